@@ -0,0 +1,185 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures server cold start: import time per module and time to first request.
+
+Each measurement runs in a fresh interpreter, as on a new Cloud Run instance.
+The report is printed as JSON. With --import-budget or
+--first-request-budget, the script exits with status 1 when startup is
+slower than the budget, so it can gate CI:
+
+    python scripts/benchmark_startup.py --import-budget 8 --first-request-budget 15
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _environment() -> dict[str, str]:
+    env = dict(os.environ)
+    src = os.path.join(ROOT, "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    return env
+
+
+def parse_importtime(output: str) -> list[dict[str, Any]]:
+    """Parses `python -X importtime` output into one record per module."""
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        name = name[1:]
+        records.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip())) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return records
+
+
+def measure_import(module: str, top: int = 15) -> dict[str, Any]:
+    """Imports `module` in a new interpreter and reports where time went."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_environment(),
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    records = parse_importtime(result.stderr)
+    top_level = sorted(
+        (record for record in records if record["depth"] == 1),
+        key=lambda record: record["cumulative_ms"],
+        reverse=True,
+    )
+    return {
+        "module": module,
+        "wall_s": round(elapsed, 3),
+        "modules": {
+            record["module"]: record["cumulative_ms"]
+            for record in records
+            if record["module"].split(".")[0] == module.split(".")[0]
+        },
+        "heaviest_imports": [
+            {"module": record["module"], "cumulative_ms": record["cumulative_ms"]}
+            for record in top_level[:top]
+        ],
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(
+    app: str = "app.server:app", path: str = "/docs", timeout: float = 120
+) -> float:
+    """Starts the server and returns the seconds until a request succeeds."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port)],
+        env=_environment(),
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with status {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=5):
+                    return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        raise TimeoutError(f"No response from {url} after {timeout} s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--module",
+        action="append",
+        help="module to time the import of (default: app.server)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per measurement; the best counts"
+    )
+    parser.add_argument(
+        "--skip-server", action="store_true", help="only measure imports"
+    )
+    parser.add_argument("--import-budget", type=float, help="seconds per import")
+    parser.add_argument(
+        "--first-request-budget", type=float, help="seconds to first request"
+    )
+    args = parser.parse_args(argv)
+
+    report: dict[str, Any] = {"imports": []}
+    for module in args.module or ["app.server"]:
+        runs = [measure_import(module) for _ in range(args.repeat)]
+        report["imports"].append(min(runs, key=lambda run: run["wall_s"]))
+    if not args.skip_server:
+        report["first_request_s"] = round(
+            min(measure_first_request() for _ in range(args.repeat)), 3
+        )
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if args.import_budget is not None:
+        failures += [
+            f"import {run['module']} took {run['wall_s']} s "
+            f"(budget {args.import_budget} s)"
+            for run in report["imports"]
+            if run["wall_s"] > args.import_budget
+        ]
+    first_request = report.get("first_request_s")
+    if args.first_request_budget is not None and first_request is not None:
+        if first_request > args.first_request_budget:
+            failures.append(
+                f"first request took {first_request} s "
+                f"(budget {args.first_request_budget} s)"
+            )
+    for failure in failures:
+        print(f"Startup budget exceeded: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
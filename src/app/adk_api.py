@@ -0,0 +1,236 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ADK's session, artifact and run endpoints on services passed in explicitly.
+
+ADK's get_fast_api_app only builds its services from URIs, so the endpoints
+the UI and API clients use are served here with the app's own session and
+artifact services, with the same paths and payloads. Routes not defined
+here, such as the dev UI, evals and /run_live, are left to ADK's app.
+"""
+
+import logging
+import os
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from google.adk.agents import RunConfig
+from google.adk.agents.run_config import StreamingMode
+from google.adk.artifacts import BaseArtifactService
+from google.adk.cli.cli_eval import EVAL_SESSION_ID_PREFIX
+from google.adk.cli.fast_api import AgentRunRequest
+from google.adk.cli.utils import envs
+from google.adk.cli.utils.agent_loader import AgentLoader
+from google.adk.events import Event
+from google.adk.runners import Runner
+from google.adk.sessions import BaseSessionService, Session
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+SESSION_PATH = "/apps/{app_name}/users/{user_id}/sessions/{session_id}"
+ARTIFACT_PATH = f"{SESSION_PATH}/artifacts/{{artifact_name}}"
+
+
+def router(
+    agents_dir: str,
+    session_service: BaseSessionService,
+    artifact_service: Callable[[], BaseArtifactService],
+) -> APIRouter:
+    """Returns the session, artifact and run endpoints on the given services.
+
+    Args:
+        agents_dir: Directory the agents are loaded from, as for ADK.
+        session_service: Keeps the sessions.
+        artifact_service: Returns the artifact service; only called once an
+            artifact endpoint or a run needs it.
+    """
+    api = APIRouter()
+    agent_loader = AgentLoader(agents_dir)
+    runners: dict[str, Runner] = {}
+
+    def get_runner(app_name: str) -> Runner:
+        if app_name not in runners:
+            envs.load_dotenv_for_agent(os.path.basename(app_name), agents_dir)
+            runners[app_name] = Runner(
+                app_name=app_name,
+                agent=agent_loader.load_agent(app_name),
+                session_service=session_service,
+                artifact_service=artifact_service(),
+            )
+        return runners[app_name]
+
+    async def require_session(app_name: str, user_id: str, session_id: str) -> None:
+        session = await session_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+    @api.get(SESSION_PATH, response_model_exclude_none=True)
+    async def get_session(app_name: str, user_id: str, session_id: str) -> Session:
+        session = await session_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return session
+
+    @api.get(
+        "/apps/{app_name}/users/{user_id}/sessions", response_model_exclude_none=True
+    )
+    async def list_sessions(app_name: str, user_id: str) -> list[Session]:
+        response = await session_service.list_sessions(
+            app_name=app_name, user_id=user_id
+        )
+        return [
+            session
+            for session in response.sessions
+            if not session.id.startswith(EVAL_SESSION_ID_PREFIX)
+        ]
+
+    @api.post(SESSION_PATH, response_model_exclude_none=True)
+    async def create_session_with_id(
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        state: dict[str, Any] | None = None,
+    ) -> Session:
+        try:
+            return await session_service.create_session(
+                app_name=app_name, user_id=user_id, state=state, session_id=session_id
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400, detail=f"Session already exists: {session_id}"
+            ) from e
+
+    @api.post(
+        "/apps/{app_name}/users/{user_id}/sessions", response_model_exclude_none=True
+    )
+    async def create_session(
+        app_name: str, user_id: str, state: dict[str, Any] | None = None
+    ) -> Session:
+        return await session_service.create_session(
+            app_name=app_name, user_id=user_id, state=state
+        )
+
+    @api.delete(SESSION_PATH)
+    async def delete_session(app_name: str, user_id: str, session_id: str) -> None:
+        await session_service.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    @api.get(ARTIFACT_PATH, response_model_exclude_none=True)
+    async def load_artifact(
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        artifact_name: str,
+        version: int | None = Query(None),
+    ) -> types.Part:
+        artifact = await artifact_service().load_artifact(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=artifact_name,
+            version=version,
+        )
+        if artifact is None:
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        return artifact
+
+    @api.get(
+        f"{ARTIFACT_PATH}/versions/{{version_id}}", response_model_exclude_none=True
+    )
+    async def load_artifact_version(
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        artifact_name: str,
+        version_id: int,
+    ) -> types.Part:
+        return await load_artifact(
+            app_name, user_id, session_id, artifact_name, version_id
+        )
+
+    @api.get(f"{SESSION_PATH}/artifacts", response_model_exclude_none=True)
+    async def list_artifact_names(
+        app_name: str, user_id: str, session_id: str
+    ) -> list[str]:
+        return await artifact_service().list_artifact_keys(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    @api.get(f"{ARTIFACT_PATH}/versions", response_model_exclude_none=True)
+    async def list_artifact_versions(
+        app_name: str, user_id: str, session_id: str, artifact_name: str
+    ) -> list[int]:
+        return await artifact_service().list_versions(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=artifact_name,
+        )
+
+    @api.delete(ARTIFACT_PATH)
+    async def delete_artifact(
+        app_name: str, user_id: str, session_id: str, artifact_name: str
+    ) -> None:
+        await artifact_service().delete_artifact(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=artifact_name,
+        )
+
+    @api.post("/run", response_model_exclude_none=True)
+    async def agent_run(req: AgentRunRequest) -> list[Event]:
+        await require_session(req.app_name, req.user_id, req.session_id)
+        runner = get_runner(req.app_name)
+        return [
+            event
+            async for event in runner.run_async(
+                user_id=req.user_id,
+                session_id=req.session_id,
+                new_message=req.new_message,
+            )
+        ]
+
+    @api.post("/run_sse")
+    async def agent_run_sse(req: AgentRunRequest) -> StreamingResponse:
+        await require_session(req.app_name, req.user_id, req.session_id)
+
+        async def event_stream() -> AsyncIterator[str]:
+            try:
+                streaming_mode = (
+                    StreamingMode.SSE if req.streaming else StreamingMode.NONE
+                )
+                async for event in get_runner(req.app_name).run_async(
+                    user_id=req.user_id,
+                    session_id=req.session_id,
+                    new_message=req.new_message,
+                    run_config=RunConfig(streaming_mode=streaming_mode),
+                ):
+                    yield f"data: {event.model_dump_json(exclude_none=True, by_alias=True)}\n\n"
+            except Exception as e:
+                logger.exception(f"Error in agent run streaming: {e}")
+                yield f'data: {{"error": "{e}"}}\n\n'
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return api
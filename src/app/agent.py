@@ -1,25 +1,25 @@
+import asyncio
 import logging
 import os
 import sys
 import uuid
-import asyncio
-
-import google
-
-from google.cloud import logging as cloud_logging
 
 from google.adk import Runner
-from google.adk.agents import SequentialAgent, LoopAgent
-from google.adk.artifacts import InMemoryArtifactService
-from google.adk.sessions import InMemorySessionService
+from google.adk.agents import LoopAgent, SequentialAgent
 
-from .sub_agents.debugging_agent import debugging_agent
+from .sessions import SqliteArtifactService, SqliteSessionService, session_store
 from .sub_agents.code_extraction_agent.agent import code_extraction_agent
+from .sub_agents.compaction_agent import RefinementCompactionAgent, agent_names
+from .sub_agents.debugging_agent import debugging_agent
 from .sub_agents.summary_agent import summary_agent
 from .sub_agents.tap_creation_agent.agent import tap_creation_agent
 from .sub_agents.validation_agent import validation_agent
-
-from .tools import _save_uploaded_image_to_state, _upload_to_gcs_and_get_url
+from .tools import (
+    _fix_extracted_code,
+    _save_uploaded_image_to_state,
+    _upload_to_gcs_and_get_url,
+)
+from .utils import cloud
 
 IS_CLOUD_RUN_ENV = os.environ.get("K_SERVICE") is not None
 
@@ -28,8 +28,13 @@ root_logger.setLevel(logging.INFO)
 
 if IS_CLOUD_RUN_ENV:
     print("Cloud Run environment detected. Using structured logging.")
-    cloud_logging_client = cloud_logging.Client()
-    cloud_logging_client.setup_logging(log_level=root_logger.level)
+    # Cloud Run collects JSON written to stdout, so no API client is needed.
+    from google.cloud.logging.handlers import StructuredLogHandler, setup_logging
+
+    setup_logging(
+        StructuredLogHandler(project_id=os.environ.get("GOOGLE_CLOUD_PROJECT")),
+        log_level=root_logger.level,
+    )
     adk_logger = logging.getLogger("google.adk")
     adk_logger.setLevel(logging.WARNING)
 else:
@@ -45,14 +50,11 @@ else:
 
 logger = logging.getLogger(__name__)
 
-_, project_id = google.auth.default()
-os.environ.setdefault("GOOGLE_CLOUD_PROJECT", project_id)
+# Only asks the default credentials when GOOGLE_CLOUD_PROJECT is not set.
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", cloud.project_id())
 os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "global")
 os.environ.setdefault("GOOGLE_GENAI_USE_VERTEXAI", "True")
 
-session_service_stateful = InMemorySessionService()
-artifact_service = InMemoryArtifactService()
-
 APP_NAME = "retro-righter"
 USER_ID = "anonymous"
 
@@ -64,6 +66,13 @@ code_refinement_loop = LoopAgent(
         debugging_agent,
     ],
     description="Iteratively validated and debugs any error in the code until the code is valid.",
+    before_agent_callback=_fix_extracted_code,
+)
+
+refinement_compaction_agent = RefinementCompactionAgent(
+    name="refinement_compaction_agent",
+    description="Replaces the refinement loop's events with a compact record.",
+    compacted_authors=agent_names(code_refinement_loop),
 )
 
 image_to_tap_agent = SequentialAgent(
@@ -71,6 +80,7 @@ image_to_tap_agent = SequentialAgent(
     sub_agents=[
         code_extraction_agent,
         code_refinement_loop,
+        refinement_compaction_agent,
         tap_creation_agent,
     ],
     before_agent_callback=_save_uploaded_image_to_state,
@@ -83,7 +93,9 @@ root_agent = SequentialAgent(
 )
 
 
-async def main():
+async def main() -> None:
+    session_service_stateful = SqliteSessionService(session_store())
+    artifact_service = SqliteArtifactService(session_store())
     session_id = str(uuid.uuid4())
     logger.info(
         f"Initializing session with ID: {session_id} for app: {APP_NAME} and user: {USER_ID}"
@@ -0,0 +1,152 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Command line tools for retro-righter.
+
+`retro-righter convert` validates and builds TAP files for text listings
+without calling a model, spreading the files over a process pool and
+printing one JSON line per file as results arrive.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from .utils import bas2tap
+
+LISTING_SUFFIXES = (".bas",)
+
+
+def find_listings(sources: Sequence[str]) -> Iterator[tuple[str, str]]:
+    """Yields (path, path relative to its source) for every listing.
+
+    Directories are walked recursively in sorted order; files named directly
+    are included whatever their suffix.
+    """
+    for source in sources:
+        if not os.path.isdir(source):
+            yield source, os.path.basename(source)
+            continue
+        for directory, subdirectories, files in os.walk(source):
+            subdirectories.sort()
+            for name in sorted(files):
+                if name.lower().endswith(LISTING_SUFFIXES):
+                    path = os.path.join(directory, name)
+                    yield path, os.path.relpath(path, source)
+
+
+def convert_file(task: tuple[str, str, str | None]) -> dict[str, Any]:
+    """Validates one listing and writes its TAP file if it compiled cleanly.
+
+    Runs in a worker process. The listing is compiled once with
+    app.utils.bas2tap, the step shared by validate_spectrum_code and
+    create_tap, so validation and TAP creation cost a single conversion.
+
+    Args:
+        task: The listing's path, its path relative to its source, and the
+            output directory, or None to write next to the listing.
+
+    Returns:
+        A JSON-serializable result for the file.
+    """
+    path, relative_path, output_dir = task
+    started = time.perf_counter()
+    result: dict[str, Any] = {"path": path, "ok": False, "tap": None}
+    try:
+        # Latin-1 maps every byte to a character, like bas2tap reading bytes.
+        with open(path, encoding="latin-1") as listing:
+            code = listing.read()
+        compilation = bas2tap.compile_listing(code)
+        if compilation.ok:
+            target = os.path.join(output_dir, relative_path) if output_dir else path
+            tap_path = os.path.splitext(target)[0] + ".tap"
+            os.makedirs(os.path.dirname(tap_path) or ".", exist_ok=True)
+            with open(tap_path, "wb") as tap_file:
+                tap_file.write(compilation.tap)
+            result.update(ok=True, tap=tap_path, size_bytes=len(compilation.tap))
+        else:
+            result["errors"] = bas2tap.parse_errors(compilation.stderr) or [
+                {"message": compilation.stderr.strip()}
+            ]
+    except Exception as e:
+        result["errors"] = [{"message": f"{type(e).__name__}: {e}"}]
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def convert(args: argparse.Namespace) -> int:
+    """Runs `retro-righter convert`, returning the exit status."""
+    tasks = [
+        (path, relative_path, args.output_dir)
+        for path, relative_path in find_listings(args.sources)
+    ]
+    workers = args.jobs or os.cpu_count() or 1
+    # Large chunks keep inter-process overhead small next to a conversion.
+    chunksize = max(1, min(256, len(tasks) // (workers * 4)))
+    started = time.perf_counter()
+    converted = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(convert_file, tasks, chunksize=chunksize):
+            if result["ok"]:
+                converted += 1
+            else:
+                failed += 1
+            print(json.dumps(result), flush=True)
+    summary = {
+        "files": len(tasks),
+        "ok": converted,
+        "failed": failed,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "workers": workers,
+    }
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Entry point for the `retro-righter` command."""
+    parser = argparse.ArgumentParser(prog="retro-righter")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser(
+        "convert",
+        help="validate .bas listings and build TAP files without a model",
+    )
+    convert_parser.add_argument(
+        "sources", nargs="+", help="listing files or directories to search"
+    )
+    convert_parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="directory for the TAP files, mirroring the source tree "
+        "(default: next to each listing)",
+    )
+    convert_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="worker processes (default: one per CPU)",
+    )
+    args = parser.parse_args(argv)
+    return convert(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
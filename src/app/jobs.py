@@ -0,0 +1,469 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batch conversion jobs backed by a durable SQLite work queue.
+
+A job is a set of uploaded images or .bas listings. Each one becomes a queue
+item that a bounded pool of workers runs through the root agent pipeline.
+Items survive restarts: anything left running by a crashed process is queued
+again when the queue starts.
+"""
+
+import asyncio
+import base64
+import contextlib
+import dataclasses
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from collections.abc import Awaitable, Callable, Iterator
+from typing import Any
+
+from google.genai import types
+
+from .utils import bas2tap
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+POLL_SECONDS = 1.0
+JOBS_USER_ID = "jobs"
+
+
+@dataclasses.dataclass(frozen=True)
+class JobItem:
+    """One uploaded file waiting to be converted."""
+
+    id: int
+    job_id: str
+    name: str
+    mime_type: str
+    payload: bytes
+
+    def content(self) -> types.Content:
+        """Returns the file as the user message for the pipeline."""
+        if self.mime_type.startswith("image/"):
+            part = types.Part.from_bytes(data=self.payload, mime_type=self.mime_type)
+        else:
+            part = types.Part(text=self.payload.decode("utf-8", errors="replace"))
+        return types.Content(role="user", parts=[part])
+
+
+@dataclasses.dataclass(frozen=True)
+class ItemResult:
+    """What the pipeline produced for one item."""
+
+    tap: bytes
+    current_code: str | None = None
+    tap_url: str | None = None
+
+
+def mime_type_for(name: str, content_type: str | None) -> str:
+    """Returns the MIME type to queue an upload as.
+
+    Raises:
+        ValueError: If the file is neither an image nor a BASIC listing.
+    """
+    if content_type and content_type.startswith("image/"):
+        return content_type
+    if name.lower().endswith((".bas", ".txt")) or (
+        content_type and content_type.startswith("text/")
+    ):
+        return "text/plain"
+    raise ValueError(f"Unsupported file '{name}': expected an image or .bas listing.")
+
+
+class JobStore:
+    """SQLite store of jobs and their items.
+
+    Finished jobs are deleted with their TAP files once they are older than
+    a TTL, when jobs are created or read.
+    """
+
+    def __init__(self, path: str, ttl: float | None = 7 * 24 * 3600) -> None:
+        """Initializes the store, creating the database if needed.
+
+        Args:
+            path: SQLite database file.
+            ttl: Seconds a job is kept after its last item finished, or None
+                to keep jobs forever. Jobs with queued or running items are
+                always kept.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS items ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT NOT NULL REFERENCES jobs(id),"
+                " position INTEGER NOT NULL,"
+                " name TEXT NOT NULL,"
+                " mime_type TEXT NOT NULL,"
+                " payload BLOB,"
+                " status TEXT NOT NULL,"
+                " error TEXT,"
+                " current_code TEXT,"
+                " tap BLOB,"
+                " tap_url TEXT,"
+                " started_at REAL,"
+                " finished_at REAL);"
+                "CREATE INDEX IF NOT EXISTS items_by_status ON items(status, id);"
+                "CREATE INDEX IF NOT EXISTS items_by_job ON items(job_id, position);"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, contextlib.closing(sqlite3.connect(self.path)) as connection:
+            with connection:
+                yield connection
+
+    def create_job(self, files: list[tuple[str, str, bytes]]) -> str:
+        """Queues a job of (name, mime type, content) files and returns its ID."""
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            self._delete_expired(connection)
+            connection.execute("INSERT INTO jobs VALUES (?, ?)", (job_id, time.time()))
+            connection.executemany(
+                "INSERT INTO items (job_id, position, name, mime_type, payload, status)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, position, name, mime_type, payload, QUEUED)
+                    for position, (name, mime_type, payload) in enumerate(files)
+                ],
+            )
+        return job_id
+
+    def claim_next(self) -> JobItem | None:
+        """Marks the oldest queued item as running and returns it."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "UPDATE items SET status = ?, started_at = ?"
+                " WHERE id = (SELECT id FROM items WHERE status = ? ORDER BY id LIMIT 1)"
+                " RETURNING id, job_id, name, mime_type, payload",
+                (RUNNING, time.time(), QUEUED),
+            ).fetchone()
+        return JobItem(*row) if row else None
+
+    def finish(self, item_id: int, result: ItemResult) -> None:
+        """Stores an item's TAP file and drops its upload."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE items SET status = ?, tap = ?, current_code = ?, tap_url = ?,"
+                " payload = NULL, finished_at = ? WHERE id = ?",
+                (
+                    DONE,
+                    result.tap,
+                    result.current_code,
+                    result.tap_url,
+                    time.time(),
+                    item_id,
+                ),
+            )
+
+    def fail(self, item_id: int, error: str) -> None:
+        """Records why an item could not be converted."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE items SET status = ?, error = ?, payload = NULL,"
+                " finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), item_id),
+            )
+
+    def requeue_running(self) -> int:
+        """Queues items left running by a stopped process again."""
+        with self._connect() as connection:
+            return connection.execute(
+                "UPDATE items SET status = ?, started_at = NULL WHERE status = ?",
+                (QUEUED, RUNNING),
+            ).rowcount
+
+    def job(self, job_id: str) -> dict[str, Any] | None:
+        """Returns a job's overall and per-item status, or None if unknown."""
+        with self._connect() as connection:
+            self._delete_expired(connection)
+            created = connection.execute(
+                "SELECT created_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if created is None:
+                return None
+            rows = connection.execute(
+                "SELECT position, name, status, error, length(tap), tap_url,"
+                " started_at, finished_at FROM items"
+                " WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        items = [
+            {
+                "position": position,
+                "name": name,
+                "status": status,
+                "error": error,
+                "tap_size_bytes": tap_size,
+                "tap_url": tap_url,
+                "started_at": started_at,
+                "finished_at": finished_at,
+            }
+            for (
+                position,
+                name,
+                status,
+                error,
+                tap_size,
+                tap_url,
+                started_at,
+                finished_at,
+            ) in rows
+        ]
+        counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+        for item in items:
+            counts[item["status"]] += 1
+        if counts[QUEUED] + counts[RUNNING] == 0:
+            status = DONE
+        elif counts[QUEUED] == len(items):
+            status = QUEUED
+        else:
+            status = RUNNING
+        return {
+            "job_id": job_id,
+            "created_at": created[0],
+            "status": status,
+            "counts": counts,
+            "items": items,
+        }
+
+    def archive(self, job_id: str) -> bytes:
+        """Returns a zip of the job's TAP files and a manifest.json."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT position, name, status, error, tap FROM items"
+                " WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        buffer = io.BytesIO()
+        manifest = []
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for position, name, status, error, tap in rows:
+                entry = {"name": name, "status": status, "error": error, "tap": None}
+                if tap is not None:
+                    stem = os.path.splitext(os.path.basename(name))[0] or "program"
+                    entry["tap"] = f"{position:04d}-{stem}.tap"
+                    archive.writestr(entry["tap"], tap)
+                manifest.append(entry)
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        return buffer.getvalue()
+
+    def _delete_expired(self, connection: sqlite3.Connection) -> None:
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        expired = (
+            "SELECT id FROM jobs WHERE created_at < ? AND NOT EXISTS ("
+            " SELECT 1 FROM items WHERE job_id = jobs.id"
+            " AND (status IN (?, ?) OR finished_at >= ?))"
+        )
+        parameters = (cutoff, QUEUED, RUNNING, cutoff)
+        connection.execute(f"DELETE FROM items WHERE job_id IN ({expired})", parameters)
+        deleted = connection.execute(
+            f"DELETE FROM jobs WHERE id IN ({expired})", parameters
+        ).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} expired job(s).")
+
+
+class JobQueue:
+    """A bounded pool of workers draining a JobStore."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        process: Callable[[JobItem], Awaitable[ItemResult]],
+        concurrency: int = 4,
+    ) -> None:
+        """Initializes the queue without starting the workers.
+
+        Args:
+            store: The durable store items are claimed from.
+            process: Converts one item, raising on failure.
+            concurrency: Number of items converted at the same time.
+        """
+        self.store = store
+        self.process = process
+        self.concurrency = concurrency
+        self._workers: list[asyncio.Task[None]] = []
+        self._wakeup: asyncio.Event | None = None
+
+    async def start(self) -> None:
+        """Requeues interrupted items and starts the workers."""
+        if self._workers:
+            return
+        requeued = await asyncio.to_thread(self.store.requeue_running)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job item(s).")
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"job-worker-{index}")
+            for index in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """Cancels the workers; running items are requeued on the next start."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, files: list[tuple[str, str, bytes]]) -> str:
+        """Queues a job and wakes the workers."""
+        job_id = await asyncio.to_thread(self.store.create_job, files)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Queued job {job_id} with {len(files)} item(s).")
+        return job_id
+
+    async def _work(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            item = await asyncio.to_thread(self.store.claim_next)
+            if item is None:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+                continue
+            # Other idle workers may find more items queued alongside this one.
+            self._wakeup.set()
+            try:
+                result = await self.process(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job item {item.id} ({item.name}) failed: {e}")
+                await asyncio.to_thread(self.store.fail, item.id, str(e))
+            else:
+                await asyncio.to_thread(self.store.finish, item.id, result)
+                logger.info(f"Job item {item.id} ({item.name}) converted.")
+
+
+_runner = None
+
+
+async def run_pipeline(item: JobItem) -> ItemResult:
+    """Runs the root agent pipeline on one item in a throwaway session.
+
+    Raises:
+        RuntimeError: If the pipeline finished without creating a TAP file.
+    """
+    global _runner
+    if _runner is None:
+        # Importing the agent authenticates with Google Cloud, so only do it
+        # once a job actually runs.
+        from google.adk import Runner
+
+        from .agent import APP_NAME, root_agent
+        from .sessions import SqliteArtifactService, SqliteSessionService, session_store
+
+        _runner = Runner(
+            agent=root_agent,
+            app_name=APP_NAME,
+            session_service=SqliteSessionService(session_store()),
+            artifact_service=SqliteArtifactService(session_store()),
+        )
+
+    from google.adk.sessions.base_session_service import GetSessionConfig
+
+    app_name = _runner.app_name
+    session = await _runner.session_service.create_session(
+        app_name=app_name, user_id=JOBS_USER_ID
+    )
+    session_id = session.id
+    try:
+        async for _ in _runner.run_async(
+            user_id=JOBS_USER_ID, session_id=session_id, new_message=item.content()
+        ):
+            pass
+        # Only the state is needed, so skip reading the event bodies back.
+        final_session = await _runner.session_service.get_session(
+            app_name=app_name,
+            user_id=JOBS_USER_ID,
+            session_id=session_id,
+            config=GetSessionConfig(num_recent_events=1),
+        )
+        state = final_session.state if final_session else {}
+        tap_file_b64 = state.get(bas2tap.TAP_STATE_KEY)
+        if not tap_file_b64:
+            raise RuntimeError("The pipeline did not create a TAP file.")
+        return ItemResult(
+            tap=base64.b64decode(tap_file_b64),
+            current_code=state.get("current_code"),
+            tap_url=state.get("tap_public_url"),
+        )
+    finally:
+        artifact_service = _runner.artifact_service
+        if artifact_service is not None:
+            for filename in await artifact_service.list_artifact_keys(
+                app_name=app_name, user_id=JOBS_USER_ID, session_id=session_id
+            ):
+                await artifact_service.delete_artifact(
+                    app_name=app_name,
+                    user_id=JOBS_USER_ID,
+                    session_id=session_id,
+                    filename=filename,
+                )
+        await _runner.session_service.delete_session(
+            app_name=app_name, user_id=JOBS_USER_ID, session_id=session_id
+        )
+
+
+_job_queue: JobQueue | None = None
+
+
+def job_queue() -> JobQueue:
+    """Returns the process-wide job queue configured from the environment.
+
+    JOBS_DB_PATH sets the database file, JOBS_TTL the seconds finished jobs
+    are kept and JOBS_CONCURRENCY the number of items converted at the same
+    time.
+    """
+    global _job_queue
+    if _job_queue is None:
+        default_path = os.path.join(
+            os.path.expanduser("~"), ".cache", "retro-righter", "jobs.sqlite3"
+        )
+        _job_queue = JobQueue(
+            JobStore(
+                os.environ.get("JOBS_DB_PATH", default_path),
+                ttl=float(os.environ.get("JOBS_TTL", str(7 * 24 * 3600))),
+            ),
+            run_pipeline,
+            concurrency=int(os.environ.get("JOBS_CONCURRENCY", "4")),
+        )
+    return _job_queue
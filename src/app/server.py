@@ -12,44 +12,133 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import functools
+import logging
 import os
+from collections.abc import AsyncIterator, Callable
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import Any
 
-import google.auth
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
-from google.adk.cli.fast_api import get_fast_api_app
-from google.cloud import logging as google_cloud_logging
+from google.adk.artifacts import BaseArtifactService, GcsArtifactService
+from google.adk.cli import fast_api
+from google.adk.sessions import BaseSessionService
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider, export
 
+from . import adk_api, jobs
+from .sessions import SqliteSessionService
+from .utils import bas2tap, cloud
 from .utils.gcs import create_bucket_if_not_exists
 from .utils.tracing import CloudTraceLoggingSpanExporter
 from .utils.typing import Feedback
 
-_, project_id = google.auth.default()
-logging_client = google_cloud_logging.Client()
-logger = logging_client.logger(__name__)
 allow_origins = (
     os.getenv("ALLOW_ORIGINS", "").split(",") if os.getenv("ALLOW_ORIGINS") else None
 )
 
-bucket_name = f"gs://{project_id}-retro-righter-logs-data"
-create_bucket_if_not_exists(
-    bucket_name=bucket_name, project=project_id, location="us-central1"
-)
-
+# The Cloud exporter is attached by the background initialization; spans
+# ended before then are not exported.
 provider = TracerProvider()
-processor = export.BatchSpanProcessor(CloudTraceLoggingSpanExporter())
-provider.add_span_processor(processor)
 trace.set_tracer_provider(provider)
 
+
+def initialize_cloud() -> None:
+    """Creates the logs bucket and starts exporting spans to Google Cloud.
+
+    These calls go over the network and need credentials, so they run in the
+    background after the server has started instead of at import or before
+    the first request.
+    """
+    bucket_name = f"gs://{cloud.logs_bucket_name()}"
+    try:
+        create_bucket_if_not_exists(
+            bucket_name=bucket_name,
+            project=cloud.project_id(),
+            location="us-central1",
+        )
+    except Exception as e:
+        logging.error(f"Failed to create bucket {bucket_name}: {e}", exc_info=True)
+    exporter = CloudTraceLoggingSpanExporter(project_id=cloud.project_id())
+    provider.add_span_processor(export.BatchSpanProcessor(exporter))
+
+
+async def _initialize_cloud_in_background() -> None:
+    try:
+        await asyncio.to_thread(initialize_cloud)
+    except Exception as e:
+        logging.error(f"Cloud initialization failed: {e}", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Runs the batch job workers and cloud setup for the lifetime of the server."""
+    initialization = asyncio.create_task(_initialize_cloud_in_background())
+    await jobs.job_queue().start()
+    try:
+        yield
+    finally:
+        await jobs.job_queue().stop()
+        await initialization
+
+
+@functools.cache
+def artifact_service() -> GcsArtifactService:
+    """Returns the artifact service on the logs bucket.
+
+    It is created on first use because the GCS client needs credentials,
+    which importing the server must not.
+    """
+    return GcsArtifactService(bucket_name=cloud.logs_bucket_name())
+
+
+def create_app(
+    agents_dir: str,
+    session_service: BaseSessionService,
+    artifact_service: Callable[[], BaseArtifactService],
+    allow_origins: list[str] | None = None,
+    lifespan: Callable[[FastAPI], AbstractAsyncContextManager[None]] | None = None,
+) -> FastAPI:
+    """Builds the app serving the agents on the given services.
+
+    ADK's get_fast_api_app only builds services from URIs and otherwise falls
+    back to in-memory sessions, which are kept until the process exits. The
+    session, artifact and run endpoints are therefore served on these
+    services instead; ADK's own app is mounted after every other route for
+    the rest (dev UI, evals, /run_live), which still use ADK's in-memory
+    services.
+
+    Args:
+        agents_dir: Directory the agents are loaded from.
+        session_service: Keeps the sessions.
+        artifact_service: Returns the artifact service when first needed.
+        allow_origins: Origins allowed to make cross-origin requests.
+        lifespan: Runs for the lifetime of the server.
+    """
+    app = FastAPI(lifespan=lifespan)
+    if allow_origins:
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=allow_origins,
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+    app.include_router(adk_api.router(agents_dir, session_service, artifact_service))
+    return app
+
+
 AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-app: FastAPI = get_fast_api_app(
+app: FastAPI = create_app(
     agents_dir=AGENT_DIR,
-    web=True,
-    artifact_service_uri=bucket_name,
+    session_service=SqliteSessionService(),
+    artifact_service=artifact_service,
     allow_origins=allow_origins,
+    lifespan=lifespan,
 )
 app.title = "retro-righter"
 app.description = "API for interacting with the Agent retro-righter"
@@ -65,18 +154,103 @@ def collect_feedback(feedback: Feedback) -> dict[str, str]:
     Returns:
         Success message
     """
-    logger.log_struct(feedback.model_dump(), severity="INFO")
+    cloud.logging_client().logger(__name__).log_struct(
+        feedback.model_dump(), severity="INFO"
+    )
     return {"status": "success"}
 
 
+@app.get("/metrics/bas2tap")
+async def bas2tap_metrics() -> dict[str, dict[str, float]]:
+    """Report bas2tap compilation cache and worker metrics.
+
+    Returns:
+        Cache hit/miss counters and worker queue depth and latency
+    """
+    return {
+        "cache": dict(bas2tap.compilation_cache.stats()),
+        "workers": bas2tap.worker_metrics(),
+    }
+
+
+@app.post("/jobs")
+async def create_job(files: list[UploadFile]) -> dict[str, Any]:
+    """Queue images and .bas listings for batch conversion.
+
+    Args:
+        files: The files to convert, one TAP file each
+
+    Returns:
+        The job ID and the number of queued items
+    """
+    queued: list[tuple[str, str, bytes]] = []
+    for upload in files:
+        name = upload.filename or f"item{len(queued)}"
+        try:
+            mime_type = jobs.mime_type_for(name, upload.content_type)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e)) from e
+        queued.append((name, mime_type, await upload.read()))
+    if not queued:
+        raise HTTPException(status_code=400, detail="No files uploaded.")
+    job_id = await jobs.job_queue().submit(queued)
+    return {"job_id": job_id, "items": len(queued)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> dict[str, Any]:
+    """Report a batch job's status and the status of each item.
+
+    Args:
+        job_id: The ID returned when the job was created
+
+    Returns:
+        Overall status, counts per status and per-item details
+    """
+    job = await asyncio.to_thread(jobs.job_queue().store.job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.get("/jobs/{job_id}/archive")
+async def get_job_archive(job_id: str) -> Response:
+    """Download the TAP files a batch job has produced so far as a zip.
+
+    Args:
+        job_id: The ID returned when the job was created
+
+    Returns:
+        A zip of the TAP files and a manifest of every item's status
+    """
+    store = jobs.job_queue().store
+    if await asyncio.to_thread(store.job, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    archive = await asyncio.to_thread(store.archive, job_id)
+    return Response(
+        content=archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.zip"'},
+    )
+
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 @app.get("/ui")
-async def read_root():
+async def read_root() -> FileResponse:
     return FileResponse("static/index.html")
 
 
+# Mounted last, as it takes every path not routed above.
+app.mount(
+    "/",
+    fast_api.get_fast_api_app(
+        agents_dir=AGENT_DIR, web=True, allow_origins=allow_origins
+    ),
+)
+
+
 # Main execution
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,837 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SQLite-backed ADK session and artifact services.
+
+Sessions, their events and their artifacts are kept in one SQLite database
+instead of process memory. Sessions idle for longer than a TTL are deleted,
+and when the stored sessions grow past a size budget the least recently
+updated ones are deleted first, so memory and disk use stay bounded however
+many sessions are opened. Event bodies are only read when a session's
+events are requested, and only the ones asked for.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from typing import Any
+
+from google.adk.artifacts import BaseArtifactService
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.genai import types
+from typing_extensions import override
+
+logger = logging.getLogger(__name__)
+
+# Artifact scope for filenames in the "user:" namespace, shared by sessions.
+USER_SCOPE = ""
+
+
+def _split_state(
+    state: dict[str, Any],
+) -> tuple[dict[str, Any], dict[str, Any], dict[str, Any]]:
+    """Splits state into session, app and user state, dropping temp keys."""
+    session_state, app_state, user_state = {}, {}, {}
+    for key, value in state.items():
+        if key.startswith(State.APP_PREFIX):
+            app_state[key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_state[key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_state[key] = value
+    return session_state, app_state, user_state
+
+
+class SessionStore:
+    """SQLite store of sessions, events and artifacts with bounded size."""
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float | None = 24 * 3600,
+        max_bytes: int | None = 256 * 1024 * 1024,
+        evict_interval: float = 10,
+    ) -> None:
+        """Initializes the store, creating the database if needed.
+
+        Args:
+            path: SQLite database file.
+            ttl: Seconds a session is kept after its last update, or None to
+                keep sessions until they are evicted for size.
+            max_bytes: Total size of stored sessions, including their events
+                and artifacts, before the least recently updated are
+                evicted, or None for no limit.
+            evict_interval: Minimum seconds between the evictions run when
+                sessions are read or written. Creating a session always
+                evicts.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.evictions = 0
+        self._last_eviction = float("-inf")
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " app_name TEXT NOT NULL,"
+                " user_id TEXT NOT NULL,"
+                " id TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_update_time REAL NOT NULL,"
+                " size_bytes INTEGER NOT NULL,"
+                " PRIMARY KEY (app_name, user_id, id));"
+                "CREATE INDEX IF NOT EXISTS sessions_by_update"
+                " ON sessions(last_update_time);"
+                "CREATE TABLE IF NOT EXISTS events ("
+                " app_name TEXT NOT NULL,"
+                " user_id TEXT NOT NULL,"
+                " session_id TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " id TEXT NOT NULL,"
+                " timestamp REAL NOT NULL,"
+                " body TEXT NOT NULL,"
+                " PRIMARY KEY (app_name, user_id, session_id, position));"
+                "CREATE TABLE IF NOT EXISTS app_states ("
+                " app_name TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS user_states ("
+                " app_name TEXT NOT NULL,"
+                " user_id TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " PRIMARY KEY (app_name, user_id));"
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                " app_name TEXT NOT NULL,"
+                " user_id TEXT NOT NULL,"
+                " scope TEXT NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " mime_type TEXT,"
+                " data BLOB,"
+                " body TEXT,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (app_name, user_id, scope, filename, version));"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, contextlib.closing(sqlite3.connect(self.path)) as connection:
+            with connection:
+                yield connection
+
+    # Sessions
+
+    def create_session(
+        self, app_name: str, user_id: str, session_id: str, state: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Stores a new session and returns its state merged with app and
+        user state.
+
+        Evicts expired and excess sessions first, so the store stays within
+        its limits as sessions are opened.
+
+        Raises:
+            ValueError: If the session already exists.
+        """
+        session_state, app_delta, user_delta = _split_state(state)
+        encoded = json.dumps(session_state)
+        now = time.time()
+        with self._connect() as connection:
+            self._evict(connection, now)
+            try:
+                connection.execute(
+                    "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (app_name, user_id, session_id, encoded, now, now, len(encoded)),
+                )
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Session {session_id} already exists.") from e
+            self._update_shared_state(
+                connection, app_name, user_id, app_delta, user_delta
+            )
+            return self._merged_state(connection, app_name, user_id, session_state)
+
+    def load_session(
+        self,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        num_recent_events: int | None = None,
+        after_timestamp: float | None = None,
+    ) -> tuple[dict[str, Any], float, list[str]] | None:
+        """Returns a session's merged state, last update time and event bodies.
+
+        Only the events selected by `num_recent_events` and `after_timestamp`
+        are read. An expired session is evicted rather than returned.
+        """
+        key = (app_name, user_id, session_id)
+        with self._connect() as connection:
+            self._evict_if_due(connection, time.time(), keep=key)
+            row = connection.execute(
+                "SELECT state, last_update_time FROM sessions"
+                " WHERE app_name = ? AND user_id = ? AND id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            query = (
+                "SELECT position, body FROM events"
+                " WHERE app_name = ? AND user_id = ? AND session_id = ?"
+            )
+            parameters: list[Any] = list(key)
+            if after_timestamp is not None:
+                query += " AND timestamp >= ?"
+                parameters.append(after_timestamp)
+            if num_recent_events:
+                query = f"SELECT * FROM ({query} ORDER BY position DESC LIMIT ?)"
+                parameters.append(num_recent_events)
+            bodies = [
+                body
+                for _, body in connection.execute(
+                    f"{query} ORDER BY position", parameters
+                )
+            ]
+            state = self._merged_state(
+                connection, app_name, user_id, json.loads(row[0])
+            )
+        return state, row[1], bodies
+
+    def list_sessions(self, app_name: str, user_id: str) -> list[tuple[str, float]]:
+        """Returns (session ID, last update time) for the user's sessions."""
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT id, last_update_time FROM sessions"
+                " WHERE app_name = ? AND user_id = ? ORDER BY created_at",
+                (app_name, user_id),
+            ).fetchall()
+
+    def delete_session(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Deletes a session with its events and session artifacts."""
+        with self._connect() as connection:
+            self._delete_sessions(connection, [(app_name, user_id, session_id)])
+
+    def append_event(
+        self,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        event_id: str,
+        timestamp: float,
+        body: str,
+        state_delta: dict[str, Any],
+    ) -> bool:
+        """Stores an event and applies its state delta.
+
+        Other sessions may be evicted to keep the store within its limits.
+
+        Returns:
+            False if the session does not exist, for example because it was
+            evicted.
+        """
+        key = (app_name, user_id, session_id)
+        session_delta, app_delta, user_delta = _split_state(state_delta)
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT state FROM sessions"
+                " WHERE app_name = ? AND user_id = ? AND id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return False
+            encoded = row[0]
+            if session_delta:
+                encoded = json.dumps({**json.loads(row[0]), **session_delta})
+            connection.execute(
+                "INSERT INTO events VALUES (?, ?, ?, (SELECT COALESCE(MAX(position)"
+                " + 1, 0) FROM events WHERE app_name = ? AND user_id = ?"
+                " AND session_id = ?), ?, ?, ?)",
+                (*key, *key, event_id, timestamp, body),
+            )
+            connection.execute(
+                "UPDATE sessions SET state = ?, last_update_time = ?,"
+                " size_bytes = size_bytes + ?"
+                " WHERE app_name = ? AND user_id = ? AND id = ?",
+                (encoded, timestamp, len(body) + len(encoded) - len(row[0]), *key),
+            )
+            self._update_shared_state(
+                connection, app_name, user_id, app_delta, user_delta
+            )
+            self._evict_if_due(connection, time.time(), keep=key)
+        return True
+
+    def delete_events(
+        self, app_name: str, user_id: str, session_id: str, event_ids: list[str]
+    ) -> None:
+        """Deletes events from a session, leaving its state as it is."""
+        key = (app_name, user_id, session_id)
+        with self._connect() as connection:
+            size = 0
+            for event_id in event_ids:
+                row = connection.execute(
+                    "DELETE FROM events WHERE app_name = ? AND user_id = ?"
+                    " AND session_id = ? AND id = ? RETURNING LENGTH(body)",
+                    (*key, event_id),
+                ).fetchone()
+                size += row[0] if row else 0
+            connection.execute(
+                "UPDATE sessions SET size_bytes = size_bytes - ?"
+                " WHERE app_name = ? AND user_id = ? AND id = ?",
+                (size, *key),
+            )
+
+    def _merged_state(
+        self,
+        connection: sqlite3.Connection,
+        app_name: str,
+        user_id: str,
+        session_state: dict[str, Any],
+    ) -> dict[str, Any]:
+        state = dict(session_state)
+        row = connection.execute(
+            "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+        ).fetchone()
+        for key, value in json.loads(row[0] if row else "{}").items():
+            state[State.APP_PREFIX + key] = value
+        row = connection.execute(
+            "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?",
+            (app_name, user_id),
+        ).fetchone()
+        for key, value in json.loads(row[0] if row else "{}").items():
+            state[State.USER_PREFIX + key] = value
+        return state
+
+    def _update_shared_state(
+        self,
+        connection: sqlite3.Connection,
+        app_name: str,
+        user_id: str,
+        app_delta: dict[str, Any],
+        user_delta: dict[str, Any],
+    ) -> None:
+        if app_delta:
+            row = connection.execute(
+                "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+            ).fetchone()
+            state = {**json.loads(row[0] if row else "{}"), **app_delta}
+            connection.execute(
+                "INSERT OR REPLACE INTO app_states VALUES (?, ?)",
+                (app_name, json.dumps(state)),
+            )
+        if user_delta:
+            row = connection.execute(
+                "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?",
+                (app_name, user_id),
+            ).fetchone()
+            state = {**json.loads(row[0] if row else "{}"), **user_delta}
+            connection.execute(
+                "INSERT OR REPLACE INTO user_states VALUES (?, ?, ?)",
+                (app_name, user_id, json.dumps(state)),
+            )
+
+    # Artifacts
+
+    def save_artifact(
+        self,
+        app_name: str,
+        user_id: str,
+        scope: str,
+        filename: str,
+        mime_type: str | None,
+        data: bytes | None,
+        body: str | None,
+    ) -> int:
+        """Stores a new version of an artifact and returns its version.
+
+        Session artifacts count towards their session's size, and other
+        sessions may be evicted to keep the store within its limits.
+        """
+        key = (app_name, user_id, scope, filename)
+        with self._connect() as connection:
+            version = connection.execute(
+                "SELECT COALESCE(MAX(version) + 1, 0) FROM artifacts"
+                " WHERE app_name = ? AND user_id = ? AND scope = ? AND filename = ?",
+                key,
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, version, mime_type, data, body, time.time()),
+            )
+            if scope != USER_SCOPE:
+                connection.execute(
+                    "UPDATE sessions SET size_bytes = size_bytes + ?"
+                    " WHERE app_name = ? AND user_id = ? AND id = ?",
+                    (len(data or body or ""), app_name, user_id, scope),
+                )
+            self._evict_if_due(connection, time.time(), keep=(app_name, user_id, scope))
+        return version
+
+    def load_artifact(
+        self,
+        app_name: str,
+        user_id: str,
+        scope: str,
+        filename: str,
+        version: int | None = None,
+    ) -> tuple[str | None, bytes | None, str | None] | None:
+        """Returns (mime type, data, body) of a version, by default the latest."""
+        query = (
+            "SELECT mime_type, data, body FROM artifacts"
+            " WHERE app_name = ? AND user_id = ? AND scope = ? AND filename = ?"
+        )
+        parameters: list[Any] = [app_name, user_id, scope, filename]
+        if version is None:
+            query += " ORDER BY version DESC LIMIT 1"
+        else:
+            query += " AND version = ?"
+            parameters.append(version)
+        with self._connect() as connection:
+            return connection.execute(query, parameters).fetchone()
+
+    def list_artifact_keys(
+        self, app_name: str, user_id: str, session_id: str
+    ) -> list[str]:
+        """Returns the filenames of a session's and its user's artifacts."""
+        with self._connect() as connection:
+            return [
+                filename
+                for (filename,) in connection.execute(
+                    "SELECT DISTINCT filename FROM artifacts WHERE app_name = ?"
+                    " AND user_id = ? AND scope IN (?, ?) ORDER BY filename",
+                    (app_name, user_id, session_id, USER_SCOPE),
+                )
+            ]
+
+    def list_versions(
+        self, app_name: str, user_id: str, scope: str, filename: str
+    ) -> list[int]:
+        """Returns the stored versions of an artifact."""
+        with self._connect() as connection:
+            return [
+                version
+                for (version,) in connection.execute(
+                    "SELECT version FROM artifacts WHERE app_name = ? AND user_id = ?"
+                    " AND scope = ? AND filename = ? ORDER BY version",
+                    (app_name, user_id, scope, filename),
+                )
+            ]
+
+    def delete_artifact(
+        self, app_name: str, user_id: str, scope: str, filename: str
+    ) -> None:
+        """Deletes every version of an artifact."""
+        key = (app_name, user_id, scope, filename)
+        with self._connect() as connection:
+            size = connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(COALESCE(data, body))), 0) FROM artifacts"
+                " WHERE app_name = ? AND user_id = ? AND scope = ? AND filename = ?",
+                key,
+            ).fetchone()[0]
+            connection.execute(
+                "DELETE FROM artifacts"
+                " WHERE app_name = ? AND user_id = ? AND scope = ? AND filename = ?",
+                key,
+            )
+            if scope != USER_SCOPE:
+                connection.execute(
+                    "UPDATE sessions SET size_bytes = size_bytes - ?"
+                    " WHERE app_name = ? AND user_id = ? AND id = ?",
+                    (size, app_name, user_id, scope),
+                )
+
+    # Eviction
+
+    def evict(self) -> int:
+        """Deletes expired sessions and the least recently updated ones over
+        the size limit, returning how many were deleted."""
+        with self._connect() as connection:
+            return self._evict(connection, time.time())
+
+    def _evict_if_due(
+        self,
+        connection: sqlite3.Connection,
+        now: float,
+        keep: tuple[str, str, str],
+    ) -> None:
+        if now - self._last_eviction >= self.evict_interval:
+            self._evict(connection, now, keep)
+
+    def _evict(
+        self,
+        connection: sqlite3.Connection,
+        now: float,
+        keep: tuple[str, str, str] | None = None,
+    ) -> int:
+        # `keep` is the session being read or written: it is evicted when it
+        # has expired, but never to make room.
+        self._last_eviction = now
+        victims = []
+        if self.ttl is not None:
+            victims += connection.execute(
+                "SELECT app_name, user_id, id FROM sessions WHERE last_update_time < ?",
+                (now - self.ttl,),
+            ).fetchall()
+            connection.execute(
+                "DELETE FROM artifacts WHERE scope = ? AND created_at < ?",
+                (USER_SCOPE, now - self.ttl),
+            )
+        if self.max_bytes is not None:
+            victims += [
+                victim
+                for victim in connection.execute(
+                    "SELECT app_name, user_id, id FROM (SELECT app_name, user_id, id,"
+                    " last_update_time, SUM(size_bytes) OVER (ORDER BY"
+                    " last_update_time DESC, rowid DESC) AS total FROM sessions)"
+                    " WHERE total > ? AND last_update_time >= ?",
+                    (self.max_bytes, now - self.ttl if self.ttl is not None else 0),
+                )
+                if victim != keep
+            ]
+        if victims:
+            self._delete_sessions(connection, victims)
+            self.evictions += len(victims)
+            logger.info(f"Evicted {len(victims)} sessions from {self.path}.")
+        return len(victims)
+
+    def _delete_sessions(
+        self, connection: sqlite3.Connection, keys: list[tuple[str, str, str]]
+    ) -> None:
+        connection.executemany(
+            "DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", keys
+        )
+        connection.executemany(
+            "DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?",
+            keys,
+        )
+        connection.executemany(
+            "DELETE FROM artifacts WHERE app_name = ? AND user_id = ? AND scope = ?",
+            keys,
+        )
+
+    def stats(self) -> dict[str, int]:
+        """Returns the number and total size of stored sessions and evictions."""
+        with self._connect() as connection:
+            sessions, size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM sessions"
+            ).fetchone()
+        return {"sessions": sessions, "size_bytes": size, "evictions": self.evictions}
+
+
+class SqliteSessionService(BaseSessionService):
+    """Session service that keeps sessions in a SessionStore.
+
+    ADK's runner reads sessions without a GetSessionConfig, so a session is
+    read with at most `max_events` of its most recent events unless the
+    config asks for a number itself. Earlier events stay stored but are not
+    seen by the agents; compaction keeps sessions well below the default.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore | None = None,
+        max_events: int | None = None,
+    ) -> None:
+        """Initializes the service.
+
+        Args:
+            store: Where to keep sessions; by default the process-wide
+                session_store(), opened on first use.
+            max_events: Most recent events read when the config does not set
+                num_recent_events, or 0 for all; by default
+                SESSION_MAX_EVENTS, or 500.
+        """
+        self._store = store
+        self.max_events = (
+            int(os.environ.get("SESSION_MAX_EVENTS", "500"))
+            if max_events is None
+            else max_events
+        )
+
+    @property
+    def store(self) -> SessionStore:
+        if self._store is None:
+            self._store = session_store()
+        return self._store
+
+    @override
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: dict[str, Any] | None = None,
+        session_id: str | None = None,
+    ) -> Session:
+        session_id = (
+            session_id.strip()
+            if session_id and session_id.strip()
+            else str(uuid.uuid4())
+        )
+        merged_state = await asyncio.to_thread(
+            self.store.create_session, app_name, user_id, session_id, state or {}
+        )
+        return Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=merged_state,
+            last_update_time=time.time(),
+        )
+
+    @override
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: GetSessionConfig | None = None,
+    ) -> Session | None:
+        loaded = await asyncio.to_thread(
+            self.store.load_session,
+            app_name,
+            user_id,
+            session_id,
+            (config.num_recent_events if config else None) or self.max_events,
+            config.after_timestamp if config else None,
+        )
+        if loaded is None:
+            return None
+        state, last_update_time, bodies = loaded
+        return Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=state,
+            events=[Event.model_validate_json(body) for body in bodies],
+            last_update_time=last_update_time,
+        )
+
+    @override
+    async def list_sessions(
+        self, *, app_name: str, user_id: str
+    ) -> ListSessionsResponse:
+        rows = await asyncio.to_thread(self.store.list_sessions, app_name, user_id)
+        return ListSessionsResponse(
+            sessions=[
+                Session(
+                    app_name=app_name,
+                    user_id=user_id,
+                    id=session_id,
+                    last_update_time=last_update_time,
+                )
+                for session_id, last_update_time in rows
+            ]
+        )
+
+    @override
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        await asyncio.to_thread(
+            self.store.delete_session, app_name, user_id, session_id
+        )
+
+    @override
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        stored = await asyncio.to_thread(
+            self.store.append_event,
+            session.app_name,
+            session.user_id,
+            session.id,
+            event.id,
+            event.timestamp,
+            event.model_dump_json(exclude_none=True),
+            event.actions.state_delta if event.actions else {},
+        )
+        if not stored:
+            logger.warning(
+                f"Failed to append event to session {session.id}: session not found"
+            )
+        return event
+
+    async def delete_events(self, session: Session, event_ids: list[str]) -> None:
+        """Deletes events from `session` and its stored copy, as in compaction.
+
+        The session's state is left as it is.
+        """
+        deleted = set(event_ids)
+        session.events[:] = [
+            event for event in session.events if event.id not in deleted
+        ]
+        await asyncio.to_thread(
+            self.store.delete_events,
+            session.app_name,
+            session.user_id,
+            session.id,
+            event_ids,
+        )
+
+
+class SqliteArtifactService(BaseArtifactService):
+    """Artifact service that keeps artifacts in a SessionStore.
+
+    Inline data is stored as raw bytes rather than base64, and session
+    artifacts are deleted with their session.
+    """
+
+    def __init__(self, store: SessionStore | None = None) -> None:
+        """Initializes the service.
+
+        Args:
+            store: Where to keep artifacts; by default the process-wide
+                session_store(), opened on first use.
+        """
+        self._store = store
+
+    @property
+    def store(self) -> SessionStore:
+        if self._store is None:
+            self._store = session_store()
+        return self._store
+
+    @staticmethod
+    def _scope(session_id: str, filename: str) -> str:
+        return USER_SCOPE if filename.startswith("user:") else session_id
+
+    @override
+    async def save_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        artifact: types.Part,
+    ) -> int:
+        inline_data = artifact.inline_data
+        if inline_data is not None and inline_data.data is not None:
+            mime_type, data, body = inline_data.mime_type, inline_data.data, None
+        else:
+            mime_type, data = None, None
+            body = artifact.model_dump_json(exclude_none=True)
+        return await asyncio.to_thread(
+            self.store.save_artifact,
+            app_name,
+            user_id,
+            self._scope(session_id, filename),
+            filename,
+            mime_type,
+            data,
+            body,
+        )
+
+    @override
+    async def load_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        version: int | None = None,
+    ) -> types.Part | None:
+        row = await asyncio.to_thread(
+            self.store.load_artifact,
+            app_name,
+            user_id,
+            self._scope(session_id, filename),
+            filename,
+            version,
+        )
+        if row is None:
+            return None
+        mime_type, data, body = row
+        if data is not None:
+            return types.Part.from_bytes(data=data, mime_type=mime_type or "")
+        if body is None:
+            raise ValueError(f"Artifact {filename} has neither data nor a body.")
+        return types.Part.model_validate_json(body)
+
+    @override
+    async def list_artifact_keys(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> list[str]:
+        return await asyncio.to_thread(
+            self.store.list_artifact_keys, app_name, user_id, session_id
+        )
+
+    @override
+    async def delete_artifact(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> None:
+        await asyncio.to_thread(
+            self.store.delete_artifact,
+            app_name,
+            user_id,
+            self._scope(session_id, filename),
+            filename,
+        )
+
+    @override
+    async def list_versions(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> list[int]:
+        return await asyncio.to_thread(
+            self.store.list_versions,
+            app_name,
+            user_id,
+            self._scope(session_id, filename),
+            filename,
+        )
+
+
+_session_store: SessionStore | None = None
+
+
+def session_store() -> SessionStore:
+    """Returns the process-wide store configured from the environment.
+
+    SESSION_DB_PATH sets the database file, SESSION_TTL the seconds a session
+    is kept after its last update and SESSION_DB_MAX_BYTES the size budget.
+    """
+    global _session_store
+    if _session_store is None:
+        default_path = os.path.join(
+            os.path.expanduser("~"), ".cache", "retro-righter", "sessions.sqlite3"
+        )
+        _session_store = SessionStore(
+            path=os.environ.get("SESSION_DB_PATH", default_path),
+            ttl=float(os.environ.get("SESSION_TTL", str(24 * 3600))),
+            max_bytes=int(
+                os.environ.get("SESSION_DB_MAX_BYTES", str(256 * 1024 * 1024))
+            ),
+        )
+    return _session_store
@@ -1,13 +1,98 @@
-from google.adk.agents import LlmAgent
+import logging
+import os
+from collections.abc import AsyncGenerator
+from typing import Any
 
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from typing_extensions import override
+
+from ...utils import listing
 from . import prompt
+from .tools import (
+    MODEL,
+    cache_extraction,
+    extract_pieces,
+    is_image,
+    preprocess_images,
+    split_pages,
+    use_cached_extraction,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CodeExtractionAgent(BaseAgent):
+    """Extracts the listing piece by piece with concurrent model calls.
+
+    Each image in the user's message is treated as a page, and pages much
+    taller than they are wide are split into overlapping strips at the gaps
+    between lines. Every piece is extracted with its own model call and the
+    listings are merged by line number into state['current_code']. This is
+    only done with EXTRACTION_MODE=pages: by default, and for a single piece
+    or text-only input, everything is handed to the LLM code extraction
+    agent, the first sub-agent, which reads it in one call.
+    """
+
+    @property
+    def llm_agent(self) -> LlmAgent:
+        """The LLM code extraction agent, the first sub-agent."""
+        agent = self.sub_agents[0]
+        if not isinstance(agent, LlmAgent):
+            raise TypeError(f"{agent.name} is not an LlmAgent.")
+        return agent
 
-MODEL = "gemini-2.5-flash"
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        parts = ctx.user_content.parts if ctx.user_content else None
+        pages = [part for part in parts or [] if is_image(part)]
+        state_delta: dict[str, Any] = {}
+        pieces: list[types.Part] = []
+        overlaps: list[bool] = []
+        if pages and os.environ.get("EXTRACTION_MODE", "single") == "pages":
+            for page_pieces in await split_pages(pages, state_delta):
+                pieces += page_pieces
+                overlaps += [index > 0 for index in range(len(page_pieces))]
+        if len(pieces) < 2:
+            async for event in self.llm_agent.run_async(ctx):
+                yield event
+            return
 
-code_extraction_agent = LlmAgent(
+        logger.info(
+            f"Extracting {len(pieces)} pieces of {len(pages)} page(s) concurrently."
+        )
+        context_parts = [part for part in parts or [] if part.text]
+        listings = await extract_pieces(
+            self.llm_agent.canonical_model, pieces, context_parts
+        )
+        current_code = listing.merge_listings(listings, overlaps)
+        state_delta["current_code"] = current_code
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=current_code)]),
+            actions=EventActions(state_delta=state_delta),
+        )
+
+
+llm_code_extraction_agent = LlmAgent(
     model=MODEL,
-    name="code_extraction_agent",
+    name="llm_code_extraction_agent",
     description="Code extraction agent for extracting ZX Spectrum code from images and input text",
     instruction=prompt.CODE_EXTRACTION_PROMPT,
     output_key="current_code",
+    before_model_callback=preprocess_images,
+)
+
+code_extraction_agent = CodeExtractionAgent(
+    name="code_extraction_agent",
+    description="Code extraction agent for extracting ZX Spectrum code from images and input text",
+    sub_agents=[llm_code_extraction_agent],
+    before_agent_callback=use_cached_extraction,
+    after_agent_callback=cache_extraction,
 )
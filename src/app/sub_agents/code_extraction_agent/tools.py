@@ -0,0 +1,270 @@
+"""
+Tools for code extraction agent
+
+This module provides callbacks that serve repeat uploads from the extraction
+cache instead of calling the model and shrink the images sent to the model,
+and the concurrent extraction of pages and strips.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest
+from google.adk.sessions.state import State
+from google.genai import types
+
+from ...utils import image_preprocessing
+from ...utils.image_cache import get_extraction_cache
+from . import prompt
+
+logger = logging.getLogger(__name__)
+
+MODEL = "gemini-2.5-flash"
+
+# Cached listings are only reused while the model and prompt that produced
+# them are unchanged.
+PROMPT_VERSION = (
+    f"{MODEL}:"
+    f"{hashlib.sha256(prompt.CODE_EXTRACTION_PROMPT.encode('utf-8')).hexdigest()[:12]}"
+)
+
+
+async def use_cached_extraction(
+    callback_context: CallbackContext,
+) -> types.Content | None:
+    """Serves the extracted code from the cache, skipping the agent.
+
+    Used as the code extraction agent's before_agent_callback. On a hit for
+    state['uploaded_image_hash'] the cached listing is saved to
+    state['current_code'] and returned as the agent's response. The SQLite
+    lookup runs in a worker thread.
+
+    Args:
+        callback_context: The context containing state with
+            'uploaded_image_hash'.
+
+    Returns:
+        The cached code as the agent's response, or None to run the agent.
+    """
+    state = callback_context.state
+    image_hash = state.get("uploaded_image_hash")
+    if not image_hash:
+        return None
+
+    cache = get_extraction_cache()
+    current_code = await asyncio.to_thread(cache.get, image_hash, PROMPT_VERSION)
+    if current_code is None:
+        logger.info(f"Extraction cache miss for image {image_hash}.")
+        return None
+
+    logger.info(f"Extraction cache hit for image {image_hash}: {cache.stats()}")
+    state["current_code"] = current_code
+    return types.Content(role="model", parts=[types.Part(text=current_code)])
+
+
+async def cache_extraction(callback_context: CallbackContext) -> None:
+    """Stores the code the agent extracted for the uploaded image.
+
+    Used as the code extraction agent's after_agent_callback, so it only runs
+    when the model was actually called. The SQLite write runs in a worker
+    thread.
+
+    Args:
+        callback_context: The context containing state with
+            'uploaded_image_hash' and 'current_code'.
+    """
+    state = callback_context.state
+    image_hash = state.get("uploaded_image_hash")
+    current_code = state.get("current_code")
+    if not image_hash or not current_code:
+        return None
+
+    await asyncio.to_thread(
+        get_extraction_cache().put, image_hash, PROMPT_VERSION, current_code
+    )
+    logger.info(f"Cached extracted code for image {image_hash}.")
+    return None
+
+
+async def preprocess_images(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> None:
+    """Replaces the request's images with their preprocessed versions.
+
+    Used as the code extraction agent's before_model_callback. Each image is
+    deskewed, cropped, converted and downsampled off the event loop per
+    PreprocessingOptions.from_env(), and the byte and estimated token savings
+    are recorded in state['image_preprocessing'].
+
+    Args:
+        callback_context: The context whose state receives the report.
+        llm_request: The request about to be sent to the model.
+    """
+    options = image_preprocessing.PreprocessingOptions.from_env()
+    if not options.enabled:
+        return None
+
+    report = _new_report()
+    for content in llm_request.contents:
+        parts = content.parts or []
+        for i, part in enumerate(parts):
+            if is_image(part):
+                parts[i] = await _preprocess_part(part, options, report)
+    _record_report(callback_context.state, report)
+    return None
+
+
+async def split_pages(
+    pages: list[types.Part], state: State | dict[str, Any]
+) -> list[list[types.Part]]:
+    """Preprocesses each page and splits tall ones into overlapping strips.
+
+    Args:
+        pages: The image parts, one per page, in reading order.
+        state: Session state or a state delta, receiving the preprocessing
+            report.
+
+    Returns:
+        The pieces to extract separately for each page, in reading order.
+        The strips of a page overlap; pages do not.
+    """
+    options = image_preprocessing.PreprocessingOptions.from_env()
+    report = _new_report()
+
+    async def split(page: types.Part) -> list[types.Part]:
+        page = await _preprocess_part(page, options, report)
+        data, _ = image_data(page)
+        strips = await asyncio.to_thread(
+            image_preprocessing.split_into_strips, data, options
+        )
+        if len(strips) == 1:
+            return [page]
+        return [
+            types.Part.from_bytes(data=strip, mime_type="image/png") for strip in strips
+        ]
+
+    pieces = await asyncio.gather(*(split(page) for page in pages))
+    _record_report(state, report)
+    return list(pieces)
+
+
+async def extract_pieces(
+    llm: BaseLlm, pieces: list[types.Part], context_parts: list[types.Part]
+) -> list[str]:
+    """Extracts the listing from each piece with concurrent model calls.
+
+    Each page or strip is sent in a request of its own, alongside any text
+    the user sent, so the wall-clock time is that of the slowest piece and
+    each call reads only a few dozen lines. At most
+    EXTRACTION_MAX_CONCURRENCY (default 4) calls run at once.
+
+    Args:
+        llm: The model the code extraction agent uses.
+        pieces: The image parts from split_pages(), in reading order.
+        context_parts: Non-image parts of the user's message.
+
+    Returns:
+        The listing extracted from each piece, in reading order.
+    """
+    semaphore = asyncio.Semaphore(
+        int(os.environ.get("EXTRACTION_MAX_CONCURRENCY", "4"))
+    )
+
+    async def extract(number: int, piece: types.Part) -> str:
+        async with semaphore:
+            llm_request = LlmRequest(
+                model=MODEL,
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[
+                            *context_parts,
+                            types.Part(
+                                text=f"Part {number} of {len(pieces)} of the "
+                                "listing. Lines cut off at the top or bottom edge "
+                                "may be partial; transcribe what is visible."
+                            ),
+                            piece,
+                        ],
+                    )
+                ],
+                config=types.GenerateContentConfig(
+                    system_instruction=prompt.CODE_EXTRACTION_PROMPT
+                ),
+            )
+            texts: list[str] = []
+            async for llm_response in llm.generate_content_async(llm_request):
+                if llm_response.content and llm_response.content.parts:
+                    texts.extend(
+                        part.text
+                        for part in llm_response.content.parts
+                        if part.text and not part.thought
+                    )
+            logger.info(f"Extracted part {number} of {len(pieces)}.")
+            return "".join(texts)
+
+    listings = await asyncio.gather(
+        *(extract(number, piece) for number, piece in enumerate(pieces, start=1))
+    )
+    return list(listings)
+
+
+def is_image(part: types.Part) -> bool:
+    """Returns whether a part carries inline image data."""
+    blob = part.inline_data
+    return bool(blob and blob.data and (blob.mime_type or "").startswith("image/"))
+
+
+def image_data(part: types.Part) -> tuple[bytes, str]:
+    """Returns the data and MIME type of a part that is_image()."""
+    blob = part.inline_data
+    if blob is None or blob.data is None or blob.mime_type is None:
+        raise ValueError("Part has no inline image data.")
+    return blob.data, blob.mime_type
+
+
+def _new_report() -> dict[str, int]:
+    return {
+        "images": 0,
+        "original_bytes": 0,
+        "bytes": 0,
+        "original_tokens": 0,
+        "tokens": 0,
+    }
+
+
+async def _preprocess_part(
+    part: types.Part,
+    options: image_preprocessing.PreprocessingOptions,
+    report: dict[str, int],
+) -> types.Part:
+    """Preprocesses one image part off the event loop, updating the report."""
+    if not options.enabled:
+        return part
+    data, mime_type = image_data(part)
+    image = await asyncio.to_thread(
+        image_preprocessing.preprocess, data, mime_type, options
+    )
+    report["images"] += 1
+    report["original_bytes"] += image.original_bytes
+    report["bytes"] += len(image.data)
+    report["original_tokens"] += image.original_tokens
+    report["tokens"] += image.tokens
+    if image.data == data:
+        return part
+    return types.Part.from_bytes(data=image.data, mime_type=image.mime_type)
+
+
+def _record_report(state: State | dict[str, Any], report: dict[str, int]) -> None:
+    if not report["images"]:
+        return
+    state["image_preprocessing"] = report
+    logger.info(
+        f"Preprocessed {report['images']} image(s): "
+        f"{report['original_bytes'] - report['bytes']} bytes and "
+        f"~{report['original_tokens'] - report['tokens']} input tokens saved."
+    )
@@ -0,0 +1,3 @@
+from .agent import RefinementCompactionAgent, agent_names
+
+__all__ = ["RefinementCompactionAgent", "agent_names"]
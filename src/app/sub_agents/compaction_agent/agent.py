@@ -0,0 +1,147 @@
+import logging
+from collections.abc import AsyncGenerator, Sequence
+from typing import Any
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from pydantic import Field
+from typing_extensions import override
+
+from ...sessions import SqliteSessionService
+from ...utils import code_state
+
+logger = logging.getLogger(__name__)
+
+
+def agent_names(agent: BaseAgent) -> list[str]:
+    """Returns the names of an agent and all of its descendants."""
+    return [agent.name] + [
+        name for sub_agent in agent.sub_agents for name in agent_names(sub_agent)
+    ]
+
+
+def build_record(
+    events: Sequence[Event], initial_code: str | None, final_code: str
+) -> dict[str, Any]:
+    """Summarizes the refinement loop's events.
+
+    Each iteration keeps the validation errors that started it and the
+    patch of lines the debugging agent changed for them.
+
+    Args:
+        events: The loop's events in order.
+        initial_code: The code the loop started from, if known.
+        final_code: The code the loop finished with.
+    """
+    iterations: list[dict[str, Any]] = []
+    valid = False
+    for event in events:
+        state_delta = event.actions.state_delta
+        errors = state_delta.get("validation_errors")
+        if errors:
+            iterations.append({"errors": errors, "diff": None})
+        if event.actions.escalate:
+            valid = True
+        patch = code_state.recorded_patch(state_delta)
+        if patch is not None:
+            if not iterations:
+                iterations.append({"errors": None, "diff": None})
+            iterations[-1]["diff"] = code_state.describe_patch(patch)
+    return {
+        "initial_code": initial_code,
+        "iterations": iterations,
+        "final_code": final_code,
+        "valid": valid,
+    }
+
+
+def render_record(record: dict[str, Any]) -> str:
+    """Formats a refinement record as the text of the compacted event."""
+    iterations = record["iterations"]
+    status = "the final code is valid" if record["valid"] else "validation failed"
+    sections = [f"Code refinement loop: {len(iterations)} iteration(s), {status}."]
+    if record["initial_code"] is not None:
+        sections.append(f"Initial code:\n{record['initial_code']}")
+    for number, iteration in enumerate(iterations, start=1):
+        errors = iteration["errors"]
+        if isinstance(errors, list):
+            errors = "\n".join(
+                f"- {error['message'] if isinstance(error, dict) else error}"
+                for error in errors
+            )
+        if errors:
+            sections.append(f"Iteration {number} errors:\n{errors}")
+        if iteration["diff"] is not None:
+            sections.append(
+                f"Iteration {number} changes:\n{iteration['diff'] or '(none)'}"
+            )
+    sections.append(f"Final code:\n{record['final_code']}")
+    return "\n\n".join(sections)
+
+
+class RefinementCompactionAgent(BaseAgent):
+    """Replaces the refinement loop's events with one compact record.
+
+    Later LLM agents are sent the whole history, one or more events for
+    every loop iteration. Once the loop has exited, its events in this
+    invocation are deleted through SqliteSessionService.delete_events(), and
+    a single event with the initial code, each iteration's errors and
+    changed lines, and the final code takes their place. Other session
+    services cannot delete events, so with them the loop's events are kept.
+    Either way the last event materializes the loop's line patches into
+    state['current_code'] for the stages after the loop.
+    """
+
+    compacted_authors: list[str] = Field(default_factory=list)
+    """Names of the agents whose events are compacted."""
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        state_delta: dict[str, Any] = {}
+        initial_code = state.get(code_state.CODE_STATE_KEY)
+        final_code = code_state.materialize(state_delta, state)
+        loop_events = [
+            event
+            for event in ctx.session.events
+            if event.invocation_id == ctx.invocation_id
+            and event.author in self.compacted_authors
+        ]
+        service = ctx.session_service
+        if not loop_events or not isinstance(service, SqliteSessionService):
+            if loop_events:
+                logger.warning(
+                    f"{type(service).__name__} cannot delete events; "
+                    "the refinement events are not compacted."
+                )
+            if state_delta:
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    actions=EventActions(state_delta=state_delta),
+                )
+            return
+
+        record = build_record(loop_events, initial_code, final_code)
+
+        event_ids = [event.id for event in loop_events]
+        await service.delete_events(ctx.session, event_ids)
+        logger.info(
+            f"Compacted {len(event_ids)} refinement events into one "
+            f"({len(record['iterations'])} iteration(s))."
+        )
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(
+                role="model", parts=[types.Part(text=render_record(record))]
+            ),
+            actions=EventActions(state_delta=state_delta),
+        )
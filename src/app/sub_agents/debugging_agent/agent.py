@@ -1,14 +1,118 @@
+import logging
+import os
+from collections.abc import Mapping
+from typing import Any
+
 from google.adk.agents import Agent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.models import LlmResponse
+from google.adk.sessions.state import State
+from google.genai import types
 
+from ...utils import basic_fixes, code_state
 from . import prompt
 
+logger = logging.getLogger(__name__)
+
 MODEL = "gemini-2.5-flash"
 
+# Past this share of the listing, the whole listing is sent instead.
+TARGETED_MAX_FRACTION = 0.5
+
+
+def targeted_lines(state: State | Mapping[str, Any]) -> list[int] | None:
+    """Returns the line numbers to send for targeted debugging.
+
+    These are the lines bas2tap reported errors in with their context and
+    jump targets, as selected by code_state.excerpt_lines, with
+    DEBUGGING_CONTEXT_LINES lines either side. Returns None when the whole
+    listing should be sent: with DEBUGGING_MODE=full, when an error has no
+    line in the listing, when the listing has unnumbered lines, or when the
+    excerpt would be more than half of it.
+    """
+    if os.environ.get("DEBUGGING_MODE", "targeted") != "targeted":
+        return None
+    errors = state.get("validation_errors")
+    if not errors or not isinstance(errors, list):
+        return None
+    table = code_state.line_table(code_state.current_code(state))
+    if table is None:
+        return None
+    numbers: set[int] = set()
+    for error in errors:
+        if not isinstance(error, dict):
+            continue
+        number = error.get("line")
+        if not isinstance(number, int) or number not in table:
+            return None
+        numbers.add(number)
+    if not numbers:
+        return None
+    context = int(os.environ.get("DEBUGGING_CONTEXT_LINES", "2"))
+    lines = code_state.excerpt_lines(table, numbers, context)
+    if len(lines) > len(table) * TARGETED_MAX_FRACTION:
+        return None
+    return lines
+
+
+async def debugging_instruction(context: ReadonlyContext) -> str:
+    """Builds the targeted prompt when possible, else the full one."""
+    state = context.state
+    current_code = code_state.current_code(state)
+    lines = targeted_lines(state)
+    if lines is None:
+        return await code_state.fill_instruction(
+            prompt.DEBUGGING_PROMPT, context, {code_state.CODE_STATE_KEY: current_code}
+        )
+    table = code_state.line_table(current_code) or {}
+    excerpt = "\n".join(table[number] for number in lines)
+    return await code_state.fill_instruction(
+        prompt.TARGETED_DEBUGGING_PROMPT, context, {"code_excerpt": excerpt}
+    )
+
+
+def record_debugged_code(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> LlmResponse | None:
+    """Records the corrected listing as a patch of the lines that changed.
+
+    In targeted mode the response holds only the corrected lines, which are
+    spliced into the listing by line number. app.utils.basic_fixes is then
+    applied, so mechanical mistakes in the model's output do not cost
+    another loop iteration; the extracted code is fixed once before the
+    loop by the loop's before_agent_callback. The response is replaced by a
+    description of the patch, so the event keeps the changed lines instead
+    of another copy of the whole listing.
+    """
+    content = llm_response.content
+    if llm_response.partial or not content or not content.parts:
+        return None
+    code = "".join(part.text or "" for part in content.parts)
+    if not code.strip():
+        return None
+    state = callback_context.state
+    if targeted_lines(state) is not None:
+        spliced = code_state.splice(code_state.current_code(state), code)
+        if spliced is None:
+            logger.warning("Targeted debugging returned unnumbered lines; ignored.")
+            return _with_text(llm_response, "No lines changed: unnumbered output.")
+        code = spliced
+    code = basic_fixes.fix_listing(code)
+    patch = code_state.record_code(state, state, code)
+    return _with_text(llm_response, code_state.describe_patch(patch))
+
+
+def _with_text(llm_response: LlmResponse, text: str) -> LlmResponse:
+    content = types.Content(role="model", parts=[types.Part(text=text)])
+    return llm_response.model_copy(update={"content": content})
+
+
 debugging_agent = Agent(
     model=MODEL,
     name="debugging_agent",
     description="Debugging agent for ZX Spectrum code",
-    instruction=prompt.DEBUGGING_PROMPT,
-    output_key="current_code",
+    instruction=debugging_instruction,
+    after_model_callback=record_debugged_code,
     tools=[],
 )
@@ -10,7 +10,7 @@ You are a highly capable session summary agent for the ZX Spectrum BASIC code pr
 (This is the final, validated, and debugged ZX Spectrum BASIC code that was used to create the TAP file.)
 
 **2. Session History Log:**
-(This is a chronological record of the key events, validation attempts, error messages, and debugging actions that occurred during the session. It provides the context for 'what happened'.)
+(This is a chronological record of the key events, validation attempts, error messages, and debugging actions that occurred during the session. It provides the context for 'what happened'. The validation and debugging iterations are condensed into one record listing the initial code, each iteration's errors and line-level changes, and the final code.)
 
 **3. Final TAP File Public URL:**
 {tap_public_url}
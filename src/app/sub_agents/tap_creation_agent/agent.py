@@ -1,15 +1,67 @@
-from google.adk.agents import Agent
+import os
+from collections.abc import AsyncGenerator
+from typing import Any
 
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from typing_extensions import override
+
+from ...utils import bas2tap
 from . import prompt
-from .tools import create_tap
+from .tools import compile_tap, create_tap, publish_tap, publish_validated_tap
 
 MODEL = "gemini-2.5-flash"
 
-tap_creation_agent = Agent(
+
+class TapCreationAgent(BaseAgent):
+    """Builds the TAP file for state['current_code'] without calling a model.
+
+    Publishes the TAP file compiled during validation when there is one, and
+    compiles the code otherwise, writing the same state keys as create_tap.
+    """
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        current_code = state.get("current_code", "")
+        state_delta: dict[str, Any] = {}
+
+        tap_bytes = bas2tap.load_tap(state, current_code)
+        if tap_bytes is None:
+            tap_bytes = await compile_tap(current_code)
+            bas2tap.store_tap(state_delta, current_code, tap_bytes)
+        tap_file_name = publish_tap(state_delta, tap_bytes)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=tap_file_name)]),
+            actions=EventActions(state_delta=state_delta),
+        )
+
+
+llm_tap_creation_agent = Agent(
     name="tap_generation_agent",
     model=MODEL,
     description="Tap creation agent for ZX Spectrum code",
     instruction=prompt.TAP_CREATION_PROMPT,
     tools=[create_tap],
-    output_key="tap_file_path",
+    output_key="tap_file_name",
+    before_agent_callback=publish_validated_tap,
+)
+
+deterministic_tap_creation_agent = TapCreationAgent(
+    name="tap_generation_agent",
+    description="Tap creation agent for ZX Spectrum code",
 )
+
+# TAP_CREATION_AGENT=llm selects the model-driven agent, e.g. for parity tests.
+if os.environ.get("TAP_CREATION_AGENT", "deterministic") == "llm":
+    tap_creation_agent: BaseAgent = llm_tap_creation_agent
+else:
+    tap_creation_agent = deterministic_tap_creation_agent
@@ -4,81 +4,116 @@ Tools for tap creation agent
 This module provides tools for creating TAP files.
 """
 
-import subprocess
-import tempfile
-import os
 import logging
+from typing import Any
 
-from google.cloud import storage
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.sessions.state import State
+from google.adk.tools import ToolContext
+from google.genai import types
+
+from ...utils import bas2tap, gcs
 
 logger = logging.getLogger(__name__)
 
 
-def create_tap(current_code: str) -> dict[str, str]:
+async def create_tap(current_code: str, tool_context: ToolContext) -> dict[str, Any]:
     """Creates a TAP file from Spectrum BASIC code.
 
-    This function takes a string of Spectrum BASIC code, writes it to a temporary
-    file with a .bas extension, and then uses the `bas2tap` command-line tool
-    to convert it into a TAP file. The path to the resulting TAP file is returned.
-
-    The caller is responsible for deleting the created TAP file when it's no
-    longer needed.
+    If the validation stage already compiled this exact code its TAP file is
+    published as is. Otherwise the code is compiled with app.utils.bas2tap.
+    The TAP file is stored base64 encoded in state['tap_file_b64'] for the
+    upload callback.
 
     Args:
         current_code: The Spectrum BASIC code as a string.
+        tool_context: Context for tool execution
 
     Returns:
-        A dictionary with the key 'tap_file_path' holding the absolute path
-        to the created TAP file.
+        A dictionary with the key 'tap_file_name' holding the name the TAP
+        file will be uploaded as (taps/<sha256>.tap), and 'size_bytes'
+        holding its size.
 
     Raises:
-        RuntimeError: If `bas2tap` is not found or if it fails to execute.
+        RuntimeError: If the subprocess backend is selected and `bas2tap` is
+            not found or fails to execute.
+        TimeoutError: If bas2tap did not finish within BAS2TAP_TIMEOUT seconds.
     """
     logger.info("Attempting to create TAP file.")
-    # Create a temporary file for the output TAP file.
-    # We use delete=False because we want to return its path to the caller.
-    # The caller is responsible for deleting this file.
-    tap_file_handle, tap_file_path = tempfile.mkstemp(suffix=".tap")
-    os.close(tap_file_handle)  # We just need the path, bas2tap will write to it.
-    logger.debug(f"Temporary TAP file path created: {tap_file_path}")
-
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".bas", delete=True) as bas_file:
-        logger.debug(f"Writing BASIC code to temporary file: {bas_file.name}")
-        bas_file.write(current_code)
-        bas_file.flush()  # Ensure data is written to disk before bas2tap is called.
-
-        command = ["bas2tap", bas_file.name, tap_file_path]
-        logger.info(f"Executing command: {' '.join(command)}")
-
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(f"Successfully created TAP file: {tap_file_path}")
-        except FileNotFoundError as e:
-            logger.error(
-                "`bas2tap` command not found. Ensure it's installed and in PATH.",
-                exc_info=True,
-            )
-            os.remove(tap_file_path)
-            logger.debug(
-                f"Cleaned up temporary TAP file due to FileNotFoundError: {tap_file_path}"
-            )
-            raise RuntimeError(
-                "`bas2tap` command not found. "
-                "Please ensure it is installed and in your system's PATH."
-            ) from e
-        except subprocess.CalledProcessError as e:
-            logger.error(
-                f"bas2tap failed with exit code {e.returncode}. Stderr: {e.stderr.strip()}",
-                exc_info=True,
-            )
-            os.remove(tap_file_path)
-            logger.debug(
-                f"Cleaned up temporary TAP file due to CalledProcessError: {tap_file_path}"
-            )
-            error_message = (
-                f"bas2tap failed with exit code {e.returncode}.\n"
-                f"Stderr: {e.stderr.strip()}"
-            )
-            raise RuntimeError(error_message) from e
-
-    return {"tap_file_path": tap_file_path}
+    tap_bytes = bas2tap.load_tap(tool_context.state, current_code)
+    if tap_bytes is None:
+        tap_bytes = await compile_tap(current_code)
+        bas2tap.store_tap(tool_context.state, current_code, tap_bytes)
+    else:
+        logger.info("Reusing the TAP file compiled during validation.")
+
+    tap_file_name = publish_tap(tool_context.state, tap_bytes)
+    logger.info(
+        f"Successfully created TAP file: {tap_file_name} ({len(tap_bytes)} bytes)"
+    )
+    return {"tap_file_name": tap_file_name, "size_bytes": len(tap_bytes)}
+
+
+def publish_validated_tap(callback_context: CallbackContext) -> types.Content | None:
+    """Publishes the TAP file compiled during validation, skipping the agent.
+
+    Used as the tap creation agent's before_agent_callback. When the final
+    state['current_code'] already compiled cleanly in the refinement loop,
+    the agent's model turn and the second compilation are both unnecessary.
+
+    Args:
+        callback_context: The context containing state with 'current_code'.
+
+    Returns:
+        The TAP file name as the agent's response, or None to run the agent.
+    """
+    state = callback_context.state
+    current_code = state.get("current_code")
+    tap_bytes = bas2tap.load_tap(state, current_code) if current_code else None
+    if tap_bytes is None:
+        logger.info("No validated TAP file for the current code; running agent.")
+        return None
+
+    tap_file_name = publish_tap(state, tap_bytes)
+    logger.info(f"Published TAP file compiled during validation: {tap_file_name}")
+    return types.Content(role="model", parts=[types.Part(text=tap_file_name)])
+
+
+def publish_tap(state: State | dict[str, Any], tap_bytes: bytes) -> str:
+    """Names the TAP file in state, ready for the upload callback.
+
+    The name is the content-addressed blob the upload callback stores the
+    file under, so the name reported to the user is the published object.
+    """
+    tap_file_name = gcs.tap_blob_name(tap_bytes)
+    state["tap_file_name"] = tap_file_name
+    return tap_file_name
+
+
+async def compile_tap(current_code: str) -> bytes:
+    """Compiles the code, raising RuntimeError if bas2tap fails."""
+    try:
+        compilation = await bas2tap.compile_listing_async(current_code)
+    except FileNotFoundError as e:
+        logger.error(
+            "`bas2tap` command not found. Ensure it's installed and in PATH.",
+            exc_info=True,
+        )
+        raise RuntimeError(
+            "`bas2tap` command not found. "
+            "Please ensure it is installed and in your system's PATH."
+        ) from e
+
+    if compilation.returncode != 0:
+        logger.error(
+            f"bas2tap failed with exit code {compilation.returncode}. "
+            f"Stderr: {compilation.stderr.strip()}"
+        )
+        raise RuntimeError(
+            f"bas2tap failed with exit code {compilation.returncode}.\n"
+            f"Stderr: {compilation.stderr.strip()}"
+        )
+    if compilation.stderr:
+        # bas2tap still writes the lines that converted, so publish them.
+        logger.warning(f"TAP file created from code with errors:\n{compilation.stderr}")
+    return compilation.tap
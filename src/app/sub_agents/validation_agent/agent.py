@@ -1,16 +1,89 @@
-from google.adk.agents import Agent
+import logging
+import os
+from collections.abc import AsyncGenerator
+from typing import Any
 
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from typing_extensions import override
+
+from ...utils import bas2tap, code_state
 from . import prompt
+from .tools import exit_loop, validate_spectrum_code
 
-from .tools import validate_spectrum_code, exit_loop
+logger = logging.getLogger(__name__)
 
 MODEL = "gemini-2.5-flash"
 
-validation_agent = Agent(
+VALID_CODE_MESSAGE = "Code meets all requirements. Exiting the refinement loop."
+
+
+class ValidationAgent(BaseAgent):
+    """Validates the loop's current code with bas2tap without calling a model.
+
+    Clean code escalates out of the refinement loop straight away. Otherwise
+    the parsed errors are written to state['validation_errors'] for the
+    debugging agent. Output that cannot be parsed as bas2tap diagnostics is
+    handed to the LLM validation agent, the first sub-agent.
+    """
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        current_code = code_state.current_code(ctx.session.state)
+        compilation = await bas2tap.compile_listing_async(current_code)
+        state_delta: dict[str, Any] = {}
+
+        if compilation.ok:
+            logger.info("Code validated cleanly; exiting the refinement loop.")
+            bas2tap.store_tap(state_delta, current_code, compilation.tap)
+            state_delta["validation_errors"] = []
+            actions = EventActions(state_delta=state_delta, escalate=True)
+            yield self._event(ctx, VALID_CODE_MESSAGE, actions)
+            return
+
+        errors = None
+        if compilation.returncode == 0:
+            errors = bas2tap.parse_errors(compilation.stderr)
+        if errors is None:
+            logger.warning("Ambiguous bas2tap output; deferring to the LLM agent.")
+            async for event in self.sub_agents[0].run_async(ctx):
+                yield event
+            return
+
+        logger.info(f"Code has {len(errors)} validation error(s).")
+        state_delta["validation_errors"] = errors
+        actions = EventActions(state_delta=state_delta)
+        yield self._event(ctx, compilation.stderr, actions)
+
+    def _event(self, ctx: InvocationContext, text: str, actions: EventActions) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            actions=actions,
+        )
+
+
+llm_validation_agent = Agent(
     model=MODEL,
-    name="validation_agent",
+    name="llm_validation_agent",
     description="Validation agent for ZX Spectrum code",
-    instruction=prompt.VALIDATION_PROMPT,
+    instruction=code_state.instruction_with_current_code(prompt.VALIDATION_PROMPT),
     tools=[validate_spectrum_code, exit_loop],
     output_key="validation_errors",
 )
+
+# VALIDATION_AGENT=llm validates every pass with the model, e.g. for parity tests.
+if os.environ.get("VALIDATION_AGENT", "deterministic") == "llm":
+    validation_agent: BaseAgent = llm_validation_agent
+else:
+    validation_agent = ValidationAgent(
+        name="validation_agent",
+        description="Validation agent for ZX Spectrum code",
+        sub_agents=[llm_validation_agent],
+    )
@@ -4,88 +4,75 @@ Tools for Spectrum basic validation agent
 This module provides tools for validating Spectrum BASIC code.
 """
 
-import subprocess
-import tempfile
-import os
 import logging
-from typing import Dict, Any
+from typing import Any
 
 from google.adk.tools import ToolContext
 
+from ...utils import bas2tap
+
 logger = logging.getLogger(__name__)
 
 
-def validate_spectrum_code(current_code: str) -> str:
+async def validate_spectrum_code(
+    current_code: str, tool_context: ToolContext | None = None
+) -> str:
     """
-    Takes Spectrum BASIC code as a string, writes it to a temporary file,
-    runs it through bas2tap to validate the code and returns the output from the command.
+    Takes Spectrum BASIC code as a string and validates it with bas2tap,
+    returning the output bas2tap produces for it.
+
+    By default the listing is checked in-process by app.utils.spectrum_basic,
+    which reports the same diagnostics without temp files or a subprocess.
+    Set BAS2TAP_BACKEND=subprocess to run the bas2tap binary instead, without
+    blocking the event loop. Results are cached, so a listing that was already
+    compiled is not compiled again.
+
+    When the code is valid its TAP file is kept in state['tap_file_b64'], so
+    the tap creation stage can publish it without compiling it again.
 
     Args:
         current_code: A string containing the Spectrum BASIC code.
+        tool_context: Context for tool execution
 
     Returns:
         The captured stdout and stderr from the bas2tap command as a string.
 
     Raises:
-        FileNotFoundError: If the 'bas2tap' command is not found.
+        FileNotFoundError: If the subprocess backend is selected and the
+            'bas2tap' command is not found.
+        TimeoutError: If bas2tap did not finish within BAS2TAP_TIMEOUT seconds.
     """
     logger.info("Validating Spectrum BASIC code.")
-    temp_bas_file = None
-    temp_tap_file = None
-    try:
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".bas", delete=False, encoding="utf-8"
-        ) as f:
-            temp_bas_file = f.name
-            logger.debug(f"Created temporary BASIC file: {temp_bas_file}")
-            f.write(current_code)
-
-        with tempfile.NamedTemporaryFile(suffix=".tap", delete=False) as f:
-            temp_tap_file = f.name
-            logger.debug(f"Created temporary TAP file: {temp_tap_file}")
-
-        command = ["bas2tap", temp_bas_file, temp_tap_file]
-        logger.info(f"Executing command: {' '.join(command)}")
-
-        process = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=False,  # We'll check the return code manually
-        )
-
-        output = ""
-        if process.stdout:
-            logger.debug(f"bas2tap stdout:\n{process.stdout}")
-            output += f"--- stdout ---\n{process.stdout}\n"
-        if process.stderr:
-            logger.warning(
-                f"bas2tap stderr:\n{process.stderr}"
-            )  # Using warning for stderr
-            output += f"--- stderr ---\n{process.stderr}\n"
-
-        if process.returncode != 0:
-            logger.error(f"bas2tap exited with a non-zero status: {process.returncode}")
-            output += f"bas2tap exited with a non-zero status: {process.returncode}"
-        else:
-            logger.info("bas2tap executed successfully.")
-
-        final_output = (
-            output if output else "bas2tap executed successfully with no output."
-        )
-        logger.debug(f"Validation result: {final_output}")
-        return final_output
-
-    finally:
-        if temp_bas_file and os.path.exists(temp_bas_file):
-            os.remove(temp_bas_file)
-            logger.debug(f"Removed temporary BASIC file: {temp_bas_file}")
-        if temp_tap_file and os.path.exists(temp_tap_file):
-            os.remove(temp_tap_file)
-            logger.debug(f"Removed temporary TAP file: {temp_tap_file}")
-
-
-def exit_loop(tool_context: ToolContext) -> Dict[str, Any]:
+    compilation = await bas2tap.compile_listing_async(current_code)
+    if tool_context is not None and compilation.ok:
+        bas2tap.store_tap(tool_context.state, current_code, compilation.tap)
+    return _format_output(
+        compilation.stdout, compilation.stderr, compilation.returncode
+    )
+
+
+def _format_output(stdout: str, stderr: str, returncode: int) -> str:
+    """Builds the validation report from bas2tap's output and exit status."""
+    output = ""
+    if stdout:
+        logger.debug(f"bas2tap stdout:\n{stdout}")
+        output += f"--- stdout ---\n{stdout}\n"
+    if stderr:
+        logger.warning(f"bas2tap stderr:\n{stderr}")  # Using warning for stderr
+        output += f"--- stderr ---\n{stderr}\n"
+
+    if returncode != 0:
+        logger.error(f"bas2tap exited with a non-zero status: {returncode}")
+        output += f"bas2tap exited with a non-zero status: {returncode}"
+    else:
+        logger.info("bas2tap executed successfully.")
+
+    final_output = output if output else "bas2tap executed successfully with no output."
+    logger.debug(f"Validation result: {final_output}")
+    return final_output
+
+
+def exit_loop(tool_context: ToolContext) -> dict[str, Any]:
     """
     Call this function ONLY when code validation has completed successfully,
     signaling the iterative process should end.
@@ -1,11 +1,18 @@
+import asyncio
 import base64
+import datetime
+import hashlib
 import logging
 import os
-import datetime
-from google.cloud import storage
+import time
+from typing import Any
 
 from google.adk.agents.callback_context import CallbackContext
 
+from .sub_agents.code_extraction_agent.tools import image_data, is_image
+from .utils import basic_fixes, gcs
+from .utils.image_cache import extraction_key
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,9 +34,37 @@ def _decode_b64_str(s: str) -> bytes:
         raise
 
 
-# --- Callback to save uploaded image(s) to state ---
-def _save_uploaded_image_to_state(callback_context: CallbackContext):
-    """Extracts image data from an incoming request, base64 encodes it, and saves to session state."""
+# --- Callback to fix mechanical mistakes in the extracted code ---
+def _fix_extracted_code(callback_context: CallbackContext) -> None:
+    """Applies app.utils.basic_fixes to state['current_code'].
+
+    Used as the refinement loop's before_agent_callback, so the fixes run
+    right after extraction, whether the code came from the model or the
+    extraction cache, and listings with only mechanical mistakes validate
+    without a debugging call.
+    """
+    state = callback_context.state
+    current_code = state.get("current_code")
+    if not current_code:
+        return None
+    fixed_code = basic_fixes.fix_listing(current_code)
+    if fixed_code != current_code:
+        logger.info("Applied deterministic fixes to the extracted code.")
+        state["current_code"] = fixed_code
+    return None
+
+
+# --- Callback to reference uploaded image(s) in state ---
+async def _save_uploaded_image_to_state(callback_context: CallbackContext) -> None:
+    """References each uploaded image in state without copying its bytes.
+
+    The images stay in the user's message, which the extraction agents read
+    directly; session state only holds a small reference per image in
+    state['uploaded_images'] ({sha256, mime_type, size_bytes}) plus the
+    extraction cache key for the images and the user's text in
+    state['uploaded_image_hash']. Hashing decodes every image, so it runs in
+    a worker thread rather than on the event loop.
+    """
     logger.info("--- Entering _save_uploaded_image_to_state callback ---")
     state = callback_context.state
     user_content = callback_context.user_content
@@ -38,14 +73,16 @@ def _save_uploaded_image_to_state(callback_context: CallbackContext):
         logger.info("Callback: No content or parts found in user_content.")
         return
 
-    # Clears image session state
-    image_parts_list = []
-    first_image_b64 = None
+    # Clears image session state, including the base64 copies older versions
+    # kept in state.
+    images: list[tuple[bytes, str | None]] = []
 
     keys_to_clear = [
         "uploaded_image_b64",
         "uploaded_mask_b64",
         "uploaded_image_parts",
+        "uploaded_images",
+        "uploaded_image_hash",
     ]
     cleared_keys_log = []
 
@@ -66,177 +103,154 @@ def _save_uploaded_image_to_state(callback_context: CallbackContext):
     )
     logger.info(confirmation_msg)
 
-    # Iterate through parts of the user_content
     for i, part in enumerate(user_content.parts):
-        if hasattr(part, "inline_data") and getattr(
-            part.inline_data, "mime_type", ""
-        ).startswith("image/"):
-            mime_type = part.inline_data.mime_type
-            logger.debug(f"Callback: Found image part {i} with mime_type: {mime_type}")
-            part_data_container = part.inline_data
-            current_data_bytes = None
-
-            # Try extracting raw bytes first
-            raw_bytes = getattr(part_data_container, "data", None)
-            if raw_bytes and isinstance(raw_bytes, (bytes, bytearray)):
-                current_data_bytes = raw_bytes
-                logger.debug(
-                    f"Callback: Extracted raw bytes ({len(current_data_bytes)}) from inline_data for part {i}."
-                )
-            else:
-                # Fallback to base64 string
-                b64_data = getattr(part_data_container, "b64_json", None)
-                if b64_data and isinstance(b64_data, str):
-                    logger.debug(
-                        f"Callback: Found base64 string in inline_data for part {i}. Decoding..."
-                    )
-                    try:
-                        current_data_bytes = _decode_b64_str(b64_data)
-                        logger.debug(
-                            f"Callback: Decoded base64 part {i}. Length: {len(current_data_bytes)}"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"Callback: Failed to decode base64 from part {i}: {e}"
-                        )
-                        continue  # Skip this part if decoding fails
-                else:
-                    logger.warning(
-                        f"Callback: Image part {i} found but no suitable data/b64_json."
-                    )
-                    continue
-
-            # If data was successfully obtained, process and add to list
-            if current_data_bytes:
-                try:
-                    # Re-encode to ensure clean base64 for state
-                    current_b64_str = base64.b64encode(current_data_bytes).decode(
-                        "utf-8"
-                    )
-                    image_part_info = {"b64": current_b64_str, "mime_type": mime_type}
-                    image_parts_list.append(image_part_info)
-                    logger.debug(
-                        f"Callback: Added image part {i} info (mime: {mime_type}, b64 len: {len(current_b64_str)}) to list."
-                    )
-
-                    # Save the first image separately for compatibility
-                    if first_image_b64 is None:
-                        first_image_b64 = current_b64_str
-                        logger.debug(
-                            f"Callback: Storing part {i} as the first image for single-edit compatibility."
-                        )
-
-                except Exception as e:
-                    logger.error(
-                        f"Callback: Error processing/encoding image part {i}: {e}"
-                    )
-                    continue
-
-    # Save the collected image parts list and the first image to state
-    if image_parts_list:
-        state["uploaded_image_parts"] = image_parts_list
-        logger.info(
-            f"Callback: Saved list of {len(image_parts_list)} image parts to state['uploaded_image_parts']."
-        )
-    else:
-        logger.info("Callback: No valid image parts found to save to the list.")
+        if is_image(part):
+            data, mime_type = image_data(part)
+            logger.debug(
+                f"Callback: Found image part {i} with mime_type: {mime_type} "
+                f"({len(data)} bytes)."
+            )
+            images.append((data, mime_type))
 
-    if first_image_b64:
-        state["uploaded_image_b64"] = first_image_b64
+    # Save the image references to state
+    if images:
+        text = "\n".join(part.text for part in user_content.parts if part.text)
+        image_references, image_hash = await asyncio.to_thread(
+            _describe_upload, images, text
+        )
+        state["uploaded_images"] = image_references
         logger.info(
-            f"Callback: Saved first image base64 string (len: {len(first_image_b64)}) to state['uploaded_image_b64']."
+            f"Callback: Saved {len(image_references)} image references to state['uploaded_images']."
         )
-    else:
-        # If no images were found at all, ensure the key is removed
-        if "uploaded_image_b64" in state:
-            del state["uploaded_image_b64"]
+        # Identifies the upload for the extraction cache.
+        state["uploaded_image_hash"] = image_hash
         logger.info(
-            "Callback: No first image found, ensuring state['uploaded_image_b64'] is clear."
+            f"Callback: Saved image hash to state['uploaded_image_hash']: {state['uploaded_image_hash']}"
         )
+    else:
+        logger.info("Callback: No valid image parts found to save.")
     logger.info("--- Exiting _save_uploaded_image_to_state callback ---")
 
 
-def _upload_to_gcs_and_get_url(callback_context: CallbackContext):
-    """Uploads a file to GCS and generates a temporary signed URL.
+def _describe_upload(
+    images: list[tuple[bytes, str | None]], text: str
+) -> tuple[list[dict[str, Any]], str]:
+    """Returns the state reference for each image and the extraction cache key."""
+    image_references = [
+        {
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "mime_type": mime_type,
+            "size_bytes": len(data),
+        }
+        for data, mime_type in images
+    ]
+    return image_references, extraction_key([data for data, _ in images], text)
+
+
+async def _upload_to_gcs_and_get_url(callback_context: CallbackContext) -> None:
+    """Uploads the TAP file to GCS and generates a temporary signed URL.
 
-    The bucket name is read from the 'GCS_BUCKET_NAME' environment variable.
-    The generated URL is valid for 1 hour.
+    The file is uploaded straight from the in-memory buffer created by the
+    tap creation agent, under a name derived from the SHA-256 of its bytes,
+    so an identical program is stored once and later runs only generate a
+    new URL. The bucket name is read from the 'GCS_BUCKET_NAME' environment
+    variable. The generated URL is valid for SIGNED_URL_EXPIRATION seconds
+    (1 hour by default) and is reused for the same program until less than
+    SIGNED_URL_MIN_REMAINING seconds (15 minutes by default) of it remain.
+
+    The GCS calls block, so they run in a worker thread with the shared
+    storage client instead of on the event loop.
 
     Args:
-        callback_context: The context containing state with 'tap_file_path'.
+        callback_context: The context containing state with 'tap_file_b64'.
 
     Raises:
-        ValueError: If the GCS_BUCKET_NAME environment variable is not set.
-        FileNotFoundError: If the file at tap_file_path does not exist.
+        ValueError: If the GCS_BUCKET_NAME environment variable is not set or
+            no TAP file was created.
         google.api_core.exceptions.GoogleAPICallError: For GCS API errors.
     """
     state = callback_context.state
-    tap_file_path = state.get("tap_file_path")
-    logger.info(f"Attempting to upload file '{tap_file_path}' to GCS.")
+    tap_file_b64 = state.get("tap_file_b64")
 
     bucket_name = os.environ.get("GCS_BUCKET_NAME")
     if not bucket_name:
         logger.error("GCS_BUCKET_NAME environment variable not set.")
         raise ValueError("GCS_BUCKET_NAME environment variable is not set.")
 
-    if not tap_file_path or not os.path.exists(tap_file_path):
-        logger.error(f"File not found at path: {tap_file_path}")
-        raise FileNotFoundError(f"The specified file does not exist: {tap_file_path}")
+    if not tap_file_b64:
+        logger.error("No TAP file found in state['tap_file_b64'].")
+        raise ValueError("No TAP file was created to upload.")
 
+    tap_bytes = _decode_b64_str(tap_file_b64)
+    blob_name = gcs.tap_blob_name(tap_bytes)
+    min_remaining = float(os.environ.get("SIGNED_URL_MIN_REMAINING", 900))
+    cached_url = gcs.get_cached_url(bucket_name, blob_name, min_remaining)
+    if cached_url:
+        logger.info(f"Reusing the URL already generated for '{blob_name}'.")
+        state["tap_public_url"] = cached_url
+        return
+
+    logger.info(f"Attempting to upload file '{blob_name}' to GCS.")
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        state["tap_public_url"] = await asyncio.to_thread(
+            _publish_tap, bucket_name, blob_name, tap_bytes
+        )
+    except Exception as e:
+        logger.error(
+            f"Failed to process file '{blob_name}' with GCS: {e}", exc_info=True
+        )
+        raise
 
-        # Use the filename as the destination blob name
-        blob_name = os.path.basename(tap_file_path)
-        blob = bucket.blob(blob_name)
 
-        logger.debug(f"Uploading '{blob_name}' to bucket '{bucket_name}'...")
-        blob.upload_from_filename(tap_file_path)
+def _publish_tap(bucket_name: str, blob_name: str, tap_bytes: bytes) -> str:
+    """Uploads the TAP file if it is new and returns a URL to download it.
+
+    The URL is cached so later requests for the same program can reuse it
+    while enough of its lifetime remains.
+    """
+    blob, uploaded = gcs.upload_if_missing(
+        bucket_name, blob_name, tap_bytes, content_type="application/octet-stream"
+    )
+    if uploaded:
         logger.info(
             f"Successfully uploaded '{blob_name}' to GCS bucket '{bucket_name}'."
         )
+    else:
+        logger.info(f"'{blob_name}' already in GCS bucket '{bucket_name}'.")
 
+    try:
+        expiration_time = datetime.timedelta(
+            seconds=float(os.environ.get("SIGNED_URL_EXPIRATION", 3600))
+        )
+        signed_at = time.time()
+        signed_url = gcs.generate_signed_url(blob, expiration_time)
+        logger.info(
+            f"Generated signed URL for '{blob_name}', valid for {expiration_time}."
+        )
+        gcs.cache_url(
+            bucket_name,
+            blob_name,
+            signed_url,
+            signed_at + expiration_time.total_seconds(),
+        )
+        return signed_url
+    except Exception as e_signed_url:
+        logger.warning(
+            f"Failed to generate signed URL for '{blob_name}': {e_signed_url}. "
+            f"Attempting to make the file public and use its public URL instead."
+        )
         try:
-            # Attempt to generate a signed URL (valid for 1 hour)
-            expiration_time = datetime.timedelta(hours=1)
-            signed_url = blob.generate_signed_url(
-                version="v4",
-                expiration=expiration_time,
-                method="GET",
-            )
+            blob.make_public()
+            public_url = blob.public_url
             logger.info(
-                f"Generated signed URL for '{blob_name}', valid for {expiration_time}."
+                f"Successfully made '{blob_name}' public. Public URL: {public_url}"
             )
-            state["tap_public_url"] = signed_url
-        except Exception as e_signed_url:
-            logger.warning(
-                f"Failed to generate signed URL for '{blob_name}': {e_signed_url}. "
-                f"Attempting to make the file public and use its public URL instead."
+            gcs.cache_url(bucket_name, blob_name, public_url)
+            return public_url
+        except Exception as e_make_public:
+            logger.error(
+                f"Failed to make '{blob_name}' public or get its public URL: {e_make_public}",
+                exc_info=True,
             )
-            try:
-                blob.make_public()
-                public_url = blob.public_url
-                logger.info(
-                    f"Successfully made '{blob_name}' public. Public URL: {public_url}"
-                )
-                state["tap_public_url"] = public_url
-            except Exception as e_make_public:
-                logger.error(
-                    f"Failed to make '{blob_name}' public or get its public URL for {tap_file_path}: {e_make_public}",
-                    exc_info=True,
-                )
-                # Re-raise the error encountered during the fallback attempt.
-                # This will be caught by the outer 'except Exception as e' below.
-                raise e_make_public
-    except Exception as e:
-        logger.error(
-            f"Failed to process file '{tap_file_path}' with GCS: {e}", exc_info=True
-        )
-        raise
-
-    finally:
-        # Delete the local file after successful upload
-        if tap_file_path and os.path.exists(tap_file_path):
-            os.remove(tap_file_path)
-            logger.debug(f"Deleted local file '{tap_file_path}' after upload attempt.")
+            # Re-raise the error encountered during the fallback attempt.
+            raise e_make_public
@@ -0,0 +1,493 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compiles Spectrum BASIC listings with bas2tap, caching the results.
+
+Listings are compiled in-process by app.utils.spectrum_basic unless
+BAS2TAP_BACKEND=subprocess selects the bas2tap binary. Results are cached by a
+hash of the normalized listing, so the validation tool and create_tap never
+compile the same listing twice.
+"""
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import weakref
+from collections import deque
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from . import spectrum_basic, tap
+from .cache import LRUCache
+
+if TYPE_CHECKING:
+    # Only needed for annotations; importing ADK would slow down the CLI.
+    from google.adk.sessions.state import State
+
+logger = logging.getLogger(__name__)
+
+TAP_STATE_KEY = "tap_file_b64"
+TAP_CODE_HASH_STATE_KEY = "tap_code_hash"
+
+_STATEMENT_ERROR = re.compile(r"ERROR in line (\d+), statement (\d+) - (.*)")
+_LINE_ERROR = re.compile(r"ERROR - (.*)")
+_LINE_NUMBER = re.compile(r"\b(ASCII |BASIC )?line (?:number )?(\d+)", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Compilation:
+    """The outcome of running bas2tap on a listing.
+
+    Attributes:
+        stdout: What bas2tap printed on stdout, with newlines normalized.
+        stderr: What bas2tap printed on stderr.
+        returncode: The bas2tap exit status.
+        tap: The TAP file bas2tap wrote, empty if it wrote none.
+    """
+
+    stdout: str
+    stderr: str
+    returncode: int
+    tap: bytes
+
+    @property
+    def ok(self) -> bool:
+        """True when the listing compiled without any errors."""
+        return self.returncode == 0 and not self.stderr
+
+
+# Semaphores and worker queues are bound to the event loop they are first used on.
+_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = (
+    weakref.WeakKeyDictionary()
+)
+_pools: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, "WorkerPool"] = (
+    weakref.WeakKeyDictionary()
+)
+
+compilation_cache: LRUCache[Compilation] = LRUCache(
+    max_size=int(os.environ.get("BAS2TAP_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("BAS2TAP_CACHE_TTL", "3600")),
+)
+
+
+class NativeCompilations:
+    """Counters of the native backend's compilations, reported like a
+    WorkerPool's metrics."""
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self._latencies: deque[float] = deque(maxlen=1024)
+
+    async def run(self, code: str) -> Compilation:
+        """Compiles a listing in a worker thread, at most
+        BAS2TAP_MAX_CONCURRENCY at once per event loop."""
+        started = time.perf_counter()
+        semaphore = _semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            compilation = await asyncio.to_thread(_compile_native, code)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            semaphore.release()
+            self._latencies.append(time.perf_counter() - started)
+        self.completed += 1
+        return compilation
+
+    def metrics(self) -> dict[str, float]:
+        """Returns queue depth, running compilations and latency percentiles."""
+        return {
+            "size": int(os.environ.get("BAS2TAP_MAX_CONCURRENCY", "4")),
+            "busy": self.running,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            **_latency_percentiles(self._latencies),
+        }
+
+
+native_compilations = NativeCompilations()
+
+
+class WorkerPool:
+    """A fixed set of bas2tap workers with reusable RAM-backed scratch files.
+
+    Each worker owns a .bas/.tap pair in a scratch directory on /dev/shm
+    (or BAS2TAP_SCRATCH_DIR), which is overwritten on every run instead of
+    creating and deleting temp files. Callers queue for an idle worker, which
+    also bounds how many bas2tap processes run at once.
+    """
+
+    def __init__(self, size: int, scratch_root: str | None = None) -> None:
+        self.size = size
+        self.scratch_dir = tempfile.mkdtemp(
+            prefix="bas2tap-", dir=scratch_root or _scratch_root()
+        )
+        weakref.finalize(self, shutil.rmtree, self.scratch_dir, ignore_errors=True)
+        # LIFO keeps the most recently used, still cached, scratch files busy.
+        self._idle: asyncio.LifoQueue[int] = asyncio.LifoQueue()
+        for index in range(size):
+            self._idle.put_nowait(index)
+        self._waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self._latencies: deque[float] = deque(maxlen=1024)
+        logger.info(f"Started {size} bas2tap workers in {self.scratch_dir}")
+
+    async def run(self, code: str, timeout: float) -> Compilation:
+        """Compiles a listing on the next idle worker.
+
+        Raises:
+            FileNotFoundError: If the 'bas2tap' command is not found.
+            TimeoutError: If bas2tap did not finish within `timeout` seconds.
+        """
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self._waiting -= 1
+        try:
+            compilation = await self._run_worker(worker, code, timeout)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+            self._latencies.append(time.perf_counter() - started)
+        self.completed += 1
+        return compilation
+
+    def metrics(self) -> dict[str, float]:
+        """Returns queue depth, worker usage and latency percentiles."""
+        return {
+            "size": self.size,
+            "busy": self.size - self._idle.qsize(),
+            "queue_depth": self._waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            **_latency_percentiles(self._latencies),
+        }
+
+    async def _run_worker(self, worker: int, code: str, timeout: float) -> Compilation:
+        bas_file = os.path.join(self.scratch_dir, f"worker{worker}.bas")
+        tap_file = os.path.join(self.scratch_dir, f"worker{worker}.tap")
+        with open(bas_file, "w", encoding="utf-8") as f:
+            f.write(code)
+        # Truncate the previous run's output in case bas2tap writes nothing.
+        open(tap_file, "wb").close()
+
+        command = ["bas2tap", bas_file, tap_file]
+        logger.debug(f"Worker {worker} executing command: {' '.join(command)}")
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.error(f"bas2tap timed out after {timeout} seconds.")
+            raise TimeoutError(f"bas2tap timed out after {timeout} seconds.") from None
+
+        with open(tap_file, "rb") as f:
+            tap_bytes = f.read()
+        return Compilation(
+            stdout=_decode(stdout),
+            stderr=_decode(stderr),
+            returncode=process.returncode or 0,
+            tap=tap_bytes,
+        )
+
+
+def backend() -> str:
+    """Returns the configured backend, 'native' or 'subprocess'."""
+    return os.environ.get("BAS2TAP_BACKEND", "native")
+
+
+def normalize(code: str) -> str:
+    """Normalizes line endings, which do not affect what bas2tap produces."""
+    code = code.replace("\r\n", "\n")
+    return code if code.endswith("\n") else code + "\n"
+
+
+def cache_key(code: str) -> str:
+    """Returns the content address of a listing for the current backend."""
+    digest = hashlib.sha256(normalize(code).encode("utf-8")).hexdigest()
+    return f"{backend()}:{digest}"
+
+
+def compile_listing(code: str) -> Compilation:
+    """Compiles a listing, returning the cached result if there is one.
+
+    Args:
+        code: The Spectrum BASIC listing.
+
+    Returns:
+        The Compilation for the listing.
+
+    Raises:
+        FileNotFoundError: If the subprocess backend is selected and the
+            'bas2tap' command is not found.
+    """
+    key = cache_key(code)
+    compilation = compilation_cache.get(key)
+    if compilation is not None:
+        logger.info(f"bas2tap cache hit for {key}: {compilation_cache.stats()}")
+        return compilation
+
+    if backend() == "subprocess":
+        compilation = _compile_with_bas2tap(normalize(code))
+    else:
+        compilation = _compile_native(normalize(code))
+    compilation_cache.put(key, compilation)
+    logger.debug(f"bas2tap cache miss for {key}: {compilation_cache.stats()}")
+    return compilation
+
+
+async def compile_listing_async(code: str, timeout: float | None = None) -> Compilation:
+    """Compiles a listing without blocking the event loop.
+
+    The subprocess backend dispatches to the event loop's WorkerPool and the
+    native backend runs in a worker thread. At most BAS2TAP_MAX_CONCURRENCY
+    compilations run at once per event loop; the rest wait their turn.
+
+    Args:
+        code: The Spectrum BASIC listing.
+        timeout: Seconds to wait for bas2tap, defaulting to BAS2TAP_TIMEOUT.
+
+    Returns:
+        The Compilation for the listing.
+
+    Raises:
+        FileNotFoundError: If the subprocess backend is selected and the
+            'bas2tap' command is not found.
+        TimeoutError: If bas2tap did not finish within the timeout.
+    """
+    key = cache_key(code)
+    compilation = compilation_cache.get(key)
+    if compilation is not None:
+        logger.info(f"bas2tap cache hit for {key}: {compilation_cache.stats()}")
+        return compilation
+
+    if timeout is None:
+        timeout = float(os.environ.get("BAS2TAP_TIMEOUT", "10"))
+    if backend() == "subprocess":
+        compilation = await worker_pool().run(normalize(code), timeout)
+    else:
+        compilation = await native_compilations.run(normalize(code))
+    compilation_cache.put(key, compilation)
+    logger.debug(f"bas2tap cache miss for {key}: {compilation_cache.stats()}")
+    return compilation
+
+
+def worker_pool() -> "WorkerPool":
+    """Returns the running event loop's bas2tap worker pool."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        size = int(os.environ.get("BAS2TAP_MAX_CONCURRENCY", "4"))
+        pool = _pools[loop] = WorkerPool(size)
+    return pool
+
+
+def worker_metrics() -> dict[str, float]:
+    """Returns the metrics of the running event loop's worker pool if it has
+    one, or otherwise of the native backend, without starting a pool."""
+    pool = _pools.get(asyncio.get_running_loop())
+    if pool is not None:
+        return pool.metrics()
+    return native_compilations.metrics()
+
+
+def _semaphore() -> asyncio.Semaphore:
+    """Returns the running event loop's compilation semaphore."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        limit = int(os.environ.get("BAS2TAP_MAX_CONCURRENCY", "4"))
+        semaphore = _semaphores[loop] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+def store_tap(state: "State | dict[str, Any]", code: str, tap_bytes: bytes) -> None:
+    """Keeps the TAP file compiled from `code` in session state.
+
+    The bytes are base64 encoded because session state must stay JSON
+    serializable, and are tagged with the listing's hash so a stale file is
+    never published for different code.
+    """
+    state[TAP_STATE_KEY] = base64.b64encode(tap_bytes).decode("utf-8")
+    state[TAP_CODE_HASH_STATE_KEY] = cache_key(code)
+
+
+def load_tap(state: "State | dict[str, Any]", code: str) -> bytes | None:
+    """Returns the TAP file stored for `code` by store_tap, or None."""
+    tap_file_b64 = state.get(TAP_STATE_KEY)
+    if not tap_file_b64 or state.get(TAP_CODE_HASH_STATE_KEY) != cache_key(code):
+        return None
+    return base64.b64decode(tap_file_b64)
+
+
+def parse_errors(stderr: str) -> list[dict[str, Any]] | None:
+    """Parses bas2tap's stderr into one dictionary per error.
+
+    Each error has the BASIC 'line' it was found in, the 'statement' within
+    that line when bas2tap reports one, and the full 'message'. Errors found
+    before a line number could be read refer to the 'ascii_line' of the
+    listing instead.
+
+    Args:
+        stderr: The stderr text of a bas2tap run.
+
+    Returns:
+        The parsed errors, or None if the output does not look like bas2tap
+        diagnostics.
+    """
+    errors: list[dict[str, Any]] = []
+    for text in stderr.splitlines():
+        if not text.strip():
+            continue
+        if match := _STATEMENT_ERROR.fullmatch(text):
+            errors.append(
+                {
+                    "line": int(match[1]),
+                    "statement": int(match[2]),
+                    "message": text,
+                }
+            )
+        elif match := _LINE_ERROR.fullmatch(text):
+            error: dict[str, Any] = {"line": None, "statement": None, "message": text}
+            if number := _LINE_NUMBER.search(match[1]):
+                key = "ascii_line" if number[1] == "ASCII " else "line"
+                error[key] = int(number[2])
+            errors.append(error)
+        elif errors:
+            # Some messages continue on the following line.
+            errors[-1]["message"] += f" {text.strip()}"
+        else:
+            return None
+    return errors or None
+
+
+def _compile_native(code: str) -> Compilation:
+    result = spectrum_basic.convert(code)
+    # Match the newline translation subprocess.run applies with text=True.
+    stdout = result.stdout.replace("\r\n", "\n").replace("\r", "\n")
+    return Compilation(
+        stdout=stdout,
+        stderr=result.stderr,
+        returncode=0,
+        tap=tap.encode_program(result.lines.program),
+    )
+
+
+def _compile_with_bas2tap(code: str) -> Compilation:
+    with _scratch_files(code) as (temp_bas_file, temp_tap_file):
+        command = ["bas2tap", temp_bas_file, temp_tap_file]
+        logger.info(f"Executing command: {' '.join(command)}")
+
+        process = subprocess.run(
+            command,
+            capture_output=True,
+            text=True,
+            check=False,  # We'll check the return code manually
+        )
+        with open(temp_tap_file, "rb") as f:
+            tap_bytes = f.read()
+        return Compilation(
+            stdout=process.stdout or "",
+            stderr=process.stderr or "",
+            returncode=process.returncode,
+            tap=tap_bytes,
+        )
+
+
+def _scratch_root() -> str | None:
+    """Returns a RAM-backed directory for scratch files when one is available."""
+    scratch_root = os.environ.get("BAS2TAP_SCRATCH_DIR", "/dev/shm")
+    if os.path.isdir(scratch_root) and os.access(scratch_root, os.W_OK):
+        return scratch_root
+    return None
+
+
+def _latency_percentiles(latencies: Iterable[float]) -> dict[str, float]:
+    """Returns the median and 95th percentile of latencies in milliseconds."""
+    ordered = sorted(latencies)
+
+    def percentile(fraction: float) -> float:
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(fraction * len(ordered)))
+        return 1000 * ordered[index]
+
+    return {"latency_p50_ms": percentile(0.5), "latency_p95_ms": percentile(0.95)}
+
+
+def _decode(output: bytes) -> str:
+    """Decodes process output the way subprocess.run does with text=True."""
+    text = output.decode(errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+@contextlib.contextmanager
+def _scratch_files(code: str) -> Iterator[tuple[str, str]]:
+    """Writes the listing to a temporary .bas file next to an empty .tap file."""
+    temp_bas_file = None
+    temp_tap_file = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            mode="w", suffix=".bas", delete=False, encoding="utf-8", dir=_scratch_root()
+        ) as f:
+            temp_bas_file = f.name
+            logger.debug(f"Created temporary BASIC file: {temp_bas_file}")
+            f.write(code)
+
+        with tempfile.NamedTemporaryFile(
+            suffix=".tap", delete=False, dir=_scratch_root()
+        ) as f:
+            temp_tap_file = f.name
+            logger.debug(f"Created temporary TAP file: {temp_tap_file}")
+
+        yield temp_bas_file, temp_tap_file
+
+    finally:
+        if temp_bas_file and os.path.exists(temp_bas_file):
+            os.remove(temp_bas_file)
+            logger.debug(f"Removed temporary BASIC file: {temp_bas_file}")
+        if temp_tap_file and os.path.exists(temp_tap_file):
+            os.remove(temp_tap_file)
+            logger.debug(f"Removed temporary TAP file: {temp_tap_file}")
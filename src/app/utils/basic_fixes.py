@@ -0,0 +1,133 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Deterministic fixes for mechanical mistakes in extracted BASIC listings.
+
+Most of the rules the debugging prompt gives the model need no judgement:
+one BASIC line per text line, no blank lines, keywords in upper case and a
+single space inside GO TO and GO SUB. They are applied here, together with
+the usual OCR confusions of O for 0 in numbers and l or I for 1 in line
+numbers, so listings that only break these rules validate without a model
+call. String literals and REM comments are left as they are.
+
+Keywords are only upper-cased where a keyword is expected, since variables
+may spell keywords, as in LET in=1: at the start of a statement, THEN in an
+IF statement, and keywords ending in $, which cannot be variable names.
+"""
+
+import re
+
+from .listing import LINE_NUMBER_PATTERN
+from .spectrum_basic import KEYWORD_NAMES
+
+# Keywords that are a single identifier, such as PRINT or INKEY$.
+_WORD_KEYWORDS = frozenset(
+    name for name in KEYWORD_NAMES if re.fullmatch(r"[A-Z]+\$?", name)
+)
+
+# A line number in which l, I or | was read for 1 or O for 0.
+_OCR_LINE_NUMBER = re.compile(r"^([0-9OolI|]*[0-9][0-9OolI|]*)(?=\s)")
+# Keywords may follow a number directly, as in 10PRINT or IF x=2OR y, so
+# only a letter or $ before a word makes it part of an identifier.
+# String literals, and REM with the rest of the line.
+_LITERAL = re.compile(r'"[^"]*"?|(?<![A-Za-z$])REM(?![A-Za-z]).*', re.IGNORECASE)
+_SPACED_KEYWORD = re.compile(
+    r"(?<![A-Za-z$])(GO)\s*(TO|SUB)(?![A-Za-z$])"
+    r"|(?<![A-Za-z$])(DEF)\s*(FN)(?![A-Za-z$])"
+    r"|(?<![A-Za-z$])(OPEN|CLOSE)\s*(#)",
+    re.IGNORECASE,
+)
+_TOKEN = re.compile(r":|(?<![A-Za-z$])[A-Za-z][A-Za-z0-9]*\$?")
+_OCR_NUMBER = re.compile(
+    r"(?<![A-Za-z0-9$.])[0-9][0-9Oo.]*[Oo][0-9Oo.]*(?![A-Za-z0-9$])"
+)
+_OCR_JUMP_TARGET = re.compile(
+    r"(GO (?:TO|SUB) ?)([0-9OolI|]*[0-9][0-9OolI|]*)(?![A-Za-z0-9$])"
+)
+_OCR_DIGITS = str.maketrans("OolI|", "00111")
+
+
+def fix_listing(listing: str) -> str:
+    """Applies the deterministic fixes to a listing.
+
+    Blank lines are dropped and text without a line number is joined to the
+    line before it, as a line wrapped on screen or on the page, keeping the
+    whitespace around the break. The result ends with a newline if the
+    listing did.
+    """
+    lines: list[str] = []
+    trailing = ""
+    for raw in listing.splitlines():
+        text = raw.strip()
+        if not text:
+            continue
+        text = _OCR_LINE_NUMBER.sub(lambda m: m[1].translate(_OCR_DIGITS), text)
+        if lines and not LINE_NUMBER_PATTERN.match(text):
+            leading = raw[: len(raw) - len(raw.lstrip())]
+            lines[-1] += trailing + leading + text
+        else:
+            lines.append(text)
+        trailing = raw[len(raw.rstrip()) :]
+    fixed = "\n".join(fix_line(line) for line in lines)
+    return fixed + "\n" if fixed and listing.endswith("\n") else fixed
+
+
+def fix_line(line: str) -> str:
+    """Applies the statement fixes to one line, outside strings and REM."""
+    match = LINE_NUMBER_PATTERN.match(line)
+    start = match.start(2) if match else 0
+    parts = [line[:start]]
+    position = start
+    for literal in _LITERAL.finditer(line, start):
+        parts.append(_fix_code(line[position : literal.start()]))
+        text = literal[0]
+        if text[0] != '"':
+            text = "REM" + text[3:]
+        parts.append(text)
+        position = literal.end()
+    parts.append(_fix_code(line[position:]))
+    return _upper_keywords("".join(parts), start)
+
+
+def _fix_code(code: str) -> str:
+    code = _SPACED_KEYWORD.sub(_space_keyword, code)
+    code = _OCR_NUMBER.sub(lambda m: m[0].replace("O", "0").replace("o", "0"), code)
+    return _OCR_JUMP_TARGET.sub(lambda m: m[1] + m[2].translate(_OCR_DIGITS), code)
+
+
+def _space_keyword(match: re.Match[str]) -> str:
+    first, second = (group for group in match.groups() if group is not None)
+    return f"{first.upper()} {second.upper()}"
+
+
+def _upper_keywords(line: str, start: int) -> str:
+    """Upper-cases the keywords after `start` that are in keyword position."""
+    # Literals are blanked out so that their words and colons are skipped.
+    code = _LITERAL.sub(lambda m: " " * len(m[0]), line)
+    chars = list(line)
+    statement_start, in_if = True, False
+    for token in _TOKEN.finditer(code, start):
+        word = token[0].upper()
+        if word == ":":
+            statement_start, in_if = True, False
+            continue
+        if word in _WORD_KEYWORDS and (
+            statement_start or word.endswith("$") or (in_if and word == "THEN")
+        ):
+            chars[token.start() : token.end()] = word
+        if statement_start:
+            in_if = word == "IF"
+        statement_start = in_if and word == "THEN"
+    return "".join(chars)
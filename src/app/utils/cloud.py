@@ -0,0 +1,61 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lazily created Google Cloud settings and clients shared by the app.
+
+Nothing here touches the network at import time, so modules can import it
+without adding to cold-start latency.
+"""
+
+import functools
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only needed for annotations; the client library is imported on first use.
+    from google.cloud.logging import Client as LoggingClient
+
+
+@functools.cache
+def project_id() -> str:
+    """Returns the Google Cloud project ID.
+
+    GOOGLE_CLOUD_PROJECT is used when set. Otherwise the project comes from
+    the default credentials, which may ask the metadata server, so the
+    result is cached for the process. Raises RuntimeError when neither names
+    a project.
+    """
+    project = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if project:
+        return project
+    import google.auth
+
+    _, project = google.auth.default()
+    if not project:
+        raise RuntimeError("No Google Cloud project found; set GOOGLE_CLOUD_PROJECT.")
+    return project
+
+
+def logs_bucket_name() -> str:
+    """Returns the bucket for large span payloads and artifacts."""
+    return f"{project_id()}-retro-righter-logs-data"
+
+
+@functools.cache
+def logging_client() -> "LoggingClient":
+    """Returns the process-wide Cloud Logging client."""
+    from google.cloud import logging as google_cloud_logging
+
+    return google_cloud_logging.Client(project=project_id())
@@ -0,0 +1,278 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Code state of the refinement loop as a line table and per-iteration patches.
+
+state['current_code'] holds the listing the loop started from and is not
+rewritten while the loop runs. Each debugging pass records a patch of the
+lines it added, changed or removed under its own key, state['code_patch_N'],
+and counts it in state['code_patch_count'], so each event carries only its
+own changed lines rather than the patches so far or a copy of the whole
+listing. The current listing is materialized from the listing and the
+patches on demand, and written back to state['current_code'] once the loop
+has finished.
+"""
+
+import bisect
+import hashlib
+import re
+from collections.abc import Awaitable, Callable, Collection, Mapping, MutableMapping
+from typing import TYPE_CHECKING, Any
+
+from .listing import LINE_NUMBER_PATTERN
+
+if TYPE_CHECKING:
+    # Only needed for annotations; importing ADK would slow down the CLI.
+    from google.adk.agents.readonly_context import ReadonlyContext
+    from google.adk.sessions.state import State
+
+CODE_STATE_KEY = "current_code"
+CODE_PATCH_COUNT_STATE_KEY = "code_patch_count"
+CODE_PATCH_STATE_KEY_PREFIX = "code_patch_"
+
+GO_TO_PATTERN = re.compile(r"\bGO\s*(?:TO|SUB)\s*(\d+)", re.IGNORECASE)
+
+# A patch is {"added": [[number, line], ...], "changed": [[number, line], ...],
+# "removed": [number, ...]}, or {"listing": text} when either listing cannot
+# be keyed by line number. Pairs rather than dicts keep the line numbers
+# integers through JSON. Recorded patches also carry the hash of the listing
+# in state['current_code'] they build on, under "base".
+Patch = dict[str, Any]
+
+
+def line_table(listing: str) -> dict[int, str] | None:
+    """Maps each line number to its full line.
+
+    Blank lines are dropped. Returns None for listings with unnumbered lines
+    or with line numbers that are not strictly increasing, which cannot be
+    rebuilt from a table.
+    """
+    table: dict[int, str] = {}
+    previous = -1
+    for text in listing.splitlines():
+        if not text.strip():
+            continue
+        match = LINE_NUMBER_PATTERN.match(text)
+        if match is None or int(match.group(1)) <= previous:
+            return None
+        previous = int(match.group(1))
+        table[previous] = text.rstrip()
+    return table
+
+
+def render_table(table: Mapping[int, str]) -> str:
+    """Materializes a line table as a listing in line number order."""
+    return "\n".join(table[number] for number in sorted(table))
+
+
+def diff_listings(before: str, after: str) -> Patch:
+    """Returns the patch that turns `before` into `after`."""
+    old, new = line_table(before), line_table(after)
+    if old is None or new is None:
+        return {"listing": after}
+    return {
+        "added": [[number, line] for number, line in new.items() if number not in old],
+        "changed": [
+            [number, line]
+            for number, line in new.items()
+            if number in old and old[number] != line
+        ],
+        "removed": [number for number in old if number not in new],
+    }
+
+
+def apply_patch(listing: str, patch: Patch) -> str:
+    """Applies a patch from diff_listings to the listing it was made against."""
+    if "listing" in patch:
+        return patch["listing"]
+    table = line_table(listing)
+    if table is None:
+        raise ValueError("Line patches only apply to line-numbered listings.")
+    for number in patch["removed"]:
+        table.pop(number, None)
+    for number, line in patch["added"] + patch["changed"]:
+        table[number] = line
+    return render_table(table)
+
+
+def excerpt_lines(
+    table: Mapping[int, str], numbers: Collection[int], context: int = 2
+) -> list[int]:
+    """Selects the lines needed to fix the given lines.
+
+    Returns, in order, the given line numbers, up to `context` lines either
+    side of each, and the lines their GO TO and GO SUB statements jump to.
+    A jump to a missing line number selects the next line, where the
+    Spectrum would continue.
+    """
+    ordered = sorted(table)
+    selected: set[int] = set()
+    for number in numbers:
+        position = bisect.bisect_left(ordered, number)
+        selected.update(ordered[max(0, position - context) : position + context + 1])
+        for match in GO_TO_PATTERN.finditer(table[number]):
+            target = bisect.bisect_left(ordered, int(match[1]))
+            if target < len(ordered):
+                selected.add(ordered[target])
+    return sorted(selected)
+
+
+def splice(listing: str, lines: str) -> str | None:
+    """Splices corrected lines into a listing by line number.
+
+    Each line replaces the listing's line with the same number, or is added
+    if there is none; a line number on its own deletes that line. Markdown
+    code fences around the lines are ignored.
+
+    Returns:
+        The new listing, or None if the listing or any of the lines has no
+        line number.
+    """
+    table = line_table(listing)
+    if table is None:
+        return None
+    for text in lines.splitlines():
+        if not text.strip() or text.lstrip().startswith("```"):
+            continue
+        match = LINE_NUMBER_PATTERN.match(text)
+        if match is None:
+            return None
+        if match[2].strip():
+            table[int(match[1])] = text.rstrip()
+        else:
+            table.pop(int(match[1]), None)
+    return render_table(table)
+
+
+def describe_patch(patch: Patch) -> str:
+    """Formats a patch one line per change, with +, ~ and - for added,
+    changed and removed lines."""
+    if "listing" in patch:
+        return f"Replaced the whole listing:\n{patch['listing']}"
+    changes = sorted(
+        [(number, f"+ {line}") for number, line in patch["added"]]
+        + [(number, f"~ {line}") for number, line in patch["changed"]]
+        + [(number, f"- {number}") for number in patch["removed"]]
+    )
+    return "\n".join(change for _, change in changes) or "No lines changed."
+
+
+def _base_hash(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()[:16]
+
+
+def _patch_key(index: int) -> str:
+    return f"{CODE_PATCH_STATE_KEY_PREFIX}{index}"
+
+
+def _patches(state: "State | Mapping[str, Any]") -> list[Patch]:
+    """Returns the patches recorded against the current state['current_code'].
+
+    Patches left by a loop that never finished are ignored once a new
+    listing has been extracted.
+    """
+    base = _base_hash(state.get(CODE_STATE_KEY, ""))
+    patches = (
+        state.get(_patch_key(index))
+        for index in range(state.get(CODE_PATCH_COUNT_STATE_KEY) or 0)
+    )
+    return [patch for patch in patches if patch and patch.get("base") == base]
+
+
+def recorded_patch(state_delta: Mapping[str, Any]) -> Patch | None:
+    """Returns the patch record_code() added to a state delta, if any."""
+    count = state_delta.get(CODE_PATCH_COUNT_STATE_KEY)
+    if not isinstance(count, int) or not count:
+        return None
+    return state_delta.get(_patch_key(count - 1))
+
+
+def current_code(state: "State | Mapping[str, Any]") -> str:
+    """Materializes the loop's current listing from the state."""
+    code = state.get(CODE_STATE_KEY, "")
+    for patch in _patches(state):
+        code = apply_patch(code, patch)
+    return code
+
+
+def record_code(
+    state_delta: "State | MutableMapping[str, Any]",
+    state: "State | Mapping[str, Any]",
+    code: str,
+) -> Patch:
+    """Records `code` as the loop's current listing and returns its patch.
+
+    Only the patch against the current listing and the new patch count are
+    added to `state_delta`.
+    """
+    count = len(_patches(state))
+    patch = diff_listings(current_code(state), code)
+    patch["base"] = _base_hash(state.get(CODE_STATE_KEY, ""))
+    state_delta[_patch_key(count)] = patch
+    state_delta[CODE_PATCH_COUNT_STATE_KEY] = count + 1
+    return patch
+
+
+def materialize(
+    state_delta: "State | MutableMapping[str, Any]", state: "State | Mapping[str, Any]"
+) -> str:
+    """Writes the current listing to state['current_code'] and clears the
+    patches, for stages after the loop. Returns the listing."""
+    code = current_code(state)
+    count = state.get(CODE_PATCH_COUNT_STATE_KEY) or 0
+    if count:
+        state_delta[CODE_STATE_KEY] = code
+        state_delta[CODE_PATCH_COUNT_STATE_KEY] = 0
+        for index in range(count):
+            state_delta[_patch_key(index)] = None
+    return code
+
+
+async def fill_instruction(
+    template: str, context: "ReadonlyContext", values: Mapping[str, str]
+) -> str:
+    """Fills a prompt template as ADK fills a template instruction, except
+    that the placeholders named in `values` take those values.
+
+    The values are inserted after the state injection, so braces in a
+    listing are never read as placeholders.
+    """
+    from google.adk.utils.instructions_utils import inject_session_state
+
+    pattern = re.compile("|".join(re.escape("{" + name + "}") for name in values))
+    parts = []
+    position = 0
+    for match in pattern.finditer(template):
+        parts.append(
+            await inject_session_state(template[position : match.start()], context)
+        )
+        parts.append(values[match[0][1:-1]])
+        position = match.end()
+    parts.append(await inject_session_state(template[position:], context))
+    return "".join(parts)
+
+
+def instruction_with_current_code(
+    template: str,
+) -> Callable[["ReadonlyContext"], Awaitable[str]]:
+    """Returns an instruction provider for a prompt template that fills
+    {current_code} with the materialized listing."""
+
+    async def instruction(context: "ReadonlyContext") -> str:
+        return await fill_instruction(
+            template, context, {CODE_STATE_KEY: current_code(context.state)}
+        )
+
+    return instruction
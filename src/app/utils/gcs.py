@@ -12,10 +12,158 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import hashlib
 import logging
+import math
+import os
+import threading
+import time
 
+import google.auth
 import google.cloud.storage as storage
 from google.api_core import exceptions
+from google.auth import credentials as auth_credentials
+from google.auth.transport import requests as auth_requests
+
+from .cache import LRUCache
+
+_clients: dict[str | None, storage.Client] = {}
+_clients_lock = threading.Lock()
+
+# Objects may be deleted behind the process's back, for example by a bucket
+# lifecycle rule, so what it knows about them is only trusted for this long.
+KNOWN_OBJECT_TTL = float(os.environ.get("GCS_KNOWN_OBJECT_TTL", "3600"))
+
+# Objects this process has uploaded or seen, so repeats skip the existence check.
+known_blobs: LRUCache[bool] = LRUCache(max_size=4096, ttl=KNOWN_OBJECT_TTL)
+
+# URL and wall-clock expiry (math.inf for public URLs) per "bucket/blob".
+signed_urls: LRUCache[tuple[str, float]] = LRUCache(max_size=4096, ttl=KNOWN_OBJECT_TTL)
+
+_signing_credentials: auth_credentials.Credentials | None = None
+_signing_lock = threading.Lock()
+
+
+def get_storage_client(project: str | None = None) -> storage.Client:
+    """Returns the process-wide storage client for `project`.
+
+    Creating a client resolves credentials and opens a new HTTP session, so
+    one client per project is shared by every request and thread; its session
+    keeps connections to GCS alive between calls.
+    """
+    with _clients_lock:
+        client = _clients.get(project)
+        if client is None:
+            client = _clients[project] = storage.Client(project=project)
+        return client
+
+
+def content_addressed_name(data: bytes, suffix: str = "", prefix: str = "") -> str:
+    """Returns a blob name derived from the SHA-256 of `data`."""
+    return f"{prefix}{hashlib.sha256(data).hexdigest()}{suffix}"
+
+
+def tap_blob_name(tap_bytes: bytes) -> str:
+    """Returns the name a TAP file is published under: taps/<sha256>.tap."""
+    return content_addressed_name(tap_bytes, suffix=".tap", prefix="taps/")
+
+
+def upload_if_missing(
+    bucket_name: str,
+    blob_name: str,
+    data: bytes,
+    content_type: str = "application/octet-stream",
+) -> tuple[storage.Blob, bool]:
+    """Uploads `data` unless an object named `blob_name` already exists.
+
+    Meant for content-addressed names, where an existing object always holds
+    the same bytes. The upload is conditional on the object not existing, so
+    concurrent uploads of the same content cannot overwrite each other.
+
+    Blocks on network calls; run it off the event loop from async code.
+
+    Returns:
+        The blob and whether it was uploaded by this call.
+    """
+    blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+    key = f"{bucket_name}/{blob_name}"
+    if known_blobs.get(key) or blob.exists():
+        logging.debug(f"Object '{key}' already exists, skipping upload.")
+        known_blobs.put(key, True)
+        return blob, False
+    try:
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        uploaded = True
+    except exceptions.PreconditionFailed:
+        logging.debug(f"Object '{key}' was uploaded concurrently.")
+        uploaded = False
+    known_blobs.put(key, True)
+    return blob, uploaded
+
+
+def get_signing_credentials() -> auth_credentials.Credentials:
+    """Returns the default credentials, loaded once for URL signing."""
+    global _signing_credentials
+    with _signing_lock:
+        if _signing_credentials is None:
+            _signing_credentials, _ = google.auth.default()
+        return _signing_credentials
+
+
+def generate_signed_url(
+    blob: storage.Blob, expiration: datetime.timedelta, method: str = "GET"
+) -> str:
+    """Generates a V4 signed URL for `blob`.
+
+    Service account keys sign the URL locally. Credentials without a key,
+    such as those of a Cloud Run service, fall back to the IAM signBlob API
+    with the service account's access token.
+
+    Raises:
+        RuntimeError: If the credentials have neither a key nor a service
+            account, as with user credentials.
+    """
+    credentials = get_signing_credentials()
+    if isinstance(credentials, auth_credentials.Signing):
+        return blob.generate_signed_url(
+            version="v4", expiration=expiration, method=method, credentials=credentials
+        )
+    service_account_email = getattr(credentials, "service_account_email", None)
+    if not isinstance(service_account_email, str):
+        raise RuntimeError(
+            f"{type(credentials).__name__} cannot sign URLs: no service account."
+        )
+    with _signing_lock:
+        if not credentials.valid:
+            credentials.refresh(auth_requests.Request())
+    return blob.generate_signed_url(
+        version="v4",
+        expiration=expiration,
+        method=method,
+        service_account_email=service_account_email,
+        access_token=credentials.token,
+    )
+
+
+def get_cached_url(
+    bucket_name: str, blob_name: str, min_remaining: float
+) -> str | None:
+    """Returns a cached URL for the object, if valid for `min_remaining` more s."""
+    entry = signed_urls.get(f"{bucket_name}/{blob_name}")
+    if entry is None:
+        return None
+    url, expires_at = entry
+    if expires_at - time.time() < min_remaining:
+        return None
+    return url
+
+
+def cache_url(
+    bucket_name: str, blob_name: str, url: str, expires_at: float = math.inf
+) -> None:
+    """Caches a URL for the object until the wall-clock time `expires_at`."""
+    signed_urls.put(f"{bucket_name}/{blob_name}", (url, expires_at))
 
 
 def create_bucket_if_not_exists(bucket_name: str, project: str, location: str) -> None:
@@ -26,7 +174,7 @@ def create_bucket_if_not_exists(bucket_name: str, project: str, location: str) -
         project: Google Cloud project ID
         location: Location to create the bucket in (defaults to us-central1)
     """
-    storage_client = storage.Client(project=project)
+    storage_client = get_storage_client(project)
 
     if bucket_name.startswith("gs://"):
         bucket_name = bucket_name[5:]
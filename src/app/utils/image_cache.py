@@ -0,0 +1,264 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent cache of code extracted from images.
+
+Entries are keyed by extraction_key: a perceptual hash of each image, a
+digest of its bytes and a digest of the user's text. A lookup serves the
+entry with the same key, or else the one whose images are the closest
+perceptual matches within a few bits, so a re-encoded or re-scanned copy of
+a page hits too; the byte digests only break ties between equally close
+entries. Entries are stored in SQLite so they survive restarts, and are
+evicted by age and by least recent use.
+"""
+
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from types import ModuleType
+
+logger = logging.getLogger(__name__)
+
+Image: ModuleType | None
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow ships with the app's dependencies
+    Image = None
+
+HASH_SIZE = 16
+
+# Bits of a 256-bit dHash that may differ for two images to count as the same
+# page; re-encoding or rescaling a scan typically flips fewer than this.
+MAX_DISTANCE = 4
+
+
+def perceptual_hash(image_bytes: bytes) -> str:
+    """Returns a difference hash (dHash) of an image as a hex string.
+
+    The image is reduced to a (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour. Falls back to a SHA-256 of the bytes if Pillow is not installed
+    or the bytes are not an image Pillow can read.
+    """
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                thumbnail = image.convert("L").resize(
+                    (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS
+                )
+            pixels = list(thumbnail.getdata())
+            bits = 0
+            for row in range(HASH_SIZE):
+                for col in range(HASH_SIZE):
+                    left = pixels[row * (HASH_SIZE + 1) + col]
+                    right = pixels[row * (HASH_SIZE + 1) + col + 1]
+                    bits = (bits << 1) | (left > right)
+            return f"dhash:{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+        except Exception as e:
+            logger.debug(f"Could not compute a perceptual hash, using SHA-256: {e}")
+    return f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+def extraction_key(images: Sequence[bytes], text: str = "") -> str:
+    """Returns the extraction cache key for the uploaded images and text.
+
+    Each image contributes its perceptual hash and the SHA-256 of its bytes,
+    and any text the user sent alongside is hashed in too, since it can
+    change what the model extracts. Decodes every image, so run it off the
+    event loop. Keys are compared with key_distance().
+    """
+    parts = [
+        f"{perceptual_hash(image)}/{hashlib.sha256(image).hexdigest()[:16]}"
+        for image in images
+    ]
+    if text:
+        parts.append(f"text:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}")
+    return "+".join(parts)
+
+
+def key_distance(key: str, other: str) -> tuple[int, int] | None:
+    """Compares two extraction keys image by image.
+
+    Returns:
+        The total Hamming distance between the images' perceptual hashes and
+        the number of images whose bytes differ, or None when the keys
+        cannot be for the same upload: a different number of images, a
+        different text, an image without a perceptual hash that differs, or
+        an image more than MAX_DISTANCE bits away.
+    """
+    parts, other_parts = key.split("+"), other.split("+")
+    if len(parts) != len(other_parts):
+        return None
+    distance = differing = 0
+    for part, other_part in zip(parts, other_parts, strict=True):
+        if part == other_part:
+            continue
+        image_hash, _, digest = part.partition("/")
+        other_hash, _, other_digest = other_part.partition("/")
+        if not (image_hash.startswith("dhash:") and other_hash.startswith("dhash:")):
+            return None
+        bits = bin(int(image_hash[6:], 16) ^ int(other_hash[6:], 16)).count("1")
+        if bits > MAX_DISTANCE:
+            return None
+        distance += bits
+        differing += digest != other_digest
+    return distance, differing
+
+
+class ExtractionCache:
+    """SQLite-backed cache of extracted listings.
+
+    Entries are keyed by image hash and prompt version, so changing the
+    extraction prompt or model never serves results produced by the old one.
+    Image hashes from extraction_key() also match near-identical images.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1000,
+        ttl: float | None = 30 * 24 * 3600,
+    ) -> None:
+        """Initializes the cache, creating the database if needed.
+
+        Args:
+            path: SQLite database file.
+            max_entries: Entries kept before the least recently used are
+                evicted.
+            ttl: Seconds an entry stays valid, or None to keep entries until
+                they are evicted.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                " image_hash TEXT NOT NULL,"
+                " prompt_version TEXT NOT NULL,"
+                " code TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (image_hash, prompt_version))"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, contextlib.closing(sqlite3.connect(self.path)) as connection:
+            with connection:
+                yield connection
+
+    def get(self, image_hash: str, prompt_version: str) -> str | None:
+        """Returns the cached listing for the image hash or the closest one.
+
+        Returns None if no entry that has not expired matches, exactly or
+        per key_distance().
+        """
+        now = time.time()
+        with self._connect() as connection:
+            if self.ttl is not None:
+                connection.execute(
+                    "DELETE FROM extractions WHERE created_at < ?", (now - self.ttl,)
+                )
+            row = connection.execute(
+                "SELECT image_hash, code FROM extractions"
+                " WHERE image_hash = ? AND prompt_version = ?",
+                (image_hash, prompt_version),
+            ).fetchone()
+            if row is None:
+                row = self._closest(connection, image_hash, prompt_version)
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute(
+                "UPDATE extractions SET last_used = ?"
+                " WHERE image_hash = ? AND prompt_version = ?",
+                (now, row[0], prompt_version),
+            )
+        self.hits += 1
+        return row[1]
+
+    def _closest(
+        self, connection: sqlite3.Connection, image_hash: str, prompt_version: str
+    ) -> tuple[str, str] | None:
+        best: tuple[tuple[int, int], str, str] | None = None
+        for stored_hash, code in connection.execute(
+            "SELECT image_hash, code FROM extractions WHERE prompt_version = ?",
+            (prompt_version,),
+        ):
+            distance = key_distance(image_hash, stored_hash)
+            if distance is not None and (best is None or distance < best[0]):
+                best = (distance, stored_hash, code)
+        return (best[1], best[2]) if best else None
+
+    def put(self, image_hash: str, prompt_version: str, code: str) -> None:
+        """Stores a listing and evicts expired and least recently used entries."""
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+                (image_hash, prompt_version, code, now, now),
+            )
+            if self.ttl is not None:
+                connection.execute(
+                    "DELETE FROM extractions WHERE created_at < ?", (now - self.ttl,)
+                )
+            connection.execute(
+                "DELETE FROM extractions WHERE rowid NOT IN ("
+                " SELECT rowid FROM extractions ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        """Returns the current size and the hit and miss counters."""
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+_extraction_cache: ExtractionCache | None = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Returns the process-wide cache configured from the environment.
+
+    EXTRACTION_CACHE_PATH sets the database file, EXTRACTION_CACHE_MAX_ENTRIES
+    the size limit and EXTRACTION_CACHE_TTL the entry lifetime in seconds.
+    """
+    global _extraction_cache
+    if _extraction_cache is None:
+        default_path = os.path.join(
+            os.path.expanduser("~"), ".cache", "retro-righter", "extractions.sqlite3"
+        )
+        _extraction_cache = ExtractionCache(
+            path=os.environ.get("EXTRACTION_CACHE_PATH", default_path),
+            max_entries=int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", "1000")),
+            ttl=float(os.environ.get("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600))),
+        )
+    return _extraction_cache
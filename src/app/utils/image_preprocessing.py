@@ -0,0 +1,320 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+CPU-side cleanup of listing images before they are sent to the model.
+
+Photos and scans are straightened, cropped to the printed text, converted to
+grayscale or 1-bit and downsampled, so extraction runs on the smallest image
+that still reads reliably. Gemini bills images by 768x768 tile, so cropping
+and downsampling cut input tokens as well as upload bytes.
+"""
+
+import dataclasses
+import hashlib
+import io
+import itertools
+import logging
+import math
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+TOKENS_PER_TILE = 258
+SMALL_IMAGE_SIDE = 384
+SKEW_STEP_DEGREES = 0.5
+MIN_SKEW_DEGREES = 0.2
+SKEW_SAMPLE_SIDE = 800
+
+
+@dataclasses.dataclass(frozen=True)
+class PreprocessingOptions:
+    """Limits for preprocessing, read from the environment by from_env()."""
+
+    enabled: bool = True
+    max_side: int = 1536
+    target_dpi: int = 200
+    color_mode: str = "grayscale"
+    max_skew_degrees: float = 5.0
+    crop_margin: int = 16
+    strip_aspect: float = 1.5
+    strip_overlap: float = 0.1
+
+    @classmethod
+    def from_env(cls) -> "PreprocessingOptions":
+        """Builds options from the IMAGE_PREPROCESSING* environment variables.
+
+        IMAGE_PREPROCESSING turns the stage off when set to "off".
+        IMAGE_MAX_SIDE caps the longest side in pixels, IMAGE_TARGET_DPI the
+        resolution of scans that record their DPI, IMAGE_COLOR_MODE is
+        "grayscale" or "bilevel", IMAGE_MAX_SKEW the largest rotation in
+        degrees to correct and IMAGE_CROP_MARGIN the border kept around the
+        text in pixels. Images more than IMAGE_STRIP_ASPECT times taller than
+        wide are split into strips overlapping by IMAGE_STRIP_OVERLAP of their
+        height; an aspect of 0 turns splitting off.
+        """
+        return cls(
+            enabled=os.environ.get("IMAGE_PREPROCESSING", "on").lower() != "off",
+            max_side=int(os.environ.get("IMAGE_MAX_SIDE", cls.max_side)),
+            target_dpi=int(os.environ.get("IMAGE_TARGET_DPI", cls.target_dpi)),
+            color_mode=os.environ.get("IMAGE_COLOR_MODE", cls.color_mode).lower(),
+            max_skew_degrees=float(
+                os.environ.get("IMAGE_MAX_SKEW", cls.max_skew_degrees)
+            ),
+            crop_margin=int(os.environ.get("IMAGE_CROP_MARGIN", cls.crop_margin)),
+            strip_aspect=float(os.environ.get("IMAGE_STRIP_ASPECT", cls.strip_aspect)),
+            strip_overlap=float(
+                os.environ.get("IMAGE_STRIP_OVERLAP", cls.strip_overlap)
+            ),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class PreprocessedImage:
+    """The image to send to the model and what preprocessing saved."""
+
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_tokens: int
+    tokens: int
+    skew_degrees: float = 0.0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+preprocessing_cache: LRUCache[PreprocessedImage] = LRUCache(max_size=32)
+
+
+def estimate_tokens(width: int, height: int) -> int:
+    """Estimates the Gemini input tokens for an image of the given size.
+
+    Images up to 384 pixels on both sides cost one tile. Larger images are
+    cut into square tiles sized from the shorter side, clamped to 256-768
+    pixels, and each tile costs 258 tokens.
+    """
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TOKENS_PER_TILE
+    tile = min(max(int(min(width, height) / 1.5), 256), 768)
+    return math.ceil(width / tile) * math.ceil(height / tile) * TOKENS_PER_TILE
+
+
+def preprocess(
+    data: bytes, mime_type: str, options: PreprocessingOptions
+) -> PreprocessedImage:
+    """Deskews, crops, converts and downsamples a listing image.
+
+    Results are cached by content and options. The original image is
+    returned unchanged if preprocessing is disabled, the bytes
+    cannot be decoded, or the result would cost as many tokens without being
+    smaller.
+    """
+    key = f"{hashlib.sha256(data).hexdigest()}:{options}"
+    cached = preprocessing_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = _unchanged(data, mime_type)
+    if options.enabled:
+        try:
+            processed = _preprocess(data, options)
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, sending original: {e}")
+        else:
+            if (processed.tokens, len(processed.data)) < (result.tokens, len(data)):
+                result = processed
+    preprocessing_cache.put(key, result)
+    return result
+
+
+def split_into_strips(data: bytes, options: PreprocessingOptions) -> list[bytes]:
+    """Splits a tall image into overlapping horizontal strips.
+
+    Strips are about as tall as the image is wide and are cut in the blank
+    gaps between text lines, so no line is sliced in half. Each strip also
+    covers the first lines of the next one, letting the extracted listings
+    be stitched together by line number.
+
+    Returns:
+        The strips as PNG images from top to bottom, or just the original
+        image if it is not tall enough, cannot be decoded or splitting is off.
+    """
+    if options.strip_aspect <= 0:
+        return [data]
+    try:
+        with Image.open(io.BytesIO(data)) as opened:
+            if opened.height <= opened.width * options.strip_aspect:
+                return [data]
+            image = opened.copy()
+    except Exception as e:
+        logger.warning(f"Could not split image into strips: {e}")
+        return [data]
+
+    pixels = np.asarray(image.convert("L"))
+    ink = pixels < _otsu_threshold(pixels)
+    gaps = ink.sum(axis=1) <= max(1, image.width // 500)
+    strip_height = image.width
+    overlap = int(strip_height * options.strip_overlap)
+
+    cuts = [0]
+    while image.height - cuts[-1] > strip_height * 1.25:
+        cuts.append(_snap_to_gap(gaps, cuts[-1] + strip_height, strip_height // 4))
+    cuts.append(image.height)
+
+    strips = []
+    for top, bottom in itertools.pairwise(cuts):
+        if bottom < image.height:
+            # Crop boxes exclude the bottom row, so keep the blank row itself.
+            bottom = _snap_to_gap(gaps, bottom + overlap, overlap // 2 or 1) + 1
+        buffer = io.BytesIO()
+        image.crop((0, top, image.width, bottom)).save(buffer, format="PNG")
+        strips.append(buffer.getvalue())
+    logger.info(
+        f"Split a {image.width}x{image.height} image into {len(strips)} strips."
+    )
+    return strips
+
+
+def _snap_to_gap(gaps: "np.ndarray", row: int, window: int) -> int:
+    """Returns the blank row nearest to `row`, or `row` if none is in reach."""
+    row = min(row, len(gaps) - 1)
+    for offset in range(window + 1):
+        for candidate in (row - offset, row + offset):
+            if 0 < candidate < len(gaps) and gaps[candidate]:
+                return candidate
+    return row
+
+
+def _unchanged(data: bytes, mime_type: str) -> PreprocessedImage:
+    tokens = 0
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            tokens = estimate_tokens(*image.size)
+    except Exception:
+        pass
+    return PreprocessedImage(data, mime_type, len(data), tokens, tokens)
+
+
+def _preprocess(data: bytes, options: PreprocessingOptions) -> PreprocessedImage:
+    with Image.open(io.BytesIO(data)) as opened:
+        dpi = opened.info.get("dpi")
+        original_tokens = estimate_tokens(*opened.size)
+        # Only None when transposing in place.
+        image = ImageOps.exif_transpose(opened) or opened
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            # Transparent areas of screenshots read as white paper.
+            background = Image.new("RGBA", image.size, "white")
+            image = Image.alpha_composite(background, image.convert("RGBA"))
+        gray = image.convert("L")
+
+    threshold = _otsu_threshold(np.asarray(gray))
+    skew = _skew_angle(gray, threshold, options.max_skew_degrees)
+    if skew:
+        gray = gray.rotate(
+            skew, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255
+        )
+
+    box = _text_box(np.asarray(gray) < threshold, options.crop_margin)
+    if box is not None:
+        gray = gray.crop(box)
+
+    scale = options.max_side / max(gray.size)
+    if dpi and dpi[0] > 0:
+        scale = min(scale, options.target_dpi / float(dpi[0]))
+    if scale < 1:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.Resampling.LANCZOS)
+
+    if options.color_mode == "bilevel":
+        gray = gray.point(lambda value: 255 if value >= threshold else 0).convert("1")
+
+    buffer = io.BytesIO()
+    gray.save(buffer, format="PNG", optimize=True)
+    return PreprocessedImage(
+        data=buffer.getvalue(),
+        mime_type="image/png",
+        original_bytes=len(data),
+        original_tokens=original_tokens,
+        tokens=estimate_tokens(*gray.size),
+        skew_degrees=skew,
+    )
+
+
+def _otsu_threshold(pixels: "np.ndarray") -> int:
+    """Returns the gray level that best separates ink from paper."""
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_dark = sum_dark / weight_dark
+        mean_light = (sum_dark[-1] - sum_dark) / weight_light
+        variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    if np.isnan(variance).all():
+        # A blank image has no ink to separate.
+        return 128
+    return int(np.nanargmax(variance)) + 1
+
+
+def _skew_angle(gray: "Image.Image", threshold: int, max_degrees: float) -> float:
+    """Finds the rotation that makes the text lines horizontal.
+
+    Level text rows give the horizontal projection profile the sharpest
+    steps between lines and gaps, so the angle with the largest sum of
+    squared differences between neighbouring rows wins. Corrections smaller
+    than MIN_SKEW_DEGREES are not worth resampling the image for.
+    """
+    if max_degrees <= 0:
+        return 0.0
+    sample = gray.copy()
+    sample.thumbnail((SKEW_SAMPLE_SIDE, SKEW_SAMPLE_SIDE))
+    ink = sample.point(lambda value: 255 if value < threshold else 0)
+
+    def score(angle: float) -> float:
+        rotated = np.asarray(ink.rotate(angle, expand=True), dtype=np.float64)
+        return float(np.sum(np.diff(rotated.sum(axis=1)) ** 2))
+
+    steps = int(max_degrees / SKEW_STEP_DEGREES)
+    angles = [step * SKEW_STEP_DEGREES for step in range(-steps, steps + 1)]
+    best = max(angles, key=score)
+    # Refines the coarse estimate to a tenth of a degree.
+    best = max((best + offset / 10 for offset in range(-4, 5)), key=score)
+    return round(best, 1) if abs(best) >= MIN_SKEW_DEGREES else 0.0
+
+
+def _text_box(ink: "np.ndarray", margin: int) -> tuple[int, int, int, int] | None:
+    """Returns the bounding box of the ink, ignoring specks, plus a margin."""
+    height, width = ink.shape
+    rows = np.flatnonzero(ink.sum(axis=1) > max(1, width // 500))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(1, height // 500))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return (
+        max(0, int(cols[0]) - margin),
+        max(0, int(rows[0]) - margin),
+        min(width, int(cols[-1]) + 1 + margin),
+        min(height, int(rows[-1]) + 1 + margin),
+    )
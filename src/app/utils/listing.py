@@ -0,0 +1,96 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Merging of BASIC listings extracted piece by piece.
+
+Pages and image strips are extracted separately, so the same program line can
+appear in more than one piece, partly or in full. A line wrapped across a
+page break arrives as an unnumbered fragment at the top of the next page,
+while strips of one page overlap, so a fragment at the top of a strip is the
+cut-off tail of a line the strip before already holds in full.
+"""
+
+import re
+from collections.abc import Sequence
+
+LINE_NUMBER_PATTERN = re.compile(r"^\s*(\d{1,5})(?!\d)\s*(.*)$")
+
+
+def parse_lines(listing: str) -> list[tuple[int | None, str]]:
+    """Splits a listing into (line number, statements) pairs.
+
+    Lines without a line number are returned with None so the caller can
+    treat them as the continuation of the previous line. Blank lines are
+    dropped.
+    """
+    lines: list[tuple[int | None, str]] = []
+    for text in listing.splitlines():
+        if not text.strip():
+            continue
+        match = LINE_NUMBER_PATTERN.match(text)
+        if match:
+            lines.append((int(match.group(1)), match.group(2).rstrip()))
+        else:
+            lines.append((None, text.strip()))
+    return lines
+
+
+def merge_listings(
+    listings: Sequence[str], overlaps: Sequence[bool] | None = None
+) -> str:
+    """Merges listings extracted from consecutive pieces by line number.
+
+    Unnumbered text continues the line before it, including across pages.
+    Unnumbered text at the top of a piece that overlaps the one before it is
+    dropped instead. When a line number occurs more than once the text seen most often wins,
+    then the longest text, since copies cut at a piece boundary are partial,
+    and then the earliest piece, so the result is deterministic.
+
+    Args:
+        listings: The listings in page or strip order.
+        overlaps: Whether each piece overlaps the one before it, as strips of
+            one page do. By default no piece overlaps.
+
+    Returns:
+        The merged listing in line number order, one line per number.
+    """
+    candidates: dict[int, list[tuple[int, str]]] = {}
+    previous: tuple[int, int] | None = None
+    for piece, listing in enumerate(listings):
+        top = True
+        for number, text in parse_lines(listing):
+            overlapped = top and overlaps is not None and overlaps[piece]
+            top = top and number is None
+            if number is None:
+                if previous is None or overlapped:
+                    continue
+                previous_number, index = previous
+                source, statements = candidates[previous_number][index]
+                candidates[previous_number][index] = (source, statements + text)
+                continue
+            copies = candidates.setdefault(number, [])
+            copies.append((piece, text))
+            previous = (number, len(copies) - 1)
+
+    merged = []
+    for number in sorted(candidates):
+        copies = candidates[number]
+        texts = [text for _, text in copies]
+        _, text = min(
+            copies,
+            key=lambda copy: (-texts.count(copy[1]), -len(copy[1]), copy[0]),
+        )
+        merged.append(f"{number} {text}".rstrip())
+    return "\n".join(merged) + "\n" if merged else ""
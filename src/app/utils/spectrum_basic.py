@@ -0,0 +1,2018 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process ZX Spectrum BASIC tokenizer and syntax checker.
+
+This module is a line-for-line port of the conversion and syntax checking
+performed by bas2tap v2.6, so a listing can be validated without writing temp
+files or forking the binary. Keywords are matched with a trie and tokenized
+lines are kept in a compact line table that the TAP encoder can reuse.
+The text written to stdout and stderr mirrors what bas2tap prints for the same
+input.
+"""
+
+import math
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any
+
+# Keyword token types.
+_FUNCTION = 3
+_STRING_FUNCTION = 4
+_PRINT_ITEM = 5
+_OPERATOR = 6
+
+# Syntax classes. Values below 0x20 in a class list refer to one of the
+# handlers below; anything else is a literal character or token that must
+# appear at that position.
+_CLASS_VARIABLE = 1
+_CLASS_ASSIGNMENT = 2
+_CLASS_OPTIONAL_NUMBER = 3
+_CLASS_FOR_VARIABLE = 4
+_CLASS_PRINT_LIST = 5
+_CLASS_NUMBER = 6
+_CLASS_COLOUR = 7
+_CLASS_TWO_NUMBERS = 8
+_CLASS_COORDINATES = 9
+_CLASS_STRING = 10
+_CLASS_FILE = 11
+_CLASS_STRING_LIST = 12
+_CLASS_NUMBER_LIST = 13
+_CLASS_VARIABLE_LIST = 14
+_CLASS_DEF_FN = 15
+
+_KEYWORDS: tuple[tuple[str, int, bytes], ...] = (
+    ("SPECTRUM", 1, b""),
+    ("PLAY", 1, b"\x0c"),
+    ("RND", 3, b""),
+    ("INKEY$", 4, b""),
+    ("PI", 3, b""),
+    ("FN", 3, b"\x01(\x0d)"),
+    ("POINT", 3, b"(\x08)"),
+    ("SCREEN$", 4, b"(\x08)"),
+    ("ATTR", 3, b"(\x08)"),
+    ("AT", 5, b"\x08"),
+    ("TAB", 5, b"\x06"),
+    ("VAL$", 4, b"\x0a"),
+    ("CODE", 3, b"\x0a"),
+    ("VAL", 3, b"\x0a"),
+    ("LEN", 3, b"\x0a"),
+    ("SIN", 3, b"\x06"),
+    ("COS", 3, b"\x06"),
+    ("TAN", 3, b"\x06"),
+    ("ASN", 3, b"\x06"),
+    ("ACS", 3, b"\x06"),
+    ("ATN", 3, b"\x06"),
+    ("LN", 3, b"\x06"),
+    ("EXP", 3, b"\x06"),
+    ("INT", 3, b"\x06"),
+    ("SQR", 3, b"\x06"),
+    ("SGN", 3, b"\x06"),
+    ("ABS", 3, b"\x06"),
+    ("PEEK", 3, b"\x06"),
+    ("IN", 3, b"\x06"),
+    ("USR", 3, b"\x06"),
+    ("STR$", 4, b"\x06"),
+    ("CHR$", 4, b"\x06"),
+    ("NOT", 3, b"\x06"),
+    ("BIN", 6, b""),
+    ("OR", 6, b"\x05"),
+    ("AND", 6, b"\x05"),
+    ("<=", 6, b"\x05"),
+    (">=", 6, b"\x05"),
+    ("<>", 6, b"\x05"),
+    ("LINE", 6, b""),
+    ("THEN", 6, b""),
+    ("TO", 6, b""),
+    ("STEP", 6, b""),
+    ("DEF FN", 1, b"\x0f"),
+    ("CAT", 1, b"\x0b"),
+    ("FORMAT", 1, b"\x0b"),
+    ("MOVE", 1, b"\x0b"),
+    ("ERASE", 1, b"\x0b"),
+    ("OPEN #", 1, b"\x0b"),
+    ("CLOSE #", 1, b"\x0b"),
+    ("MERGE", 1, b"\x0b"),
+    ("VERIFY", 1, b"\x0b"),
+    ("BEEP", 1, b"\x08"),
+    ("CIRCLE", 1, b"\x09,\x06"),
+    ("INK", 2, b"\x07"),
+    ("PAPER", 2, b"\x07"),
+    ("FLASH", 2, b"\x07"),
+    ("BRIGHT", 2, b"\x07"),
+    ("INVERSE", 2, b"\x07"),
+    ("OVER", 2, b"\x07"),
+    ("OUT", 1, b"\x08"),
+    ("LPRINT", 1, b"\x05"),
+    ("LLIST", 1, b"\x03"),
+    ("STOP", 1, b""),
+    ("READ", 1, b"\x0e"),
+    ("DATA", 2, b"\x0d"),
+    ("RESTORE", 1, b"\x03"),
+    ("NEW", 1, b""),
+    ("BORDER", 1, b"\x06"),
+    ("CONTINUE", 1, b""),
+    ("DIM", 1, b"\x01(\x0d)"),
+    ("REM", 1, b"\x05"),
+    ("FOR", 1, b"\x04=\x06\xcc\x06\xcd\x06"),
+    ("GO TO", 1, b"\x06"),
+    ("GO SUB", 1, b"\x06"),
+    ("INPUT", 1, b"\x05"),
+    ("LOAD", 1, b"\x0b"),
+    ("LIST", 1, b"\x03"),
+    ("LET", 1, b"\x01=\x02"),
+    ("PAUSE", 1, b"\x06"),
+    ("NEXT", 1, b"\x04"),
+    ("POKE", 1, b"\x08"),
+    ("PRINT", 1, b"\x05"),
+    ("PLOT", 1, b"\x09"),
+    ("RUN", 1, b"\x03"),
+    ("SAVE", 1, b"\x0b"),
+    ("RANDOMIZE", 1, b"\x03"),
+    ("IF", 1, b"\x06\xcb"),
+    ("CLS", 1, b""),
+    ("DRAW", 1, b"\x09,\x06"),
+    ("CLEAR", 1, b"\x03"),
+    ("RETURN", 1, b""),
+    ("COPY", 1, b""),
+)
+
+FIRST_KEYWORD = 0xA3
+KEYWORD_NAMES: tuple[str, ...] = tuple(name for name, _, _ in _KEYWORDS)
+
+_NAMES: list[bytes] = [b"(null)"] * 0x20 + [bytes([c]) for c in range(0x20, 0xA3)]
+_NAMES[0x0D] = b"(eoln)"
+_TYPES: list[int] = [_OPERATOR] * 0xA3
+_CLASSES: list[bytes] = [b""] * 0xA3
+for _name, _type, _classes in _KEYWORDS:
+    _NAMES.append(_name.encode("ascii"))
+    _TYPES.append(_type)
+    _CLASSES.append(_classes)
+_TYPES[ord(":")] = 2
+
+# Token codes referred to by the syntax checker.
+_SPECTRUM, _PLAY, _INKEY, _FN, _POINT, _SCREEN, _AT, _TAB, _CODE = (
+    0xA3,
+    0xA4,
+    0xA6,
+    0xA8,
+    0xA9,
+    0xAA,
+    0xAC,
+    0xAD,
+    0xAF,
+)
+_EXP, _IN, _USR, _RND, _BIN, _OR, _AND, _LE, _GE, _NE = (
+    0xB9,
+    0xBF,
+    0xC0,
+    0xA5,
+    0xC4,
+    0xC5,
+    0xC6,
+    0xC7,
+    0xC8,
+    0xC9,
+)
+_LINE, _THEN, _TO, _STEP, _DEF_FN, _CAT, _FORMAT, _MOVE, _ERASE = (
+    0xCA,
+    0xCB,
+    0xCC,
+    0xCD,
+    0xCE,
+    0xCF,
+    0xD0,
+    0xD1,
+    0xD2,
+)
+_OPEN, _CLOSE, _MERGE, _VERIFY, _OUT, _LPRINT, _LLIST, _DATA = (
+    0xD3,
+    0xD4,
+    0xD5,
+    0xD6,
+    0xDF,
+    0xE0,
+    0xE1,
+    0xE4,
+)
+_DIM, _REM, _FOR, _INPUT, _LOAD, _LIST, _LET, _PRINT, _SAVE = (
+    0xE9,
+    0xEA,
+    0xEB,
+    0xEE,
+    0xEF,
+    0xF0,
+    0xF1,
+    0xF5,
+    0xF8,
+)
+_IF, _CLS, _DRAW, _CLEAR = 0xFA, 0xFB, 0xFC, 0xFD
+
+_EOL = 0x0D
+_NUMBER_MARKER = 0x0E
+_NUMBER_PLACEHOLDER = b"\x0e\x00\x00\x00\x00\x00"
+_TAB_CHAR = 0x06
+_SPACE, _QUOTE, _HASH, _LPAREN, _RPAREN, _COMMA, _COLON = b' "#(),:'
+_PLUS, _MINUS, _STAR, _SLASH, _CARET, _DOT, _BANG = b"+-*/^.!"
+_SEMICOLON, _APOSTROPHE, _EQUALS, _LESS, _GREATER = b";'=<>"
+_LBRACE, _RBRACE = b"{}"
+_STATEMENT_END = (_COLON, _EOL)
+_RELATIONAL = (_EQUALS, _LESS, _GREATER, _LE, _GE, _NE)
+_FILE_TYPES = (_COLON, _EOL, _CODE, _DATA, _LINE, _SCREEN)
+
+# Embedded colour and print control sequences: name, control code and the
+# number of parameters that follow it.
+_CONTROL_SEQUENCES = (
+    (b"INK", 0x10, 1),
+    (b"PAPER", 0x11, 1),
+    (b"FLASH", 0x12, 1),
+    (b"BRIGHT", 0x13, 1),
+    (b"INVERSE", 0x14, 1),
+    (b"OVER", 0x15, 1),
+    (b"AT", 0x16, 2),
+    (b"TAB", 0x17, 2),
+)
+
+MAX_LINE_NUMBER = 9999
+MAX_PROGRAM_SIZE = 0xA21C
+_MAX_STATEMENTS = 127
+_MAX_SOURCE_LINE = 0x3FF
+
+BANNER = "\nBAS2TAP v2.6 by Martijn van der Heide of ThunderWare Research Center\n\n"
+_PROGRESS_CLEAR = b"\r" + b" " * 37 + b"\r"
+
+# Padding appended to every buffer so that looking ahead past the end of a
+# line reads NUL bytes, as the C implementation does with its line buffers.
+_PADDING = b"\x00" * 8
+
+
+def _isalpha(c: int) -> bool:
+    return 0x41 <= c <= 0x5A or 0x61 <= c <= 0x7A
+
+
+def _isdigit(c: int) -> bool:
+    return 0x30 <= c <= 0x39
+
+
+def _isalnum(c: int) -> bool:
+    return _isalpha(c) or _isdigit(c)
+
+
+def _isxdigit(c: int) -> bool:
+    return _isdigit(c) or 0x41 <= c <= 0x46 or 0x61 <= c <= 0x66
+
+
+def _toupper(c: int) -> int:
+    return c - 0x20 if 0x61 <= c <= 0x7A else c
+
+
+def _tolower(c: int) -> int:
+    return c + 0x20 if 0x41 <= c <= 0x5A else c
+
+
+def _int32(value: float) -> int:
+    """Converts a double to int the way x86 `cvttsd2si` does."""
+    if math.isnan(value) or not -(2**31) <= value < 2**31:
+        return -(2**31)
+    return int(value)
+
+
+def _floor(value: float) -> float:
+    return value if math.isinf(value) or math.isnan(value) else math.floor(value)
+
+
+def _pow(base: float, exponent: float) -> float:
+    try:
+        return math.pow(base, exponent)
+    except OverflowError:
+        return math.inf
+
+
+class _KeywordTrie:
+    """Longest-prefix keyword matcher over the token names."""
+
+    def __init__(self) -> None:
+        self._root: dict[int, Any] = {}
+        for token in range(FIRST_KEYWORD, 0x100):
+            node = self._root
+            for c in _NAMES[token]:
+                node = node.setdefault(c, {})
+            node[-1] = token
+
+    def match(self, buf: bytes, pos: int, fold_case: bool) -> tuple[int, int]:
+        """Returns the longest keyword at `pos` as (token, length), or (0, 0)."""
+        node = self._root
+        token = length = 0
+        i = pos
+        while True:
+            c = buf[i]
+            child = node.get(_toupper(c) if fold_case else c)
+            if child is None:
+                return token, length
+            node = child
+            i += 1
+            if -1 in node:
+                token, length = node[-1], i - pos
+
+
+_TRIE = _KeywordTrie()
+
+
+class LineTable:
+    """Compact table of tokenized BASIC lines.
+
+    The program is held as one contiguous buffer in the layout the Spectrum
+    uses in memory (big-endian line number, little-endian length, body ending
+    in 0x0d), with parallel arrays of line numbers and offsets for lookups.
+    """
+
+    def __init__(self) -> None:
+        self._program = bytearray()
+        self._numbers = array("H")
+        self._offsets = array("I")
+
+    def append(self, line_number: int, body: bytes) -> None:
+        """Adds a tokenized line; `body` must include the trailing 0x0d."""
+        self._numbers.append(line_number)
+        self._offsets.append(len(self._program))
+        self._program += line_number.to_bytes(2, "big")
+        self._program += len(body).to_bytes(2, "little")
+        self._program += body
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __iter__(self) -> Iterator[tuple[int, memoryview]]:
+        view = memoryview(self._program)
+        for index, number in enumerate(self._numbers):
+            start = self._offsets[index] + 4
+            end = self._end_of(index)
+            yield number, view[start:end]
+
+    def _end_of(self, index: int) -> int:
+        if index + 1 < len(self._offsets):
+            return self._offsets[index + 1]
+        return len(self._program)
+
+    @property
+    def line_numbers(self) -> list[int]:
+        return self._numbers.tolist()
+
+    @property
+    def program(self) -> memoryview:
+        """The program area exactly as it is stored in a TAP data block."""
+        return memoryview(self._program).toreadonly()
+
+    def find(self, line_number: int) -> memoryview | None:
+        """Returns the tokenized body of `line_number`, or None."""
+        for index, number in enumerate(self._numbers):
+            if number == line_number:
+                start = self._offsets[index] + 4
+                return memoryview(self._program)[start : self._end_of(index)]
+        return None
+
+
+@dataclass(frozen=True)
+class ConversionResult:
+    """Outcome of converting a listing.
+
+    Attributes:
+        stdout: Text bas2tap would print on stdout (banner, progress, notes).
+        stderr: Error messages bas2tap would print on stderr.
+        lines: Every line that converted successfully.
+        ok: True when the whole listing converted without errors.
+        is_48k: True if the program needs 48K mode, False if it needs 128K
+            mode, None if it runs in either.
+        interface: 0 for Interface 1 or Opus Discovery, 1 for Interface 1,
+            2 for Opus Discovery, None if no disk/network commands are used.
+    """
+
+    stdout: str
+    stderr: str
+    lines: LineTable
+    ok: bool
+    is_48k: bool | None
+    interface: int | None
+
+
+class _Converter:
+    """Holds the state that bas2tap keeps in globals across a conversion."""
+
+    def __init__(
+        self, case_independent: bool, warnings: bool, check_syntax: bool
+    ) -> None:
+        self._case_independent = case_independent
+        self._warnings = warnings
+        self._check_syntax = check_syntax
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.lines = LineTable()
+        self.is_48k = -1
+        self.uses_interface1 = -1
+        self._previous_line = -1
+        self._bracket_count = 0
+        self._inside_def_fn = False
+        self._handling_def_fn = False
+        self._line_number = 0
+        self._statement = 0
+        self._buf = b""
+        self._p = 0
+        self._handlers = {
+            _CLASS_VARIABLE: self._class_variable,
+            _CLASS_ASSIGNMENT: self._class_assignment,
+            _CLASS_OPTIONAL_NUMBER: self._class_optional_number,
+            _CLASS_FOR_VARIABLE: self._class_for_variable,
+            _CLASS_PRINT_LIST: self._class_print_list,
+            _CLASS_NUMBER: self._class_number,
+            _CLASS_COLOUR: self._class_number,
+            _CLASS_TWO_NUMBERS: self._class_two_numbers,
+            _CLASS_COORDINATES: self._class_coordinates,
+            _CLASS_STRING: self._class_string,
+            _CLASS_FILE: self._class_file,
+            _CLASS_STRING_LIST: self._class_string_list,
+            _CLASS_NUMBER_LIST: self._class_number_list,
+            _CLASS_VARIABLE_LIST: self._class_variable_list,
+            _CLASS_DEF_FN: self._class_def_fn,
+        }
+        self._var_type = 1
+        self._list_type = 0
+        self._depth = 0
+        self._stale: dict[int, int] = {}
+
+    # -- Output -------------------------------------------------------------
+
+    def _error(self, message: bytes, *args: object) -> bool:
+        """Reports a statement level error and returns False."""
+        self.stderr += b"ERROR in line %d, statement %d - " % (
+            self._line_number,
+            self._statement,
+        )
+        self.stderr += (message % args if args else message) + b"\n"
+        return False
+
+    def _expected(self, what: bytes) -> bool:
+        return self._error(
+            b'Expected %s, but got "%s"', what, _NAMES[self._buf[self._p]]
+        )
+
+    # -- Conversion ---------------------------------------------------------
+
+    def convert(self, source: bytes, output_name: str) -> bool:
+        self.stdout += BANNER.encode("latin-1")
+        self.stdout += b"Creating output file %s\n" % output_name.encode("latin-1")
+        ok = True
+        file_line = 0
+        total = 0
+        pos = 0
+        while ok and pos < len(source):
+            end = source.find(b"\n", pos, pos + _MAX_SOURCE_LINE + 1)
+            chunk_end = end + 1 if end >= 0 else min(len(source), pos + 0x400)
+            chunk = source[pos:chunk_end].split(b"\x00", 1)[0]
+            pos = chunk_end
+            file_line += 1
+            if len(chunk) > _MAX_SOURCE_LINE:
+                self.stderr += b"ERROR - Line %d too long\n" % file_line
+                ok = False
+                break
+            line_number, rest = self._prepare_line(chunk, file_line)
+            if line_number == -2:
+                continue
+            if line_number < 0:
+                ok = False
+                break
+            if line_number > MAX_LINE_NUMBER:
+                self.stderr += (
+                    b"ERROR - Line number %d is larger than the maximum allowed\n"
+                    % line_number
+                )
+                ok = False
+                break
+            self.stdout += b"\rConverting line %4d -> %4d\r" % (
+                file_line,
+                line_number,
+            )
+            self._line_number = line_number
+            body = bytearray()
+            ok = self._tokenize(rest + _PADDING, body)
+            body.append(_EOL)
+            if ok and self._bracket_count:
+                ok = self._error(b"Too few closing brackets")
+            if ok and self._check_syntax:
+                ok = self._check_line(bytes(body))
+            if ok:
+                total += len(body) + 4
+                if total > MAX_PROGRAM_SIZE:
+                    self.stderr += (
+                        b"ERROR - Object file too large at line %d!\n" % line_number
+                    )
+                    ok = False
+                else:
+                    self.lines.append(line_number, bytes(body))
+        self.stdout += _PROGRESS_CLEAR
+        if ok:
+            self.stdout += b"Done! Listing contains %d %s.\n" % (
+                file_line,
+                b"line" if file_line == 1 else b"lines",
+            )
+        else:
+            self.stdout += b"Listing as far as done contains %d %s.\n" % (
+                file_line - 1,
+                b"line" if file_line == 2 else b"lines",
+            )
+        if self.is_48k >= 0:
+            self.stdout += b"Note: this program can only be used in %dK mode\n" % (
+                48 if self.is_48k == 1 else 128
+            )
+        if self.uses_interface1 == 0:
+            self.stdout += (
+                b"Note: this program requires Interface 1 or Opus Discovery\n"
+            )
+        elif self.uses_interface1 == 1:
+            self.stdout += b"Note: this program requires Interface 1\n"
+        elif self.uses_interface1 == 2:
+            self.stdout += b"Note: this program requires an Opus Discovery"
+        return ok
+
+    def _prepare_line(self, chunk: bytes, file_line: int) -> tuple[int, bytes]:
+        """Collapses whitespace outside strings and splits off the line number.
+
+        Returns the line number and the remaining text, -2 for a line that
+        should be skipped or -1 when conversion has to stop.
+        """
+        out = bytearray()
+        in_string = in_rem = previous_space = False
+        ok = True
+        i = 0
+        while i < len(chunk):
+            c = chunk[i]
+            if c == 0x09:
+                out.append(_TAB_CHAR)
+                i += 1
+                continue
+            if c <= 0x1F or c >= 0x7F:
+                ok = False
+                break
+            if not in_rem and chunk[i : i + 5].upper() in (b" REM ", b":REM "):
+                in_rem = True
+            if in_string or in_rem:
+                out.append(c)
+            elif c == _SPACE:
+                if not previous_space:
+                    out.append(c)
+                previous_space = True
+            else:
+                previous_space = False
+                out.append(c)
+            if c == _QUOTE and not in_rem:
+                in_string = not in_string
+            i += 1
+        if not ok and chunk[i] in (0x0D, 0x0A):
+            ok = True
+        bad_char = chunk[i] if not ok else 0
+
+        line_number, rest = self._line_number_of(bytes(out))
+        if in_string:
+            kind = b"BASIC" if line_number >= 0 else b"ASCII"
+            self.stderr += b"ERROR - %s line %d misses terminating quote\n" % (
+                kind,
+                line_number if line_number >= 0 else file_line,
+            )
+            ok = False
+        elif not ok:
+            kind = b"BASIC" if line_number >= 0 else b"ASCII"
+            code = bad_char if bad_char < 0x80 else 0xFFFFFF00 | bad_char
+            self.stderr += (
+                b"ERROR - %s line %d contains a bad character (code %02Xh)\n"
+                % (kind, line_number if line_number >= 0 else file_line, code)
+            )
+        elif line_number < 0:
+            if not rest:
+                if self._warnings:
+                    self.stdout += b"WARNING - Skipping empty ASCII line %d\n" % (
+                        file_line
+                    )
+                return -2, b""
+            self.stderr += b"ERROR - Missing line number in ASCII line %d\n" % (
+                file_line
+            )
+            ok = False
+        elif self._previous_line >= 0:
+            if line_number < self._previous_line:
+                self.stderr += (
+                    b"ERROR - Line number %d is smaller than previous line number %d\n"
+                    % (line_number, self._previous_line)
+                )
+                ok = False
+            elif line_number == self._previous_line and self._warnings:
+                self.stdout += b"WARNING - Duplicate use of line number %d\n" % (
+                    line_number
+                )
+        elif not rest:
+            self.stderr += b"ERROR - Line %d contains no statements!\n" % line_number
+            ok = False
+        self._previous_line = line_number
+        return (line_number if ok else -1), rest
+
+    @staticmethod
+    def _line_number_of(line: bytes) -> tuple[int, bytes]:
+        i = 0
+        while i < len(line) and line[i] == _SPACE:
+            i += 1
+        if i == len(line) or not _isdigit(line[i]):
+            return -1, line[i:]
+        number = 0
+        while i < len(line) and _isdigit(line[i]):
+            number = (number * 10 + line[i] - 0x30) & 0xFFFFFFFF
+            i += 1
+        if number >= 2**31:
+            number -= 2**32
+        while i < len(line) and line[i] == _SPACE:
+            i += 1
+        return number, line[i:]
+
+    def _tokenize(self, s: bytes, out: bytearray) -> bool:
+        """Tokenizes the text of one line into `out`."""
+        in_string = False
+        expect_keyword = True
+        self._statement = 1
+        self._handling_def_fn = False
+        ok = True
+        i = 0
+        while s[i] and ok:
+            c = s[i]
+            if in_string:
+                if c == _QUOTE:
+                    out.append(c)
+                    i += 1
+                    in_string = False
+                    while s[i] == _SPACE:
+                        i += 1
+                else:
+                    result, i = self._expand_sequence(s, i, out, False)
+                    if result == 0:
+                        out.append(c)
+                        i += 1
+                    elif result < 0:
+                        ok = False
+            elif c == _QUOTE:
+                if expect_keyword:
+                    ok = self._error(b"Expected keyword but got quote")
+                else:
+                    in_string = True
+                    out.append(c)
+                    i += 1
+            elif expect_keyword:
+                result, token, i = self._match_token(s, i, True)
+                if result == -1:
+                    ok = self._error(
+                        b'Expected keyword but got token "%s"', _NAMES[token]
+                    )
+                elif result == -2:
+                    ok = False
+                elif result == 0:
+                    ok = self._error(b'Expected keyword but got "%s"', _NAMES[s[i]])
+                else:
+                    out.append(token)
+                    if token != _COLON:
+                        expect_keyword = False
+                    if token == _DEF_FN:
+                        self._handling_def_fn = True
+                        self._inside_def_fn = False
+                    elif token == _REM:
+                        while s[i]:
+                            result, i = self._expand_sequence(s, i, out, False)
+                            if result == 0:
+                                out.append(s[i])
+                                i += 1
+                            elif result < 0:
+                                # bas2tap spins forever here; report it once.
+                                ok = False
+                                break
+            elif c == _LPAREN:
+                self._bracket_count += 1
+                out.append(c)
+                i += 1
+                if self._handling_def_fn and not self._inside_def_fn:
+                    self._inside_def_fn = True
+            elif c == _RPAREN:
+                if self._handling_def_fn and self._inside_def_fn:
+                    out += _NUMBER_PLACEHOLDER
+                    self._handling_def_fn = self._inside_def_fn = False
+                self._bracket_count -= 1
+                if self._bracket_count < 0:
+                    ok = self._error(b"Too many closing brackets")
+                else:
+                    out.append(c)
+                    i += 1
+            elif c == _COMMA and self._handling_def_fn and self._inside_def_fn:
+                out += _NUMBER_PLACEHOLDER
+                out.append(c)
+                i += 1
+            else:
+                result, token, i = self._match_token(s, i, False)
+                if result == -1:
+                    ok = self._error(b'Unexpected keyword "%s"', _NAMES[token])
+                elif result == -2:
+                    ok = False
+                elif result == 1:
+                    out.append(token)
+                    if token in (_COLON, _THEN):
+                        expect_keyword = True
+                        self._handling_def_fn = False
+                        if self._bracket_count:
+                            ok = self._error(b"Too few closing brackets")
+                        self._statement += 1
+                        if ok and self._statement > _MAX_STATEMENTS:
+                            self.stderr += (
+                                b"ERROR - Line %d has too many statements\n"
+                                % self._line_number
+                            )
+                            ok = False
+                    elif token == _BIN:
+                        ok, i = self._handle_bin(s, i, out)
+                else:
+                    result, i = self._handle_number(s, i, out)
+                    if result < 0:
+                        ok = False
+                    elif result == 0:
+                        result, i = self._expand_sequence(s, i, out, True)
+                        if result < 0:
+                            ok = False
+                        elif result == 0:
+                            if _isalpha(s[i]):
+                                while _isalnum(s[i]):
+                                    out.append(s[i])
+                                    i += 1
+                            else:
+                                out.append(s[i])
+                                i += 1
+        return ok
+
+    def _match_token(
+        self, s: bytes, i: int, want_keyword: bool
+    ) -> tuple[int, int, int]:
+        """Matches a keyword at `i`.
+
+        Returns (1, token, new position) on a match, (0, 0, i) when there is
+        no keyword, (-1, token, ...) when the keyword is not allowed here and
+        (-2, token, ...) when it clashes with the 48K/128K mode.
+        """
+        if s[i] == _COLON:
+            token, length = _COLON, 1
+        else:
+            token, length = _TRIE.match(s, i, self._case_independent)
+            if not token:
+                return 0, 0, i
+        if _isalpha(s[i + length - 1]) and _isalpha(s[i + length]):
+            return 0, 0, i
+        i += length
+        while s[i] == _SPACE:
+            i += 1
+        if token in (_SPECTRUM, _PLAY):
+            if self.is_48k == 1:
+                self.stderr += (
+                    b"ERROR - Line %d contains a 128K keyword, but the program\n"
+                    b"also uses UDGs 'T' and/or 'U'\n" % self._line_number
+                )
+                return -2, token, i
+            if self.is_48k == -1:
+                self.is_48k = 0
+        if want_keyword and _TYPES[token] == 0:
+            return -1, token, i
+        if not want_keyword and _TYPES[token] == 1:
+            return -1, token, i
+        return 1, token, i
+
+    def _handle_number(self, s: bytes, i: int, out: bytearray) -> tuple[int, int]:
+        """Copies a numeric literal and appends its hidden 5-byte form."""
+        if not (_isdigit(s[i]) or s[i] == _DOT):
+            return 0, i
+        start = i
+        value = 0.0
+        while _isdigit(s[i]):
+            value = value * 10.0 + s[i] - 48.0
+            i += 1
+        if s[i] == _DOT:
+            i += 1
+            divisor = 1.0
+            while _isdigit(s[i]):
+                divisor /= 10.0
+                value += (s[i] - 0x30) * divisor
+                i += 1
+        if s[i] in b"eE":
+            i += 1
+            negative = False
+            if s[i] == _PLUS:
+                i += 1
+            elif s[i] == _MINUS:
+                negative = True
+                i += 1
+            exponent = 0.0
+            while _isdigit(s[i]):
+                exponent = exponent * 10.0 + s[i] - 48.0
+                i += 1
+            if negative:
+                value /= _pow(10.0, exponent)
+            else:
+                value *= _pow(10.0, exponent)
+        out += s[start:i]
+
+        integer = _int32(_floor(value))
+        if integer == value and -65536.0 <= value < 65536.0:
+            out += b"\x0e\x00"
+            if integer < 0:
+                out.append(0xFF)
+                integer += 0x10000
+            else:
+                out.append(0x00)
+            out += bytes((integer & 0xFF, (integer >> 8) & 0xFF, 0x00))
+            return 1, i
+
+        sign = 0
+        if value < 0:
+            sign = 0x80
+            value = -value
+        exponent = _floor(math.log(value) / 0.6931471805599453) if value else -math.inf
+        if exponent < -129.0 or exponent > 126.0:
+            self.stderr += b"ERROR - Number too big in line %d\n" % self._line_number
+            return -1, i
+        if math.isnan(exponent):
+            mantissa = 1 << 63
+        else:
+            mantissa = math.floor(
+                (value / _pow(2.0, exponent) - 1) * 2147483648.0 + 0.5
+            )
+        mantissa &= 0xFFFFFFFFFFFFFFFF
+        out += bytes(
+            (
+                _NUMBER_MARKER,
+                (_int32(exponent) - 0x7F) & 0xFF,
+                ((mantissa >> 24) | sign) & 0xFF,
+                (mantissa >> 16) & 0xFF,
+                (mantissa >> 8) & 0xFF,
+                mantissa & 0xFF,
+            )
+        )
+        return 1, i
+
+    def _handle_bin(self, s: bytes, i: int, out: bytearray) -> tuple[bool, int]:
+        value = 0
+        while s[i] in b"01":
+            value = value * 2 + s[i] - 0x30
+            if value > 0xFFFF:
+                self.stderr += (
+                    b"ERROR - Number too big in line %d\n" % self._line_number
+                )
+                return False, i
+            out.append(s[i])
+            i += 1
+        out += bytes((_NUMBER_MARKER, 0, 0, value & 0xFF, value >> 8, 0))
+        return True, i
+
+    def _expand_sequence(
+        self, s: bytes, i: int, out: bytearray, strip_spaces: bool
+    ) -> tuple[int, int]:
+        """Expands a `{...}` escape at `i`.
+
+        Returns 1 and the new position when a sequence was expanded, 0 when
+        the text should be copied as is and -1 on an error.
+        """
+        if s[i] != _LBRACE:
+            return 0, i
+        j = i + 1
+        if s[j : j + 5].upper() == b"CODE}":
+            out.append(_CODE)
+            return 1, i + 6
+        if s[j : j + 4].upper() == b"CAT}":
+            out.append(_CAT)
+            return 1, i + 5
+        if s[j : j + 4].upper() == b"(C)}":
+            out.append(0x7F)
+            i += 5
+        elif s[j] == _PLUS and 0x31 <= s[j + 1] <= 0x38 and s[j + 2] == _RBRACE:
+            out.append((((s[j + 1] - 0x30) % 8) ^ 7) + 0x88)
+            i += 4
+        elif s[j] == _MINUS and 0x31 <= s[j + 1] <= 0x38 and s[j + 2] == _RBRACE:
+            out.append((s[j + 1] - 0x30) % 8 + 0x80)
+            i += 4
+        elif 0x41 <= _toupper(s[j]) <= 0x55 and s[j + 1] == _RBRACE:
+            udg = _toupper(s[j])
+            if udg in b"TU":
+                if self.is_48k == 0:
+                    self.stderr += (
+                        b"ERROR - Line %d contains UDGs 'T' and/or 'U'\n"
+                        b"but the program was already marked 128K\n" % self._line_number
+                    )
+                    return -1, i
+                if self.is_48k == -1:
+                    self.is_48k = 1
+            out.append(udg + 0x4F)
+            i += 3
+        elif _isxdigit(s[j]) and _isxdigit(s[j + 1]) and s[j + 2] == _RBRACE:
+            out.append(_hex_digit(s[j]) * 16 + _hex_digit(s[j + 1]))
+            i += 4
+        else:
+            end = self._expand_control(s, j, out)
+            if end < 0:
+                if self._warnings:
+                    close = s.find(b"}", i)
+                    nul = s.find(b"\x00", i)
+                    if 0 <= close < nul:
+                        self.stdout += (
+                            b'WARNING - Unexpandable sequence "%s" in line %d\n'
+                            % (s[i : close + 1], self._line_number)
+                        )
+                return 0, i
+            i = end
+        if strip_spaces:
+            while s[i] == _SPACE:
+                i += 1
+        return 1, i
+
+    @staticmethod
+    def _expand_control(s: bytes, j: int, out: bytearray) -> int:
+        """Expands `{INK n}` style sequences; returns the end or -1."""
+        for name, code, count in _CONTROL_SEQUENCES:
+            if s[j : j + len(name)].upper() != name:
+                continue
+            j += len(name)
+            values = []
+            for index in range(count):
+                if index:
+                    if s[j] != _COMMA:
+                        return -1
+                    j += 1
+                while s[j] == _SPACE:
+                    j += 1
+                value = 0
+                while _isdigit(s[j]):
+                    value = (value * 10 + s[j] - 0x30) & 0xFF
+                    j += 1
+                values.append(value)
+            if s[j] != _RBRACE:
+                return -1
+            out.append(code)
+            out += bytes(values)
+            return j + 1
+        return -1
+
+    # -- Syntax checking ----------------------------------------------------
+
+    def _check_line(self, body: bytes) -> bool:
+        """Checks the syntax of one tokenized line (ending in 0x0d)."""
+        compact = bytearray()
+        i = 0
+        while i < len(body) and body[i] != _EOL:
+            c = body[i]
+            if c == _NUMBER_MARKER:
+                compact.append(c)
+                i += 6
+            elif 0x10 <= c <= 0x15:
+                i += 2
+            elif c in (0x16, 0x17):
+                i += 3
+            else:
+                if c > 0x20:
+                    compact.append(c)
+                i += 1
+        compact.append(_EOL)
+        self._buf = bytes(compact) + _PADDING
+        self._p = 0
+        self._statement = 0
+        self._list_type = 0
+        b = self._buf
+        ok = True
+        while ok and b[self._p] != _EOL:
+            self._statement += 1
+            keyword = b[self._p]
+            self._p += 1
+            if keyword == _REM:
+                return True
+            if _TYPES[keyword] not in (0, 1, 2):
+                if keyword == _POINT and b[self._p] == _HASH:
+                    self._p += 1
+                    if not self._scan_stream(keyword):
+                        return False
+                    if b[self._p] != _SEMICOLON:
+                        return self._expected(b'";"')
+                    self._p += 1
+                    ok = self._class_number(keyword)
+                else:
+                    self.stderr += (
+                        b'ERROR - Keyword ("%s") error in line %d, statement %d\n'
+                        % (_NAMES[keyword], self._line_number, self._statement)
+                    )
+                    return False
+            else:
+                ok = self._check_statement(keyword)
+            if ok and keyword != _IF and b[self._p] not in _STATEMENT_END:
+                if keyword == _CLS and b[self._p] == _HASH:
+                    self._p += 1
+                    if not self._signal_interface1(0):
+                        return False
+                    if b[self._p] not in _STATEMENT_END:
+                        ok = self._end_of_statement_error()
+                else:
+                    ok = self._end_of_statement_error()
+            if ok and b[self._p] == _COLON:
+                self._p += 1
+                while b[self._p] == _COLON:
+                    self._p += 1
+                    self._statement += 1
+        return ok
+
+    def _end_of_statement_error(self) -> bool:
+        return self._error(
+            b'Expected end of statement, but got "%s"', _NAMES[self._buf[self._p]]
+        )
+
+    def _check_statement(self, keyword: int) -> bool:
+        b = self._buf
+        if keyword in (_LLIST, _LIST) and b[self._p] == _HASH:
+            self._p += 1
+            if not self._scan_stream(keyword):
+                return False
+            if b[self._p] not in _STATEMENT_END:
+                if b[self._p] != _COMMA:
+                    return self._expected(b'","')
+                self._p += 1
+        classes = _CLASSES[keyword]
+        index = 0
+        while index < len(classes):
+            item = classes[index]
+            if b[self._p] == _EOL:
+                if item in (_CLASS_OPTIONAL_NUMBER, _CLASS_PRINT_LIST):
+                    pass
+                elif (keyword == _FOR and item == _STEP) or (
+                    keyword == _DRAW and item == _COMMA
+                ):
+                    index += 2
+                    continue
+                else:
+                    return self._error(b"Unexpected end of line")
+            if item > 0x1F:
+                if b[self._p] == item:
+                    self._p += 1
+                elif b[self._p] == _COLON and (
+                    (keyword == _FOR and item == _STEP)
+                    or (keyword == _DRAW and item == _COMMA)
+                ):
+                    index += 1
+                else:
+                    return self._error(
+                        b'Expected "%s", but got "%s"',
+                        _NAMES[item],
+                        _NAMES[b[self._p]],
+                    )
+            elif not self._handlers[item](keyword):
+                return False
+            index += 1
+        return True
+
+    def _check_end(self) -> bool:
+        """Reports an error and returns True at the end of a statement."""
+        if self._buf[self._p] in _STATEMENT_END:
+            self._error(b"Unexpected end of statement")
+            return True
+        return False
+
+    def _scan_variable(self, mode: int) -> tuple[bool, int, int]:
+        """Scans a variable name with optional indices or slicing.
+
+        `mode` is -1 when no brackets may follow, 0 when indexing is not
+        allowed, 1 when anything goes and 2 when slicing is not allowed.
+        Returns (ok, is_numeric, name length).
+        """
+        b = self._buf
+        is_numeric = 1
+        if not _isalpha(b[self._p]):
+            return False, is_numeric, 0
+        length = 1
+        self._p += 1
+        while _isalnum(b[self._p]):
+            length += 1
+            self._p += 1
+        if b[self._p] == ord("$"):
+            if length > 1:
+                self._error(b"String variables can only have single character names")
+                return False, is_numeric, length
+            self._p += 1
+            is_numeric = 0
+        if mode < 0 or b[self._p] != _LPAREN:
+            return True, is_numeric, length
+        if length > 1:
+            self._error(b"Arrays can only have single character names")
+            return False, is_numeric, length
+        if mode == 0:
+            self._error(b"Slicing/Indexing not allowed")
+            return False, is_numeric, length
+        self._p += 1
+        if b[self._p] == _RPAREN:
+            self._error(b"Empty array index not allowed")
+            return False, is_numeric, length
+        slot = 0
+        if b[self._p] == _TO:
+            if mode == 2:
+                self._error(b'Slicing token "TO" inappropriate for arrays')
+                return False, is_numeric, length
+        else:
+            ok, slot = self._scan_expression(_LPAREN, slot, 0)
+            if not ok:
+                return False, is_numeric, length
+            if slot == 0:
+                self._error(b"Variables indices must be numeric")
+                return False, is_numeric, length
+            if b[self._p] == _RPAREN:
+                self._p += 1
+                return True, is_numeric, length
+        array_index = False
+        if b[self._p] not in (_TO, _COMMA):
+            self._error(b'Unexpected index character "%c"', b[self._p])
+            return False, is_numeric, length
+        if b[self._p] == _COMMA:
+            array_index = True
+        elif mode == 2:
+            self._error(b'Slicing token "TO" inappropriate for arrays')
+            return False, is_numeric, length
+        elif is_numeric:
+            self._error(b"Only character strings can be sliced")
+            return False, is_numeric, length
+        while True:
+            self._p += 1
+            ok, slot = self._scan_expression(_LPAREN, slot, 0)
+            if not ok:
+                return False, is_numeric, length
+            if slot == 0:
+                self._error(b"Variables indices must be numeric")
+                return False, is_numeric, length
+            if not array_index:
+                if b[self._p] != _RPAREN:
+                    self._expected(b'")"')
+                    return False, is_numeric, length
+            elif b[self._p] not in (_COMMA, _RPAREN, _TO):
+                self._expected(b'","')
+                return False, is_numeric, length
+            if b[self._p] == _RPAREN:
+                self._p += 1
+                return True, is_numeric, length
+
+    def _slice_string(self) -> bool:
+        """Checks a slice directly following a string, e.g. `"abc"(2 TO)`."""
+        b = self._buf
+        self._p += 1
+        if b[self._p] == _RPAREN:
+            self._p += 1
+            return True
+        slot = 0
+        if b[self._p] != _TO:
+            ok, slot = self._scan_expression(_LPAREN, slot, 0)
+            if not ok:
+                return False
+            if slot == 0:
+                return self._error(b"Slice values must be numeric")
+            if b[self._p] == _RPAREN:
+                self._p += 1
+                return True
+            if b[self._p] != _TO:
+                return self._error(b"Unexpected index character")
+        self._p += 1
+        if b[self._p] == _RPAREN:
+            self._p += 1
+            return True
+        ok, slot = self._scan_expression(_LPAREN, slot, 0)
+        if not ok:
+            return False
+        if slot == 0:
+            return self._error(b"Slice values must be numeric")
+        if b[self._p] != _RPAREN:
+            return self._expected(b'")"')
+        self._p += 1
+        return True
+
+    def _skip_string(self) -> bool:
+        """Skips a string literal (and any `""` escapes) starting at a quote."""
+        b = self._buf
+        while b[self._p] == _QUOTE:
+            self._p += 1
+            while b[self._p] != _QUOTE:
+                if b[self._p] == _EOL:
+                    return self._error(b"Unexpected end of line")
+                self._p += 1
+            self._p += 1
+        return True
+
+    def _scan_expression(
+        self, keyword: int, type_: int, level: int
+    ) -> tuple[bool, int]:
+        """Scans an expression, tracking whether it is numeric (1) or not (0).
+
+        `type_` carries the caller's type slot in and out, as bas2tap passes it
+        by reference and does not always assign it. The type of a bracketed or
+        OR'ed operand lands in an uninitialised stack slot in bas2tap, so the
+        value last left at the same nesting depth is reused to match it.
+        """
+        self._depth += 1
+        try:
+            return self._scan_expression_at(keyword, type_, level)
+        finally:
+            self._depth -= 1
+
+    def _scan_expression_at(
+        self, keyword: int, type_: int, level: int
+    ) -> tuple[bool, int]:
+        b = self._buf
+        more = True
+        current = 1
+        have_type = False
+        fixed = False
+        sub = self._stale.get(self._depth, 0)
+        if b[self._p] in (_PLUS, _MINUS):
+            type_ = 1
+            have_type = True
+            self._p += 1
+        while more:
+            c = b[self._p]
+            if c == _LPAREN:
+                self._p += 1
+                ok, sub = self._scan_expression(_LPAREN, sub, level + 1)
+                self._stale[self._depth] = sub
+                if not ok:
+                    return False, type_
+                if have_type and sub != current:
+                    return self._error(b"Type conflict in expression"), type_
+                if not have_type:
+                    current = sub
+                    have_type = True
+                self._p += 1
+                if b[self._p] == _LPAREN:
+                    if sub:
+                        return self._error(b"cannot slice a numerical value"), type_
+                    if not self._slice_string():
+                        return False, type_
+            elif c == _RPAREN:
+                return True, type_ if fixed else current
+            elif c in _STATEMENT_END:
+                if not fixed:
+                    type_ = current
+                if level:
+                    return self._error(b"too few closing brackets"), type_
+                more = False
+            elif _isdigit(c) or c in (_DOT, _BIN):
+                if not have_type:
+                    have_type = True
+                    current = 1
+                elif current == 0:
+                    return self._error(b"Type conflict in expression"), type_
+                self._p += 1
+                while b[self._p] != _NUMBER_MARKER:
+                    self._p += 1
+                self._p += 1
+            elif c == _QUOTE:
+                if not have_type:
+                    have_type = True
+                    current = 0
+                elif current:
+                    return self._error(b"Type conflict in expression"), type_
+                self._skip_quoted()
+                if b[self._p] == _LPAREN and not self._slice_string():
+                    return False, type_
+            else:
+                ok, sub, length = self._scan_variable(1)
+                self._stale[self._depth] = sub
+                if ok:
+                    if have_type and sub != current:
+                        return self._error(b"Type conflict in expression"), type_
+                    if not have_type:
+                        current = sub
+                        have_type = True
+                elif length:
+                    return False, type_
+                else:
+                    kind = _TYPES[c]
+                    if kind == 0:
+                        return self._error(b'Unexpected token "%s"', _NAMES[c]), type_
+                    if kind in (1, 2):
+                        return (
+                            self._error(b'Unexpected keyword "%s"', _NAMES[c]),
+                            type_,
+                        )
+                    if kind != _OPERATOR:
+                        self._p += 1
+                        if kind == _PRINT_ITEM:
+                            if keyword not in (_PRINT, _LPRINT):
+                                return (
+                                    self._error(
+                                        b'Unexpected token "%s"', _NAMES[b[self._p]]
+                                    ),
+                                    type_,
+                                )
+                            if not self._function_arguments(c):
+                                return False, type_
+                        elif c == _USR and b[self._p] == _QUOTE:
+                            if not self._udg_address():
+                                return False, type_
+                        else:
+                            if not have_type:
+                                have_type = True
+                                current = 1 if kind == _FUNCTION else 0
+                            elif (current and kind == _STRING_FUNCTION) or (
+                                not current and kind == _FUNCTION
+                            ):
+                                return (
+                                    self._error(b"Type conflict in expression"),
+                                    type_,
+                                )
+                            if not self._function_arguments(c):
+                                return False, type_
+                            if c == _INKEY and b[self._p] == _HASH:
+                                self._p += 1
+                                if not self._scan_stream(c):
+                                    return False, type_
+
+            if _TYPES[keyword] in (_FUNCTION, _STRING_FUNCTION):
+                return True, type_ if fixed else current
+            if not more:
+                break
+            c = b[self._p]
+            if c in (_OR, _AND):
+                if c == _OR and type_ == 0:
+                    return self._error(b'"OR" requires a numeric left value'), type_
+                self._p += 1
+                ok, sub = self._scan_expression(c, sub, 0)
+                self._stale[self._depth] = sub
+                if not ok:
+                    return False, type_
+                if sub == 0:
+                    return (
+                        self._error(b'"%s" requires a numeric right value', _NAMES[c]),
+                        type_,
+                    )
+                if not have_type:
+                    have_type = fixed = True
+                    type_ = 0 if c == _AND and type_ == 0 else 1
+                    current = type_
+                more = False
+            elif c in _RELATIONAL:
+                if level:
+                    current = 1
+                type_ = 1
+                fixed = True
+                have_type = False
+                self._p += 1
+            elif c == _PLUS:
+                self._p += 1
+            elif c in (_MINUS, _STAR, _SLASH, _CARET):
+                if current == 0:
+                    return self._error(b"Type conflict in expression"), type_
+                self._p += 1
+            else:
+                more = False
+        return True, type_ if fixed else current
+
+    def _skip_quoted(self) -> None:
+        b = self._buf
+        while True:
+            self._p += 1
+            while b[self._p] != _QUOTE:
+                self._p += 1
+            self._p += 1
+            if b[self._p] != _QUOTE:
+                return
+
+    def _udg_address(self) -> bool:
+        """Checks `USR "a"`, which yields the address of a UDG."""
+        b = self._buf
+        self._p += 1
+        if self._check_end():
+            return False
+        if not 0x41 <= _toupper(b[self._p]) <= 0x55:
+            return self._error(b'Bad UDG "%s"', _NAMES[b[self._p]])
+        self._p += 1
+        if self._check_end():
+            return False
+        if b[self._p] != _QUOTE:
+            return self._error(b"An UDG name may be only 1 letter")
+        self._p -= 1
+        if _toupper(b[self._p]) in b"TU":
+            if self.is_48k == 0:
+                self.stderr += (
+                    b"ERROR - Line %d contains UDGs 'T' and/or 'U'\n"
+                    b"but the program was already marked 128K\n" % self._line_number
+                )
+                return False
+            if self.is_48k == -1:
+                self.is_48k = 1
+        self._p += 2
+        return True
+
+    def _function_arguments(self, token: int) -> bool:
+        b = self._buf
+        # The variable type written by class 1 is local to this call.
+        var_type = self._var_type
+        try:
+            return self._check_arguments(b, token)
+        finally:
+            self._var_type = var_type
+
+    def _check_arguments(self, b: bytes, token: int) -> bool:
+        for item in _CLASSES[token]:
+            if self._check_end():
+                return False
+            if item > 0x1F:
+                if b[self._p] != item:
+                    return self._error(
+                        b'Expected "%c", but got "%s"', item, _NAMES[b[self._p]]
+                    )
+                self._p += 1
+            elif item in (1, 3, 5, 6, 8, 10, 12, 13, 14):
+                if not self._handlers[item](token):
+                    return False
+        return True
+
+    def _scan_stream(self, keyword: int) -> bool:
+        return self._signal_interface1(0) and self._class_number(keyword)
+
+    def _signal_interface1(self, device: int) -> bool:
+        """Records that the program needs Interface 1 (1) or an Opus (2)."""
+        if (device == 1 and self.uses_interface1 == 2) or (
+            device == 2 and self.uses_interface1 == 1
+        ):
+            return self._error(
+                b"The program uses commands that are specific\n"
+                b"for Interface 1 and Opus Discovery, but don't exist on both "
+                b"devices"
+            )
+        self.uses_interface1 = device
+        return True
+
+    def _scan_channel(self, keyword: int) -> tuple[bool, int]:
+        """Scans a channel specifier such as `"m";1;"name"` or `#4`."""
+        b = self._buf
+        if self._check_end():
+            return False, 0
+        if b[self._p] != _QUOTE:
+            if not self._class_number(keyword):
+                self.stderr += b"Expected to find a channel identifier\n"
+                return False, 0
+            channel = ord("m")
+            if not self._signal_interface1(2) or self._check_end():
+                return False, channel
+            if b[self._p] != _SEMICOLON:
+                return self._expected(b'";"'), channel
+            self._p += 1
+            return not self._check_end(), channel
+        self._p += 1
+        if self._check_end():
+            return False, 0
+        c = b[self._p]
+        if not (_isalpha(c) or c in (_HASH, _CODE, _CAT)):
+            return self._error(b"Channel name must be alphanumeric"), 0
+        channel = _tolower(c)
+        self._p += 1
+        if self._check_end():
+            return False, channel
+        if b[self._p] != _QUOTE:
+            return self._error(b"Channel name must be single character"), channel
+        self._p += 1
+        if channel == ord("n"):
+            device = 1
+        elif channel in (ord("j"), ord("d"), _CODE):
+            device = 2
+        else:
+            device = 0
+        if not self._signal_interface1(device):
+            return False, channel
+        if channel in (ord("m"), ord("d"), ord("n"), _HASH, _CAT):
+            if self._check_end():
+                return False, channel
+            if b[self._p] != _SEMICOLON:
+                return self._expected(b'";"'), channel
+            self._p += 1
+            if not self._class_number(keyword):
+                return False, channel
+            if channel == ord("m"):
+                if self._check_end():
+                    return False, channel
+                if b[self._p] != _SEMICOLON:
+                    return self._expected(b'";"'), channel
+                self._p += 1
+                if self._check_end():
+                    return False, channel
+        return True, channel
+
+    # -- Syntax classes -----------------------------------------------------
+
+    def _class_variable(self, keyword: int) -> bool:
+        if keyword in (_FN, _DIM):
+            mode = -1
+        elif keyword == _LET:
+            mode = 1
+        else:
+            mode = 2
+        ok, self._var_type, length = self._scan_variable(mode)
+        if not ok and not length:
+            return self._expected(b"variable")
+        return ok
+
+    def _class_assignment(self, keyword: int) -> bool:
+        ok, type_ = self._scan_expression(keyword, 0, 0)
+        if not ok:
+            return False
+        if type_ != self._var_type:
+            return self._error(b"Bad assignment expression type")
+        return True
+
+    def _class_optional_number(self, keyword: int) -> bool:
+        b = self._buf
+        if b[self._p] in _STATEMENT_END:
+            return True
+        if keyword == _CLEAR and b[self._p] == _HASH:
+            self._p += 1
+            if not self._signal_interface1(0):
+                return False
+            if b[self._p] in _STATEMENT_END:
+                return True
+        return self._class_number(keyword)
+
+    def _class_for_variable(self, keyword: int) -> bool:
+        ok, is_numeric, length = self._scan_variable(0)
+        if not ok:
+            return self._expected(b"variable") if not length else False
+        if length != 1 or not is_numeric:
+            return self._error(b"Wrong variable type")
+        return True
+
+    def _class_print_list(self, keyword: int) -> bool:
+        b = self._buf
+        slot = 0
+        more = True
+        while more:
+            while b[self._p] in (_SEMICOLON, _COMMA, _APOSTROPHE):
+                self._p += 1
+            c = b[self._p]
+            if c in _STATEMENT_END:
+                break
+            if c == _HASH:
+                self._p += 1
+                if not self._scan_stream(keyword):
+                    return False
+            elif _TYPES[c] == 2 or c == _TAB:
+                self._p += 1
+                if not self._class_number(keyword):
+                    return False
+            elif c == _AT:
+                self._p += 1
+                if not self._class_number(keyword) or self._check_end():
+                    return False
+                if b[self._p] != _COMMA:
+                    return self._expected(b'","')
+                self._p += 1
+                if not self._class_number(keyword):
+                    return False
+            elif keyword == _INPUT and c == _LINE:
+                self._p += 1
+                ok, is_numeric, length = self._scan_variable(0)
+                if not ok:
+                    return self._expected(b"variable") if not length else False
+                if is_numeric:
+                    return self._error(b"INPUT LINE requires an alphanumeric variable")
+            else:
+                ok, slot = self._scan_expression(keyword, slot, 0)
+                if not ok:
+                    return False
+            if b[self._p] in _STATEMENT_END:
+                more = False
+            elif b[self._p] not in (_SEMICOLON, _COMMA, _APOSTROPHE):
+                return self._expected(b'separator ";", "," or "\'"')
+        return True
+
+    def _class_number(self, keyword: int) -> bool:
+        ok, type_ = self._scan_expression(keyword, 1, 0)
+        if not ok:
+            return False
+        if type_ == 0 and keyword != _USR:
+            return self._error(b"Expected numeric expression")
+        return True
+
+    def _class_two_numbers(self, keyword: int) -> bool:
+        if not self._class_number(keyword):
+            return False
+        if self._buf[self._p] != _COMMA:
+            return self._expected(b'","')
+        self._p += 1
+        return self._class_number(keyword)
+
+    def _class_coordinates(self, keyword: int) -> bool:
+        b = self._buf
+        while True:
+            if self._check_end():
+                return False
+            if _TYPES[b[self._p]] != 2:
+                break
+            self._p += 1
+            if not self._class_number(keyword) or self._check_end():
+                return False
+            if b[self._p] != _SEMICOLON:
+                return self._expected(b'";"')
+            self._p += 1
+        if self._check_end():
+            return False
+        return self._class_two_numbers(keyword)
+
+    def _class_string(self, keyword: int) -> bool:
+        ok, type_ = self._scan_expression(keyword, 0, 0)
+        if not ok:
+            return False
+        if type_:
+            return self._error(b"Expected string expression")
+        return True
+
+    def _class_string_list(self, keyword: int) -> bool:
+        b = self._buf
+        slot = 0
+        while True:
+            ok, slot = self._scan_expression(keyword, slot, 0)
+            if not ok:
+                return False
+            if slot:
+                return self._error(b'"%s" requires string parameters', _NAMES[keyword])
+            if b[self._p] in _STATEMENT_END:
+                return True
+            if b[self._p] == _COMMA:
+                self._p += 1
+            elif b[self._p] != _RPAREN:
+                return self._expected(b'","')
+
+    def _class_number_list(self, keyword: int) -> bool:
+        b = self._buf
+        if b[self._p] == _RPAREN and keyword == _FN:
+            return True
+        # bas2tap leaves this type slot uninitialised; for DATA it holds
+        # whatever the previous number list on the line left behind.
+        slot = 1 if keyword in (_DIM, _FN) else self._list_type
+        more = True
+        while more:
+            ok, slot = self._scan_expression(keyword, slot, 0)
+            if not ok:
+                return False
+            self._list_type = slot
+            if keyword == _DIM and slot == 0:
+                return self._error(b'"DIM" requires numeric dimensions')
+            if keyword in (_DIM, _FN):
+                if self._check_end():
+                    return False
+                if b[self._p] == _RPAREN:
+                    more = False
+            if b[self._p] in _STATEMENT_END:
+                break
+            if b[self._p] == _COMMA:
+                self._p += 1
+            elif b[self._p] == _RPAREN:
+                more = False
+            else:
+                return self._expected(b'","')
+        return True
+
+    def _class_variable_list(self, keyword: int) -> bool:
+        b = self._buf
+        while True:
+            ok, _, length = self._scan_variable(2)
+            if not ok:
+                return self._expected(b"variable") if not length else False
+            if b[self._p] in _STATEMENT_END:
+                return True
+            if b[self._p] != _COMMA:
+                return self._expected(b'","')
+            self._p += 1
+
+    def _class_def_fn(self, keyword: int) -> bool:
+        b = self._buf
+        if not self._single_letter_variable():
+            return False
+        if b[self._p] == _LPAREN:
+            self._p += 1
+            if self._check_end():
+                return False
+            if b[self._p] == _RPAREN:
+                return self._error(b"Empty parameter array not allowed")
+            while True:
+                if not self._single_letter_variable():
+                    return False
+                if b[self._p] != _NUMBER_MARKER:
+                    return self._expected(b"number marker")
+                self._p += 1
+                if self._check_end():
+                    return False
+                if b[self._p] == _RPAREN:
+                    break
+                if b[self._p] != _COMMA:
+                    return self._expected(b'","')
+                self._p += 1
+            self._p += 1
+        if self._check_end():
+            return False
+        if b[self._p] != _EQUALS:
+            return self._expected(b'"="')
+        self._p += 1
+        if self._check_end():
+            return False
+        return self._scan_expression(keyword, 1, 0)[0]
+
+    def _single_letter_variable(self) -> bool:
+        ok, _, length = self._scan_variable(-1)
+        if not ok:
+            return self._expected(b"variable") if not length else False
+        if length != 1:
+            return self._error(b"Wrong variable type; must be single character")
+        return True
+
+    # -- File and channel commands ------------------------------------------
+
+    def _class_file(self, keyword: int) -> bool:
+        if keyword in (_LOAD, _VERIFY, _MERGE, _SAVE):
+            return self._load_or_save(keyword)
+        if keyword == _CAT:
+            return self._cat(keyword)
+        if keyword == _FORMAT:
+            return self._format(keyword)
+        if keyword == _MOVE:
+            return self._move(keyword)
+        if keyword == _ERASE:
+            return self._erase(keyword)
+        if keyword == _OPEN:
+            return self._open(keyword)
+        if keyword == _CLOSE:
+            return self._scan_stream(keyword)
+        return True
+
+    def _mark_128k_file_io(self) -> bool:
+        if self.is_48k == 1:
+            self.stderr += (
+                b"ERROR - Line %d contains 128K file I/O, but the program\n"
+                b"also uses UDGs 'T' and/or 'U'\n" % self._line_number
+            )
+            return False
+        if self.is_48k == -1:
+            self.is_48k = 0
+        return True
+
+    def _filename(self, empty_message: bytes) -> bool:
+        """Checks a filename: a literal, which may not be empty, or a string."""
+        b = self._buf
+        if b[self._p] == _QUOTE:
+            if b[self._p + 1] == _QUOTE and b[self._p + 2] != _QUOTE:
+                return self._error(empty_message)
+            return self._skip_string()
+        return self._class_string(0)
+
+    def _load_or_save(self, keyword: int) -> bool:
+        b = self._buf
+        saving = keyword == _SAVE
+        channel = 0
+        if b[self._p] == _STAR:
+            self._p += 1
+            ok, channel = self._scan_channel(keyword)
+            if not ok:
+                return False
+            if channel not in b"mbn":
+                if saving:
+                    message = b'You cannot SAVE to the "%s" channel'
+                else:
+                    message = b'You cannot LOAD/VERIFY/MERGE from the "%s" channel'
+                return self._error(message, _NAMES[channel])
+        elif b[self._p] == _BANG:
+            self._p += 1
+            if not self._mark_128k_file_io():
+                return False
+        if channel and channel != ord("m"):
+            if b[self._p] not in _FILE_TYPES:
+                return self._error(
+                    b'The "%s" channel does not use filenames', _NAMES[channel]
+                )
+        elif b[self._p] == _QUOTE:
+            if saving and b[self._p + 1] == _QUOTE and b[self._p + 2] != _QUOTE:
+                return self._error(b"Empty filename not allowed")
+            if not self._skip_string():
+                return False
+        elif b[self._p] in _FILE_TYPES:
+            return self._expected(b"filename")
+        elif not self._class_string(keyword):
+            return False
+
+        c = b[self._p]
+        if c in _STATEMENT_END:
+            return True
+        if c == _CODE:
+            if saving:
+                self._p += 1
+                if not self._class_number(keyword):
+                    return False
+                if b[self._p] != _COMMA:
+                    return self._error(
+                        b"%s CODE requires both address and length", _NAMES[keyword]
+                    )
+                self._p += 1
+                return self._class_number(keyword)
+            if keyword == _MERGE:
+                return self._error(b"Cannot MERGE CODE")
+            self._p += 1
+            if b[self._p] in _STATEMENT_END:
+                return True
+            if not self._class_number(keyword):
+                return False
+            if b[self._p] == _COMMA:
+                self._p += 1
+                return self._class_number(keyword)
+            if b[self._p] in _STATEMENT_END:
+                return True
+            return self._expected(b'","')
+        if c == _SCREEN:
+            self._p += 1
+            return True
+        if c == _DATA:
+            self._p += 1
+            if self._check_end():
+                return False
+            if not self._single_letter_variable():
+                return False
+            if b[self._p] != _LPAREN:
+                return self._error(b"DATA requires an array")
+            self._p += 1
+            if b[self._p] != _RPAREN:
+                return self._error(b"DATA requires an empty array index")
+            self._p += 1
+            return True
+        if c == _LINE and saving:
+            self._p += 1
+            return self._class_number(keyword)
+        return self._error(b'Unknown file-type "%s"', _NAMES[c])
+
+    def _cat(self, keyword: int) -> bool:
+        b = self._buf
+        if not self._signal_interface1(0):
+            return False
+        if b[self._p] == _HASH:
+            self._p += 1
+            if not self._scan_stream(keyword):
+                return False
+            if b[self._p] != _COMMA:
+                return self._expected(b'","')
+        return self._class_number(keyword)
+
+    def _format(self, keyword: int) -> bool:
+        b = self._buf
+        ok, channel = self._scan_channel(keyword)
+        if not ok:
+            return False
+        if channel == ord("m"):
+            if self._check_end():
+                return False
+            return self._filename(b"Empty volume name not allowed")
+        if channel in b"jbt":
+            if b[self._p] != _SEMICOLON:
+                return self._expected(b'";"')
+            self._p += 1
+            if self._check_end():
+                return False
+            return self._class_number(keyword)
+        return self._error(b'You cannot FORMAT from the "%s" channel', _NAMES[channel])
+
+    def _move(self, keyword: int) -> bool:
+        b = self._buf
+        for index in range(2):
+            if b[self._p] == _HASH:
+                self._p += 1
+                if not self._scan_stream(keyword):
+                    return False
+            else:
+                ok, channel = self._scan_channel(keyword)
+                if not ok:
+                    return False
+                if channel == ord("m"):
+                    if self._check_end():
+                        return False
+                    if not self._filename(b"Empty filename not allowed"):
+                        return False
+                elif channel in b"bdnt":
+                    pass
+                elif channel == ord("s"):
+                    if index == 0:
+                        return self._error(b'You cannot MOVE from the "s" channel')
+                elif channel == ord("k"):
+                    if index == 1:
+                        return self._error(b'You cannot MOVE to the "k" channel')
+                else:
+                    return self._error(
+                        b'You cannot MOVE from/to the "%s" channel', _NAMES[channel]
+                    )
+            if index == 0:
+                if b[self._p] != _TO:
+                    return self._expected(b'"TO"')
+                self._p += 1
+        return True
+
+    def _erase(self, keyword: int) -> bool:
+        b = self._buf
+        if b[self._p] == _BANG:
+            self._p += 1
+            if not self._mark_128k_file_io():
+                return False
+        else:
+            ok, channel = self._scan_channel(keyword)
+            if not ok:
+                return False
+            if channel != ord("m"):
+                return self._error(b'You can only ERASE from the ! or "m" channel')
+        if self._check_end():
+            return False
+        return self._filename(b"Empty filename not allowed")
+
+    def _open(self, keyword: int) -> bool:
+        b = self._buf
+        if not self._scan_stream(keyword):
+            return False
+        if b[self._p] not in (_SEMICOLON, _COMMA):
+            return self._expected(b'";"')
+        self._p += 1
+        ok, channel = self._scan_channel(keyword)
+        if not ok:
+            return False
+        if channel == ord("m"):
+            if self._check_end():
+                return False
+            if not self._filename(b"Empty filename not allowed"):
+                return False
+        elif channel not in (*b"nb#kstp", _CAT, _CODE):
+            return self._error(
+                b'You cannot attach a stream to the "%s" channel', _NAMES[channel]
+            )
+        c = b[self._p]
+        if c in _STATEMENT_END:
+            return True
+        if c == _IN:
+            self._p += 1
+            return self._signal_interface1(2)
+        if c in (_OUT, _EXP):
+            self._p += 1
+            return self._signal_interface1(2) and self._class_number(keyword)
+        if c == _RND:
+            self._p += 1
+            if not self._signal_interface1(2) or not self._class_number(keyword):
+                return False
+            if b[self._p] == _COMMA:
+                self._p += 1
+                return self._class_number(keyword)
+        return True
+
+
+def _hex_digit(c: int) -> int:
+    return c - 0x30 if _isdigit(c) else _toupper(c) - 0x37
+
+
+def convert(
+    source: str | bytes,
+    *,
+    case_independent: bool = False,
+    warnings: bool = True,
+    check_syntax: bool = True,
+    output_name: str = "program.tap",
+) -> ConversionResult:
+    """Tokenizes and syntax checks a Spectrum BASIC listing in memory.
+
+    Args:
+        source: The listing, one numbered line per text line.
+        case_independent: Match keywords regardless of case (bas2tap -c).
+        warnings: Report warnings such as duplicate line numbers (no -w).
+        check_syntax: Run the syntax checker on every line (no -n).
+        output_name: File name quoted in the "Creating output file" banner.
+
+    Returns:
+        A ConversionResult with the diagnostics and the tokenized program.
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    converter = _Converter(case_independent, warnings, check_syntax)
+    ok = converter.convert(source, output_name)
+    return ConversionResult(
+        stdout=converter.stdout.decode("latin-1"),
+        stderr=converter.stderr.decode("latin-1"),
+        lines=converter.lines,
+        ok=ok,
+        is_48k=None if converter.is_48k < 0 else converter.is_48k == 1,
+        interface=(
+            None if converter.uses_interface1 < 0 else converter.uses_interface1
+        ),
+    )
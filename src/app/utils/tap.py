@@ -0,0 +1,84 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory TAP encoder for tokenized ZX Spectrum BASIC programs.
+
+A TAP file is a sequence of blocks, each stored as a little-endian length
+followed by a flag byte, the payload and an XOR checksum. A BASIC program is a
+17 byte header block followed by a data block holding the program area, which
+is the layout bas2tap writes.
+"""
+
+import functools
+import operator
+
+Buffer = bytes | bytearray | memoryview
+
+HEADER_FLAG = 0x00
+DATA_FLAG = 0xFF
+PROGRAM_TYPE = 0x00
+NO_AUTOSTART = 0x8000
+MAX_NAME_LENGTH = 10
+MAX_AUTOSTART_LINE = 9999
+
+
+def checksum(flag: int, payload: Buffer) -> int:
+    """Returns the XOR of the flag byte and every payload byte."""
+    return functools.reduce(operator.xor, memoryview(payload).cast("B"), flag)
+
+
+def encode_block(flag: int, payload: Buffer) -> bytes:
+    """Encodes one TAP block: length, flag, payload and checksum."""
+    view = memoryview(payload).cast("B")
+    block = bytearray((len(view) + 2).to_bytes(2, "little"))
+    block.append(flag)
+    block += view
+    block.append(checksum(flag, view))
+    return bytes(block)
+
+
+def encode_program(
+    program: Buffer, name: str = "", autostart: int | None = None
+) -> bytes:
+    """Encodes a tokenized BASIC program area as a TAP file.
+
+    Args:
+        program: The program area, e.g. spectrum_basic.LineTable.program.
+        name: Tape block name of at most 10 characters; padded with spaces.
+        autostart: Line to run after loading, or None to load without running.
+
+    Returns:
+        The complete TAP file contents.
+
+    Raises:
+        ValueError: If the name is too long or the autostart line is out of
+            range.
+    """
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f'Spectrum blockname too long "{name}"')
+    if autostart is None:
+        autostart = NO_AUTOSTART
+    elif not 0 <= autostart <= MAX_AUTOSTART_LINE:
+        raise ValueError(f"Invalid auto-start line number {autostart}")
+
+    view = memoryview(program).cast("B")
+    header = bytearray([PROGRAM_TYPE])
+    header += name.encode("latin-1").ljust(MAX_NAME_LENGTH, b" ")
+    header += len(view).to_bytes(2, "little")
+    header += autostart.to_bytes(2, "little")
+    # For programs the second parameter is the offset of the variables area,
+    # which directly follows the program.
+    header += len(view).to_bytes(2, "little")
+    return encode_block(HEADER_FLAG, header) + encode_block(DATA_FLAG, view)
@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
 import json
 import logging
+import threading
+import time
 from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 
 import google.cloud.storage as storage
@@ -23,6 +27,23 @@ from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
 from opentelemetry.sdk.trace import ReadableSpan
 from opentelemetry.sdk.trace.export import SpanExportResult
 
+from .gcs import get_storage_client
+
+# Seconds before a missing bucket is looked up again.
+MISSING_BUCKET_RECHECK_SECONDS = 300
+
+# Estimated attribute size kept in a log entry, leaving headroom below the
+# 256 KB Cloud Logging limit for the rest of the span and for JSON escaping.
+LOG_ENTRY_ATTRIBUTES_BUDGET = 200 * 1024
+
+# Characters of an offloaded string attribute kept in the log entry.
+PREVIEW_CHARS = 512
+
+# Estimated size of the log entries written in one request, leaving headroom
+# below the 10 MB Cloud Logging limit, and of an entry's labels and metadata.
+LOG_BATCH_BUDGET = 9 * 1024 * 1024
+LOG_ENTRY_OVERHEAD = 1024
+
 
 class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
     """
@@ -31,6 +52,10 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
 
     This class helps bypass the 256 character limit of Cloud Trace for attribute values
     by leveraging Cloud Logging (which has a 256KB limit) and Cloud Storage for larger payloads.
+
+    Each export cycle writes its log entries in as few batches as fit in a
+    Cloud Logging request, and large payloads are uploaded by a small thread
+    pool so the exporter does not wait on GCS.
     """
 
     def __init__(
@@ -39,6 +64,8 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
         storage_client: storage.Client | None = None,
         bucket_name: str | None = None,
         debug: bool = False,
+        upload_workers: int = 2,
+        max_pending_uploads: int = 32,
         **kwargs: Any,
     ) -> None:
         """
@@ -48,6 +75,9 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
         :param storage_client: Google Cloud Storage client
         :param bucket_name: Name of the GCS bucket to store large payloads
         :param debug: Enable debug mode for additional logging
+        :param upload_workers: Threads uploading large payloads to GCS
+        :param max_pending_uploads: Uploads that may be queued or running before
+            the exporter uploads the next payload itself
         :param kwargs: Additional arguments to pass to the parent class
         """
         super().__init__(**kwargs)
@@ -56,9 +86,16 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
             project=self.project_id
         )
         self.logger = self.logging_client.logger(__name__)
-        self.storage_client = storage_client or storage.Client(project=self.project_id)
+        self.storage_client = storage_client or get_storage_client(self.project_id)
         self.bucket_name = bucket_name or f"{self.project_id}-retro-righter-logs-data"
         self.bucket = self.storage_client.bucket(self.bucket_name)
+        self._bucket_exists: bool | None = None
+        self._bucket_checked_at = 0.0
+        self._bucket_lock = threading.Lock()
+        self._uploads = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="span-upload"
+        )
+        self._upload_slots = threading.BoundedSemaphore(max_pending_uploads)
 
     def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
         """
@@ -67,8 +104,12 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
         :param spans: A sequence of spans to export
         :return: The result of the export operation
         """
+        batch = self.logger.batch()
+        entries = batch_bytes = 0
         for span in spans:
             span_context = span.get_span_context()
+            if span_context is None:
+                continue
             trace_id = format(span_context.trace_id, "x")
             span_id = format(span_context.span_id, "x")
             span_dict = json.loads(span.to_json())
@@ -83,8 +124,12 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
             if self.debug:
                 print(span_dict)
 
-            # Log the span data to Google Cloud Logging
-            self.logger.log_struct(
+            entry_bytes = _estimate_size(span_dict) + LOG_ENTRY_OVERHEAD
+            if entries and batch_bytes + entry_bytes > LOG_BATCH_BUDGET:
+                self._commit(batch, entries)
+                batch = self.logger.batch()
+                entries = batch_bytes = 0
+            batch.log_struct(
                 span_dict,
                 labels={
                     "type": "agent_telemetry",
@@ -92,18 +137,58 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
                 },
                 severity="INFO",
             )
+            entries += 1
+            batch_bytes += entry_bytes
+        # Log the span data to Google Cloud Logging in as few requests as fit
+        if entries:
+            self._commit(batch, entries)
         # Export spans to Google Cloud Trace using the parent class method
         return super().export(spans)
 
-    def store_in_gcs(self, content: str, span_id: str) -> str:
+    def shutdown(self) -> None:
+        """Waits for the queued GCS uploads before shutting down."""
+        self._uploads.shutdown(wait=True)
+        super().shutdown()
+
+    def _commit(self, batch: google_cloud_logging.Batch, entries: int) -> None:
+        """Write a batch of log entries, logging rather than raising on failure."""
+        try:
+            batch.commit()
+        except Exception as e:
+            logging.error(f"Failed to log {entries} span(s) to Cloud Logging: {e}")
+
+    def bucket_exists(self) -> bool:
+        """
+        Check whether the payload bucket exists, asking GCS at most once, or
+        every few minutes while it is missing.
+
+        :return: Whether the bucket exists
         """
-        Initiate storing large content in Google Cloud Storage/
+        with self._bucket_lock:
+            if self._bucket_exists or (
+                self._bucket_exists is False
+                and time.monotonic() - self._bucket_checked_at
+                < MISSING_BUCKET_RECHECK_SECONDS
+            ):
+                return self._bucket_exists
+            self._bucket_exists = bool(self.bucket.exists())
+            self._bucket_checked_at = time.monotonic()
+            return self._bucket_exists
+
+    def store_in_gcs(self, payload: dict[str, Any], span_id: str) -> str:
+        """
+        Initiate storing large attributes in Google Cloud Storage.
+
+        The payload is serialized and gzip-compressed once, by the upload
+        itself. The upload runs in the background; when too many uploads are
+        pending it runs in the calling thread instead, which bounds the memory
+        held by queued payloads.
 
-        :param content: The content to store
+        :param payload: The attributes to store
         :param span_id: The ID of the span
-        :return: The  GCS URI of the stored content
+        :return: The GCS URI the content is stored at
         """
-        if not self.storage_client.bucket(self.bucket_name).exists():
+        if not self.bucket_exists():
             logging.warning(
                 f"Bucket {self.bucket_name} not found. "
                 "Unable to store span attributes in GCS."
@@ -111,39 +196,94 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
             return "GCS bucket not found"
 
         blob_name = f"spans/{span_id}.json"
-        blob = self.bucket.blob(blob_name)
-
-        blob.upload_from_string(content, "application/json")
+        if self._upload_slots.acquire(blocking=False):
+            future = self._uploads.submit(self._upload, blob_name, payload)
+            future.add_done_callback(self._release_upload_slot)
+        else:
+            self._upload(blob_name, payload)
         return f"gs://{self.bucket_name}/{blob_name}"
 
+    def _upload(self, blob_name: str, payload: dict[str, Any]) -> None:
+        """Upload one gzipped payload, logging rather than raising on failure."""
+        try:
+            content = gzip.compress(json.dumps(payload).encode(), compresslevel=6)
+            blob = self.bucket.blob(blob_name)
+            # GCS decompresses the object for clients that don't accept gzip.
+            blob.content_encoding = "gzip"
+            blob.upload_from_string(content, "application/json")
+        except Exception as e:
+            logging.error(f"Failed to store span attributes in {blob_name}: {e}")
+
+    def _release_upload_slot(self, future: Future) -> None:
+        self._upload_slots.release()
+
     def _process_large_attributes(self, span_dict: dict, span_id: str) -> dict:
         """
         Process large attribute values by storing them in GCS if they exceed the size
         limit of Google Cloud Logging.
 
+        Sizes are estimated from string lengths instead of serializing the
+        attributes. When they exceed the budget, the largest attributes are
+        moved to GCS until the rest fit, and the log entry keeps a short
+        preview of each one plus a pointer to the payload.
+
         :param span_dict: The span data dictionary
-        :param trace_id: The trace ID
         :param span_id: The span ID
         :return: The updated span dictionary
         """
         attributes = span_dict["attributes"]
-        if len(json.dumps(attributes).encode()) > 255 * 1024:  # 250 KB
-            # Separate large payload from other attributes
-            attributes_payload = dict(attributes.items())
-            attributes_retain = dict(attributes.items())
-
-            # Store large payload in GCS
-            gcs_uri = self.store_in_gcs(json.dumps(attributes_payload), span_id)
-            attributes_retain["uri_payload"] = gcs_uri
-            attributes_retain["url_payload"] = (
-                f"https://storage.mtls.cloud.google.com/"
-                f"{self.bucket_name}/spans/{span_id}.json"
-            )
+        if not attributes:
+            return span_dict
+        sizes = {
+            key: len(key) + _estimate_size(value) for key, value in attributes.items()
+        }
+        total = sum(sizes.values())
+        if total <= LOG_ENTRY_ATTRIBUTES_BUDGET:
+            return span_dict
 
-            span_dict["attributes"] = attributes_retain
-            logging.info(
-                "Length of payload span above 250 KB, storing attributes in GCS "
-                "to avoid large log entry errors"
-            )
+        payload = {}
+        for key in sorted(sizes, key=sizes.__getitem__, reverse=True):
+            if total <= LOG_ENTRY_ATTRIBUTES_BUDGET:
+                break
+            payload[key] = attributes[key]
+            total -= sizes[key]
 
+        attributes_retain = {
+            key: _preview(value) if key in payload else value
+            for key, value in attributes.items()
+        }
+        attributes_retain["offloaded_attributes"] = list(payload)
+        attributes_retain["uri_payload"] = self.store_in_gcs(payload, span_id)
+        attributes_retain["url_payload"] = (
+            f"https://storage.mtls.cloud.google.com/"
+            f"{self.bucket_name}/spans/{span_id}.json"
+        )
+
+        span_dict["attributes"] = attributes_retain
+        logging.info(
+            f"Span attributes estimated above {LOG_ENTRY_ATTRIBUTES_BUDGET} bytes, "
+            f"storing {len(payload)} of them in GCS to avoid large log entry errors"
+        )
         return span_dict
+
+
+def _estimate_size(value: Any) -> int:
+    """Estimate the JSON size of a value without encoding it."""
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(item) + 1 for item in value) + 2
+    if isinstance(value, dict):
+        return sum(len(key) + 4 + _estimate_size(item) for key, item in value.items())
+    return 8
+
+
+def _preview(value: Any) -> Any:
+    """Shorten an offloaded attribute to what is kept in the log entry."""
+    if isinstance(value, str):
+        if len(value) <= PREVIEW_CHARS:
+            return value
+        return f"{value[:PREVIEW_CHARS]}... [{len(value)} characters]"
+    if isinstance(value, (list, tuple)):
+        return f"[{len(value)} items]"
+    return value
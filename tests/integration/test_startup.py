@@ -0,0 +1,63 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BENCHMARK = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "scripts",
+    "benchmark_startup.py",
+)
+
+# Seconds. Wall-clock times depend on the machine, so the test only runs
+# where STARTUP_IMPORT_BUDGET has been set to match it.
+IMPORT_BUDGET = os.environ.get("STARTUP_IMPORT_BUDGET")
+FIRST_REQUEST_BUDGET = os.environ.get("STARTUP_FIRST_REQUEST_BUDGET", "15")
+
+
+@pytest.mark.skipif(IMPORT_BUDGET is None, reason="STARTUP_IMPORT_BUDGET is not set")
+def test_startup_is_within_budget() -> None:
+    """Fails when server import or time to first request regresses.
+
+    Startup must not need Google Cloud credentials: without them only the
+    background cloud setup fails, so a placeholder project is enough.
+    """
+    env = {"GOOGLE_CLOUD_PROJECT": "startup-benchmark", **os.environ}
+    result = subprocess.run(
+        [
+            sys.executable,
+            BENCHMARK,
+            "--module",
+            "app.server",
+            "--module",
+            "app.agent",
+            "--repeat",
+            "2",
+            "--import-budget",
+            str(IMPORT_BUDGET),
+            "--first-request-budget",
+            FIRST_REQUEST_BUDGET,
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert [run["module"] for run in report["imports"]] == ["app.server", "app.agent"]
@@ -0,0 +1,51 @@
+import unittest
+
+from app.utils.bas2tap import normalize, parse_errors
+
+
+class TestNormalize(unittest.TestCase):
+    def test_line_endings(self) -> None:
+        self.assertEqual(normalize("10 PRINT 1\r\n20 STOP"), "10 PRINT 1\n20 STOP\n")
+
+
+class TestParseErrors(unittest.TestCase):
+    def test_statement_error(self) -> None:
+        self.assertEqual(
+            parse_errors(
+                'ERROR in line 10, statement 2 - Expected keyword but got "P"\n'
+            ),
+            [
+                {
+                    "line": 10,
+                    "statement": 2,
+                    "message": 'ERROR in line 10, statement 2 - Expected keyword but got "P"',
+                }
+            ],
+        )
+
+    def test_line_errors(self) -> None:
+        errors = parse_errors(
+            "ERROR - Line number 5 is smaller than previous line number 10\n"
+            "ERROR - Missing line number in ASCII line 3\n"
+        )
+        self.assertEqual(errors[0]["line"], 5)
+        self.assertIsNone(errors[0]["statement"])
+        self.assertIsNone(errors[1]["line"])
+        self.assertEqual(errors[1]["ascii_line"], 3)
+
+    def test_continuation_lines_are_joined(self) -> None:
+        errors = parse_errors(
+            "ERROR - Line 20 contains 128K file I/O, but the program\n"
+            "also uses UDGs 'T' and/or 'U'\n"
+        )
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["line"], 20)
+        self.assertTrue(errors[0]["message"].endswith("and/or 'U'"))
+
+    def test_unrecognized_output(self) -> None:
+        self.assertIsNone(parse_errors("Segmentation fault\n"))
+        self.assertIsNone(parse_errors(""))
+
+
+if __name__ == "__main__":
+    unittest.main()
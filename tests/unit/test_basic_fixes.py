@@ -0,0 +1,59 @@
+import unittest
+
+from app.utils import bas2tap
+from app.utils.basic_fixes import fix_line, fix_listing
+
+
+class TestFixListing(unittest.TestCase):
+    def test_mechanical_mistakes_are_fixed(self) -> None:
+        """Tests that a listing with only mechanical mistakes then compiles."""
+        listing = (
+            'l0 print "hello": let x=1O\n'
+            "\n"
+            "2O if x=1O OR x<0 then gosub 1OO\n"
+            "   : goto l0\n"
+            '1OO deffn a(x)=x*2: Print AT 1,2;val$ "3": return\n'
+        )
+        fixed = fix_listing(listing)
+        self.assertEqual(
+            fixed,
+            '10 PRINT "hello": LET x=10\n'
+            "20 IF x=10 OR x<0 THEN GO SUB 100   : GO TO 10\n"
+            '100 DEF FN a(x)=x*2: PRINT AT 1,2;VAL$ "3": RETURN\n',
+        )
+        self.assertTrue(bas2tap.compile_listing(fixed).ok)
+
+    def test_strings_rem_and_variables_are_kept(self) -> None:
+        self.assertEqual(
+            fix_line('10 print "goto 1O": rem print 1O'),
+            '10 PRINT "goto 1O": REM print 1O',
+        )
+        self.assertEqual(
+            fix_line("20 LET score=O: LET t1O=2: LET val1=3"),
+            "20 LET score=O: LET t1O=2: LET val1=3",
+        )
+
+    def test_only_keywords_in_keyword_position_are_upper_cased(self) -> None:
+        """Tests that variables spelling keywords keep their case."""
+        self.assertEqual(
+            fix_line("10 let in=1: for to=in TO 2: print in+to; at: next to"),
+            "10 LET in=1: FOR to=in TO 2: PRINT in+to; at: NEXT to",
+        )
+        self.assertEqual(
+            fix_line('20 if in then print "a: b";to: let t$=chr$ in'),
+            '20 IF in THEN PRINT "a: b";to: LET t$=CHR$ in',
+        )
+
+    def test_continuation_keeps_the_whitespace_at_the_break(self) -> None:
+        self.assertEqual(
+            fix_listing('10 PRINT "a"; \n  "b"\n20 PRINT ab\ncd'),
+            '10 PRINT "a";   "b"\n20 PRINT abcd',
+        )
+
+    def test_valid_listing_is_unchanged(self) -> None:
+        listing = "10 PRINT 1\n20 GO TO 10\n"
+        self.assertEqual(fix_listing(listing), listing)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from app.utils.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_hits_and_misses_are_counted(self) -> None:
+        cache = LRUCache[int](max_size=2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(
+            cache.stats(), {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+        )
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache = LRUCache[int](max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expired_entries_are_dropped(self) -> None:
+        now = [0.0]
+        cache = LRUCache[int](max_size=2, ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] = 5
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 11
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from typing import Any
+
+from app import cli
+from app.utils import spectrum_basic, tap
+
+
+class TestConvert(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "listings")
+        self.output = os.path.join(self.directory.name, "taps")
+        self._write("games/good.bas", "10 PRINT 1\n20 GO TO 10\n")
+        self._write("games/bad.BAS", "10 PRNT 1\n")
+        self._write("notes.txt", "not a listing")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def _write(self, relative_path: str, text: str) -> None:
+        path = os.path.join(self.source, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as listing:
+            listing.write(text)
+
+    def _run(self, *argv: str) -> tuple[int, list[dict[str, Any]], dict[str, Any]]:
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = cli.main(["convert", *argv])
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return status, results, json.loads(stderr.getvalue())
+
+    def test_tree_is_converted_with_json_lines(self) -> None:
+        """Tests per-file results, mirrored TAP paths and the summary."""
+        status, results, summary = self._run(self.source, "-o", self.output, "-j", "2")
+
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            [(os.path.basename(r["path"]), r["ok"]) for r in results],
+            [("bad.BAS", False), ("good.bas", True)],
+        )
+        self.assertEqual(results[0]["errors"][0]["line"], 10)
+        good = results[1]
+        self.assertEqual(good["tap"], os.path.join(self.output, "games", "good.tap"))
+        with open(good["tap"], "rb") as tap_file:
+            expected = tap.encode_program(
+                spectrum_basic.convert("10 PRINT 1\n20 GO TO 10\n").lines.program
+            )
+            self.assertEqual(tap_file.read(), expected)
+        self.assertEqual(good["size_bytes"], len(expected))
+        self.assertEqual(summary["files"], 2)
+        self.assertEqual((summary["ok"], summary["failed"]), (1, 1))
+        self.assertEqual(summary["workers"], 2)
+
+    def test_named_file_is_written_next_to_it(self) -> None:
+        path = os.path.join(self.source, "games", "good.bas")
+        status, results, _ = self._run(path, "-j", "1")
+        self.assertEqual(status, 0)
+        self.assertEqual(
+            results[0]["tap"], os.path.join(self.source, "games", "good.tap")
+        )
+        self.assertTrue(os.path.exists(results[0]["tap"]))
+
+    def test_unreadable_file_is_reported(self) -> None:
+        status, results, _ = self._run(os.path.join(self.source, "missing.bas"))
+        self.assertEqual(status, 1)
+        self.assertIn("FileNotFoundError", results[0]["errors"][0]["message"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.utils import cloud
+
+
+class TestProjectId(unittest.TestCase):
+    def setUp(self) -> None:
+        cloud.project_id.cache_clear()
+        self.addCleanup(cloud.project_id.cache_clear)
+
+    @patch("google.auth.default")
+    def test_environment_avoids_credential_lookup(
+        self, mock_default: MagicMock
+    ) -> None:
+        with patch.dict(os.environ, {"GOOGLE_CLOUD_PROJECT": "env-project"}):
+            self.assertEqual(cloud.project_id(), "env-project")
+            self.assertEqual(
+                cloud.logs_bucket_name(), "env-project-retro-righter-logs-data"
+            )
+        mock_default.assert_not_called()
+
+    @patch("google.auth.default", return_value=(None, "adc-project"))
+    def test_default_credentials_are_asked_once(self, mock_default: MagicMock) -> None:
+        with patch.dict(os.environ, {"GOOGLE_CLOUD_PROJECT": ""}):
+            self.assertEqual(cloud.project_id(), "adc-project")
+            self.assertEqual(cloud.project_id(), "adc-project")
+        mock_default.assert_called_once()
+
+    @patch("google.auth.default", return_value=(None, None))
+    def test_missing_project_is_reported(self, mock_default: MagicMock) -> None:
+        with patch.dict(os.environ, {"GOOGLE_CLOUD_PROJECT": ""}):
+            with self.assertRaises(RuntimeError):
+                cloud.project_id()
+
+
+if __name__ == "__main__":
+    unittest.main()
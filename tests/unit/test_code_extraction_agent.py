@@ -0,0 +1,149 @@
+import asyncio
+import io
+import os
+import unittest
+from collections.abc import AsyncGenerator
+from typing import Any
+from unittest.mock import patch
+
+from google.adk.agents import LlmAgent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+from PIL import Image, ImageDraw
+
+from app.sub_agents.code_extraction_agent.agent import CodeExtractionAgent
+
+PAGE_LISTINGS = {
+    "Part 1 of 3": "10 PRINT 1\n20 PRINT 2\n",
+    "Part 2 of 3": "20 PRINT 2\n30 GO TO 10\n",
+    "Part 3 of 3": "40 STOP\n",
+}
+
+
+class FakeLlm(BaseLlm):
+    """Answers each page request after a delay, tracking concurrency."""
+
+    calls: int = 0
+    running: int = 0
+    max_running: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        texts = [
+            part.text for part in llm_request.contents[-1].parts or [] if part.text
+        ]
+        text = next(
+            (
+                listing
+                for text in texts
+                for label, listing in PAGE_LISTINGS.items()
+                if text.startswith(label + " ")
+            ),
+            "10 PRINT 1\n",
+        )
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=text)])
+        )
+
+
+@patch.dict(os.environ, {"IMAGE_PREPROCESSING": "off", "EXTRACTION_MODE": "pages"})
+class TestCodeExtractionAgent(unittest.IsolatedAsyncioTestCase):
+    async def _run(self, parts: list[types.Part]) -> tuple[list[Any], dict[str, Any]]:
+        self.llm = FakeLlm(model="fake")
+        agent = CodeExtractionAgent(
+            name="code_extraction_agent",
+            sub_agents=[
+                LlmAgent(
+                    name="llm_code_extraction_agent",
+                    model=self.llm,
+                    output_key="current_code",
+                )
+            ],
+        )
+        runner = InMemoryRunner(agent=agent, app_name="test")
+        session = await runner.session_service.create_session(
+            app_name="test", user_id="user"
+        )
+        events = [
+            event
+            async for event in runner.run_async(
+                user_id="user",
+                session_id=session.id,
+                new_message=types.Content(role="user", parts=parts),
+            )
+        ]
+        stored = await runner.session_service.get_session(
+            app_name="test", user_id="user", session_id=session.id
+        )
+        assert stored is not None
+        return events, stored.state
+
+    def _page(self, number: int) -> types.Part:
+        return types.Part.from_bytes(data=b"page%d" % number, mime_type="image/png")
+
+    async def test_pages_are_extracted_concurrently_and_merged(self) -> None:
+        """Tests one model call per page, run at once, merged by line number."""
+        events, state = await self._run(
+            [types.Part(text="Convert")] + [self._page(n) for n in (1, 2, 3)]
+        )
+        self.assertEqual(
+            state["current_code"],
+            "10 PRINT 1\n20 PRINT 2\n30 GO TO 10\n40 STOP\n",
+        )
+        self.assertEqual(events[-1].author, "code_extraction_agent")
+        self.assertEqual(self.llm.calls, 3)
+        self.assertEqual(self.llm.max_running, 3)
+
+    async def test_tall_image_is_extracted_in_strips(self) -> None:
+        """Tests that a long scan is split and its strips merged."""
+        image = Image.new("L", (300, 900), 255)
+        draw = ImageDraw.Draw(image)
+        for top in range(10, 880, 30):
+            draw.rectangle((20, top, 250, top + 16), fill=0)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        page = types.Part.from_bytes(data=buffer.getvalue(), mime_type="image/png")
+
+        events, state = await self._run([page])
+        self.assertEqual(self.llm.calls, 3)
+        self.assertEqual(self.llm.max_running, 3)
+        self.assertEqual(events[-1].author, "code_extraction_agent")
+        self.assertEqual(
+            state["current_code"],
+            "10 PRINT 1\n20 PRINT 2\n30 GO TO 10\n40 STOP\n",
+        )
+
+    @patch.dict(os.environ, {"EXTRACTION_MAX_CONCURRENCY": "1"})
+    async def test_concurrency_is_limited(self) -> None:
+        await self._run([self._page(n) for n in (1, 2, 3)])
+        self.assertEqual(self.llm.max_running, 1)
+
+    async def test_single_image_uses_llm_agent(self) -> None:
+        events, state = await self._run([self._page(1)])
+        self.assertEqual(state["current_code"], "10 PRINT 1\n")
+        self.assertEqual(events[-1].author, "llm_code_extraction_agent")
+        self.assertEqual(self.llm.calls, 1)
+
+    @patch.dict(os.environ, {"EXTRACTION_MODE": "single"})
+    async def test_single_mode_sends_all_pages_in_one_call(self) -> None:
+        events, _ = await self._run([self._page(n) for n in (1, 2, 3)])
+        self.assertEqual(events[-1].author, "llm_code_extraction_agent")
+        self.assertEqual(self.llm.calls, 1)
+
+    async def test_single_call_is_the_default(self) -> None:
+        with patch.dict(os.environ):
+            del os.environ["EXTRACTION_MODE"]
+            events, _ = await self._run([self._page(n) for n in (1, 2, 3)])
+        self.assertEqual(events[-1].author, "llm_code_extraction_agent")
+        self.assertEqual(self.llm.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import io
+import os
+import tempfile
+import unittest
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from google.adk.models import LlmRequest
+from google.genai import types
+from PIL import Image
+
+from app.sub_agents.code_extraction_agent.tools import (
+    PROMPT_VERSION,
+    cache_extraction,
+    preprocess_images,
+    use_cached_extraction,
+)
+from app.utils.image_cache import ExtractionCache
+from app.utils.image_preprocessing import preprocessing_cache
+
+
+class TestExtractionCacheCallbacks(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ExtractionCache(os.path.join(self.directory.name, "cache.db"))
+        patcher = patch(
+            "app.sub_agents.code_extraction_agent.tools.get_extraction_cache",
+            return_value=self.cache,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def _create_mock_callback_context(self, state: dict[str, Any]) -> MagicMock:
+        callback_context = MagicMock()
+        callback_context.state = state
+        return callback_context
+
+    async def test_miss_runs_agent_and_caches_result(self) -> None:
+        """Tests that a miss runs the model and stores its output."""
+        state = {"uploaded_image_hash": "dhash:ab"}
+        callback_context = self._create_mock_callback_context(state)
+        self.assertIsNone(await use_cached_extraction(callback_context))
+
+        state["current_code"] = "10 PRINT 1\n"
+        await cache_extraction(callback_context)
+        self.assertEqual(self.cache.get("dhash:ab", PROMPT_VERSION), "10 PRINT 1\n")
+
+    async def test_hit_skips_agent(self) -> None:
+        """Tests that a hit sets current_code and returns it as the response."""
+        self.cache.put("dhash:ab", PROMPT_VERSION, "10 PRINT 1\n")
+        state = {"uploaded_image_hash": "dhash:ab"}
+        content = await use_cached_extraction(self._create_mock_callback_context(state))
+        self.assertEqual(content.parts[0].text, "10 PRINT 1\n")
+        self.assertEqual(state["current_code"], "10 PRINT 1\n")
+
+    async def test_other_prompt_version_is_not_served(self) -> None:
+        """Tests that results from another prompt version are ignored."""
+        self.cache.put("dhash:ab", "old-prompt", "10 PRINT 1\n")
+        state = {"uploaded_image_hash": "dhash:ab"}
+        self.assertIsNone(
+            await use_cached_extraction(self._create_mock_callback_context(state))
+        )
+
+    async def test_without_image_hash_nothing_is_cached(self) -> None:
+        """Tests that text-only requests bypass the cache."""
+        state = {"current_code": "10 PRINT 1\n"}
+        callback_context = self._create_mock_callback_context(state)
+        self.assertIsNone(await use_cached_extraction(callback_context))
+        await cache_extraction(callback_context)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestPreprocessImages(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        preprocessing_cache.clear()
+
+    def _llm_request(self, *parts: types.Part) -> LlmRequest:
+        return LlmRequest(contents=[types.Content(role="user", parts=list(parts))])
+
+    async def test_images_are_replaced_and_savings_reported(self) -> None:
+        """Tests that the request carries the smaller image."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (2000, 2000), "white").save(buffer, format="BMP")
+        image_part = types.Part.from_bytes(
+            data=buffer.getvalue(), mime_type="image/bmp"
+        )
+        llm_request = self._llm_request(types.Part(text="Extract"), image_part)
+        callback_context = MagicMock()
+        callback_context.state = {}
+
+        self.assertIsNone(await preprocess_images(callback_context, llm_request))
+
+        parts = llm_request.contents[0].parts
+        self.assertEqual(parts[0].text, "Extract")
+        self.assertEqual(parts[1].inline_data.mime_type, "image/png")
+        report = callback_context.state["image_preprocessing"]
+        self.assertEqual(report["images"], 1)
+        self.assertEqual(report["original_bytes"], len(buffer.getvalue()))
+        self.assertEqual(report["bytes"], len(parts[1].inline_data.data))
+        self.assertLess(report["tokens"], report["original_tokens"])
+
+    @patch.dict(os.environ, {"IMAGE_PREPROCESSING": "off"})
+    async def test_disabled(self) -> None:
+        image_part = types.Part.from_bytes(data=b"image", mime_type="image/png")
+        llm_request = self._llm_request(image_part)
+        callback_context = MagicMock()
+        callback_context.state = {}
+        await preprocess_images(callback_context, llm_request)
+        self.assertIs(llm_request.contents[0].parts[0], image_part)
+        self.assertNotIn("image_preprocessing", callback_context.state)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from types import MappingProxyType
+from typing import Any
+from unittest.mock import MagicMock
+
+from google.adk.models import LlmResponse
+from google.adk.sessions.state import State
+from google.genai import types
+
+from app.sub_agents.debugging_agent.agent import record_debugged_code
+from app.utils import code_state
+
+BEFORE = "10 PRNT 1\n20 GO TO 10\n30 STOP"
+AFTER = "10 PRINT 1\n20 GO TO 10\n25 BEEP 1,0"
+
+
+class TestPatches(unittest.TestCase):
+    def test_diff_and_apply_round_trip(self) -> None:
+        patch = code_state.diff_listings(BEFORE, AFTER)
+        self.assertEqual(
+            patch,
+            {
+                "added": [[25, "25 BEEP 1,0"]],
+                "changed": [[10, "10 PRINT 1"]],
+                "removed": [30],
+            },
+        )
+        self.assertEqual(code_state.apply_patch(BEFORE, patch), AFTER)
+        self.assertEqual(
+            code_state.describe_patch(patch), "~ 10 PRINT 1\n+ 25 BEEP 1,0\n- 30"
+        )
+
+    def test_unnumbered_listing_is_replaced_whole(self) -> None:
+        after = "10 PRINT 1\n  continued"
+        self.assertIsNone(code_state.line_table(after))
+        self.assertIsNone(code_state.line_table("20 STOP\n10 PRINT 1"))
+        patch = code_state.diff_listings(BEFORE, after)
+        self.assertEqual(patch, {"listing": after})
+        self.assertEqual(code_state.apply_patch(BEFORE, patch), after)
+
+    def test_state_keeps_only_patches_until_materialized(self) -> None:
+        state = {"current_code": BEFORE}
+        state_delta: dict[str, Any] = {}
+        code_state.record_code(state_delta, state, AFTER)
+        self.assertNotIn("current_code", state_delta)
+        state.update(state_delta)
+        self.assertEqual(code_state.current_code(state), AFTER)
+
+        state_delta = {}
+        self.assertEqual(code_state.materialize(state_delta, state), AFTER)
+        self.assertEqual(
+            state_delta,
+            {"current_code": AFTER, "code_patch_count": 0, "code_patch_0": None},
+        )
+
+    def test_each_delta_carries_only_its_own_patch(self) -> None:
+        state: dict[str, Any] = {"current_code": BEFORE}
+        deltas = []
+        for code in (AFTER, AFTER + "\n30 STOP", "10 CLS"):
+            state_delta: dict[str, Any] = {}
+            code_state.record_code(state_delta, state, code)
+            state.update(state_delta)
+            deltas.append(state_delta)
+
+        self.assertEqual(
+            [sorted(delta) for delta in deltas],
+            [
+                ["code_patch_0", "code_patch_count"],
+                ["code_patch_1", "code_patch_count"],
+                ["code_patch_2", "code_patch_count"],
+            ],
+        )
+        self.assertEqual(deltas[1]["code_patch_1"]["added"], [[30, "30 STOP"]])
+        self.assertEqual(code_state.current_code(state), "10 CLS")
+
+    def test_patches_for_another_listing_are_ignored(self) -> None:
+        state = {"current_code": BEFORE}
+        code_state.record_code(state, state, AFTER)
+        state["current_code"] = "10 CLS"
+        self.assertEqual(code_state.current_code(state), "10 CLS")
+
+
+class TestExcerptAndSplice(unittest.TestCase):
+    def test_excerpt_includes_context_and_jump_targets(self) -> None:
+        table = {n: f"{n} REM" for n in range(10, 110, 10)}
+        table[80] = "80 GO SUB 25: GOTO 100"
+        self.assertEqual(
+            code_state.excerpt_lines(table, [80], context=1), [30, 70, 80, 90, 100]
+        )
+
+    def test_splice_replaces_adds_and_deletes_by_number(self) -> None:
+        self.assertEqual(
+            code_state.splice(BEFORE, "```\n10 PRINT 1\n25 BEEP 1,0\n30\n```"), AFTER
+        )
+        self.assertIsNone(code_state.splice(BEFORE, "Here you go:\n10 PRINT 1"))
+
+
+class TestInstructionWithCurrentCode(unittest.IsolatedAsyncioTestCase):
+    async def test_listing_is_materialized_and_not_injected(self) -> None:
+        state = {"current_code": "10 PRINT 1", "validation_errors": "E"}
+        code_state.record_code(state, state, '10 PRINT "{x}"')
+        context = MagicMock(state=MappingProxyType(state))
+        context._invocation_context.session.state = state
+        instruction = code_state.instruction_with_current_code(
+            "Code:\n{current_code}\nErrors: {validation_errors}"
+        )
+        self.assertEqual(await instruction(context), 'Code:\n10 PRINT "{x}"\nErrors: E')
+
+
+class TestRecordDebuggedCode(unittest.TestCase):
+    def test_response_is_replaced_by_patch(self) -> None:
+        state = State({"current_code": BEFORE}, {})
+        callback_context = MagicMock(state=state)
+        response = LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=AFTER)])
+        )
+
+        result = record_debugged_code(callback_context, response)
+
+        self.assertEqual(
+            result.content.parts[0].text, "~ 10 PRINT 1\n+ 25 BEEP 1,0\n- 30"
+        )
+        self.assertEqual(code_state.current_code(state), AFTER)
+        self.assertNotIn("current_code", state._delta)
+
+
+if __name__ == "__main__":
+    unittest.main()
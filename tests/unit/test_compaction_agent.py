@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from google.adk.agents import BaseAgent, LoopAgent, SequentialAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import BaseSessionService, InMemorySessionService
+from google.genai import types
+
+from app.sessions import SessionStore, SqliteSessionService
+from app.sub_agents.compaction_agent import RefinementCompactionAgent, agent_names
+from app.sub_agents.compaction_agent.agent import build_record, render_record
+from app.utils import code_state
+
+VALID_CODE = "10 PRINT 1\n20 GO TO 10"
+ERRORS = [{"line": 10, "statement": 1, "message": "ERROR in line 10, statement 1"}]
+
+
+def _event(ctx: InvocationContext, author: str, text: str, **actions: Any) -> Event:
+    return Event(
+        invocation_id=ctx.invocation_id,
+        author=author,
+        content=types.Content(role="model", parts=[types.Part(text=text)]),
+        actions=EventActions(**actions),
+    )
+
+
+class ExtractionAgent(BaseAgent):
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        code = "10 PRNT 1\n20 GO TO 10"
+        yield _event(ctx, self.name, code, state_delta={"current_code": code})
+
+
+class ValidatingAgent(BaseAgent):
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        if code_state.current_code(ctx.session.state) == VALID_CODE:
+            yield _event(
+                ctx,
+                self.name,
+                "valid",
+                state_delta={"validation_errors": []},
+                escalate=True,
+            )
+        else:
+            yield _event(
+                ctx, self.name, "invalid", state_delta={"validation_errors": ERRORS}
+            )
+
+
+class DebuggingAgent(BaseAgent):
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state_delta: dict[str, Any] = {}
+        code_state.record_code(state_delta, ctx.session.state, VALID_CODE)
+        yield _event(ctx, self.name, "fixed", state_delta=state_delta)
+
+
+class TestRefinementCompactionAgent(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SessionStore(os.path.join(self.directory.name, "db.sqlite3"))
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    async def test_loop_events_are_replaced_by_record(self) -> None:
+        """Tests that the stored loop events become one record."""
+        stored = await self._run_pipeline(SqliteSessionService(self.store))
+
+        self.assertEqual(
+            [event.author for event in stored.events],
+            ["user", "extractor", "compactor"],
+        )
+        self.assertEqual(stored.state["current_code"], VALID_CODE)
+        self.assertEqual(stored.state["code_patch_count"], 0)
+        record = stored.events[-1].content.parts[0].text
+        self.assertIn("1 iteration(s), the final code is valid", record)
+        self.assertIn("- ERROR in line 10, statement 1", record)
+        self.assertIn("Initial code:\n10 PRNT 1\n20 GO TO 10", record)
+        self.assertIn("Iteration 1 changes:\n~ 10 PRINT 1\n\n", record)
+        self.assertTrue(record.endswith(f"Final code:\n{VALID_CODE}"))
+
+    async def test_loop_events_are_kept_by_other_services(self) -> None:
+        """Tests that services without delete_events() keep the loop's events,
+        and the code is still materialized."""
+        stored = await self._run_pipeline(InMemorySessionService())
+
+        self.assertEqual(
+            [event.author for event in stored.events],
+            [
+                "user",
+                "extractor",
+                "validation_agent",
+                "debugging_agent",
+                "validation_agent",
+                "compactor",
+            ],
+        )
+        self.assertEqual(stored.state["current_code"], VALID_CODE)
+
+    async def _run_pipeline(self, service: BaseSessionService) -> Any:
+        loop = LoopAgent(
+            name="loop",
+            max_iterations=3,
+            sub_agents=[
+                ValidatingAgent(name="validation_agent"),
+                DebuggingAgent(name="debugging_agent"),
+            ],
+        )
+        pipeline = SequentialAgent(
+            name="pipeline",
+            sub_agents=[
+                ExtractionAgent(name="extractor"),
+                loop,
+                RefinementCompactionAgent(
+                    name="compactor", compacted_authors=agent_names(loop)
+                ),
+            ],
+        )
+        runner = Runner(agent=pipeline, app_name="test", session_service=service)
+        session = await service.create_session(app_name="test", user_id="user")
+        async for _ in runner.run_async(
+            user_id="user",
+            session_id=session.id,
+            new_message=types.Content(role="user", parts=[types.Part(text="go")]),
+        ):
+            pass
+        return await service.get_session(
+            app_name="test", user_id="user", session_id=session.id
+        )
+
+    def test_record_without_initial_code_or_fix(self) -> None:
+        events = [
+            Event(
+                author="validation_agent",
+                actions=EventActions(state_delta={"validation_errors": "bad"}),
+            )
+        ]
+        record = build_record(events, None, "10 PRNT 1")
+        self.assertEqual(record["iterations"], [{"errors": "bad", "diff": None}])
+        self.assertFalse(record["valid"])
+        self.assertEqual(
+            render_record(record),
+            "Code refinement loop: 1 iteration(s), validation failed.\n\n"
+            "Iteration 1 errors:\nbad\n\nFinal code:\n10 PRNT 1",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
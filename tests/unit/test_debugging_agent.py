@@ -0,0 +1,87 @@
+import os
+import unittest
+from types import MappingProxyType
+from unittest.mock import MagicMock, patch
+
+from google.adk.models import LlmResponse
+from google.adk.sessions.state import State
+from google.genai import types
+
+from app.sub_agents.debugging_agent.agent import (
+    debugging_instruction,
+    record_debugged_code,
+    targeted_lines,
+)
+from app.utils import code_state
+
+LISTING = "\n".join(f"{n} PRINT {n}" for n in range(10, 210, 10)).replace(
+    "100 PRINT 100", "100 PRNT 100: GO TO 10"
+)
+ERRORS = [{"line": 100, "statement": 1, "message": "ERROR in line 100"}]
+
+
+@patch.dict(os.environ, {"DEBUGGING_MODE": "targeted", "DEBUGGING_CONTEXT_LINES": "1"})
+class TestTargetedDebugging(unittest.IsolatedAsyncioTestCase):
+    def test_lines_are_targeted_only_when_all_errors_have_lines(self) -> None:
+        state = {"current_code": LISTING, "validation_errors": ERRORS}
+        self.assertEqual(targeted_lines(state), [10, 90, 100, 110])
+        ascii_error = {"line": None, "ascii_line": 3, "message": "ERROR"}
+        state["validation_errors"] = [*ERRORS, ascii_error]
+        self.assertIsNone(targeted_lines(state))
+        state["validation_errors"] = "raw LLM validation output"
+        self.assertIsNone(targeted_lines(state))
+        with patch.dict(os.environ, {"DEBUGGING_MODE": "full"}):
+            self.assertIsNone(
+                targeted_lines({"current_code": LISTING, "validation_errors": ERRORS})
+            )
+
+    async def test_instruction_sends_only_the_excerpt(self) -> None:
+        state = {"current_code": LISTING, "validation_errors": ERRORS}
+        context = MagicMock(state=MappingProxyType(state))
+        context._invocation_context.session.state = state
+
+        instruction = await debugging_instruction(context)
+
+        self.assertIn(
+            "10 PRINT 10\n90 PRINT 90\n100 PRNT 100: GO TO 10\n110 PRINT 110\n",
+            instruction,
+        )
+        self.assertNotIn("20 PRINT 20", instruction)
+        self.assertNotIn("{code_excerpt}", instruction)
+
+    def test_returned_lines_are_spliced_into_the_listing(self) -> None:
+        state = State({"current_code": LISTING, "validation_errors": ERRORS}, {})
+        response = LlmResponse(
+            content=types.Content(
+                role="model", parts=[types.Part(text="100 PRINT 100: GO TO 10")]
+            )
+        )
+
+        result = record_debugged_code(MagicMock(state=state), response)
+
+        self.assertEqual(result.content.parts[0].text, "~ 100 PRINT 100: GO TO 10")
+        self.assertEqual(
+            code_state.current_code(state),
+            LISTING.replace("100 PRNT 100", "100 PRINT 100"),
+        )
+
+
+class TestRecordDebuggedCode(unittest.TestCase):
+    def test_model_output_is_fixed_before_it_is_recorded(self) -> None:
+        """Tests that mechanical mistakes the model makes are fixed without
+        another pass through the loop."""
+        state = State({"current_code": "10 PRNT 1\n20 GO TO 10"}, {})
+        response = LlmResponse(
+            content=types.Content(
+                role="model", parts=[types.Part(text="10 print 1\n20 goto 10")]
+            )
+        )
+
+        result = record_debugged_code(MagicMock(state=state), response)
+
+        self.assertEqual(result.content.parts[0].text, "~ 10 PRINT 1")
+        self.assertEqual(code_state.current_code(state), "10 PRINT 1\n20 GO TO 10")
+
+
+if __name__ == "__main__":
+    unittest.main()
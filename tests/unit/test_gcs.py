@@ -0,0 +1,125 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+from google.api_core import exceptions
+from google.auth import compute_engine
+from google.oauth2 import service_account
+
+from app.utils import gcs
+from app.utils.cache import LRUCache
+
+
+@patch("app.utils.gcs.storage.Client")
+class TestUploadIfMissing(unittest.TestCase):
+    def setUp(self) -> None:
+        gcs._clients.clear()
+        gcs.known_blobs.clear()
+
+    def test_existing_object_is_skipped(self, mock_storage_client: MagicMock) -> None:
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = True
+
+        blob, uploaded = gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")
+
+        self.assertIs(blob, mock_blob.return_value)
+        self.assertFalse(uploaded)
+        mock_blob.return_value.upload_from_string.assert_not_called()
+
+    def test_known_object_is_not_checked_again(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = False
+
+        self.assertTrue(gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")[1])
+        self.assertFalse(gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")[1])
+        mock_blob.return_value.exists.assert_called_once()
+        mock_storage_client.assert_called_once_with(project=None)
+
+    def test_known_object_is_checked_again_after_ttl(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        """Tests that an object deleted by a lifecycle rule is uploaded again."""
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = False
+        now = [0.0]
+        known_blobs = LRUCache[bool](ttl=60, clock=lambda: now[0])
+
+        with patch.object(gcs, "known_blobs", known_blobs):
+            self.assertTrue(gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")[1])
+            now[0] = 61
+            self.assertTrue(gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")[1])
+
+    def test_concurrent_upload_is_not_overwritten(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = False
+        mock_blob.return_value.upload_from_string.side_effect = (
+            exceptions.PreconditionFailed("exists")
+        )
+        self.assertFalse(gcs.upload_if_missing("bucket", "taps/a.tap", b"tap")[1])
+
+
+class TestGenerateSignedUrl(unittest.TestCase):
+    def test_service_account_key_signs_locally(self) -> None:
+        credentials = MagicMock(spec=service_account.Credentials)
+        blob = MagicMock()
+        expiration = datetime.timedelta(hours=1)
+        with patch.object(gcs, "_signing_credentials", credentials):
+            gcs.generate_signed_url(blob, expiration)
+        blob.generate_signed_url.assert_called_once_with(
+            version="v4", expiration=expiration, method="GET", credentials=credentials
+        )
+
+    def test_credentials_without_service_account_cannot_sign(self) -> None:
+        credentials = MagicMock(spec=["valid", "token", "refresh"])
+        with patch.object(gcs, "_signing_credentials", credentials):
+            with self.assertRaises(RuntimeError):
+                gcs.generate_signed_url(MagicMock(), datetime.timedelta(hours=1))
+
+    def test_keyless_credentials_use_access_token(self) -> None:
+        credentials = MagicMock(spec=compute_engine.Credentials)
+        credentials.valid = False
+        credentials.service_account_email = "runner@example.iam.gserviceaccount.com"
+        credentials.token = "token"
+        blob = MagicMock()
+        with patch.object(gcs, "_signing_credentials", credentials):
+            gcs.generate_signed_url(blob, datetime.timedelta(hours=1))
+        credentials.refresh.assert_called_once()
+        kwargs = blob.generate_signed_url.call_args.kwargs
+        self.assertEqual(kwargs["access_token"], "token")
+        self.assertEqual(
+            kwargs["service_account_email"], "runner@example.iam.gserviceaccount.com"
+        )
+
+
+class TestCachedUrl(unittest.TestCase):
+    def setUp(self) -> None:
+        gcs.signed_urls.clear()
+
+    @patch("app.utils.gcs.time.time", return_value=1000.0)
+    def test_url_is_reused_until_threshold(self, _: MagicMock) -> None:
+        gcs.cache_url("bucket", "a.tap", "https://signed", expires_at=2000.0)
+        self.assertEqual(gcs.get_cached_url("bucket", "a.tap", 900), "https://signed")
+        self.assertIsNone(gcs.get_cached_url("bucket", "a.tap", 1001))
+        self.assertIsNone(gcs.get_cached_url("bucket", "b.tap", 0))
+
+    def test_public_url_does_not_expire(self) -> None:
+        gcs.cache_url("bucket", "a.tap", "https://public")
+        self.assertEqual(gcs.get_cached_url("bucket", "a.tap", 10**9), "https://public")
+
+
+class TestContentAddressedName(unittest.TestCase):
+    def test_name_depends_only_on_content(self) -> None:
+        name = gcs.content_addressed_name(b"tap", suffix=".tap", prefix="taps/")
+        self.assertEqual(name, gcs.content_addressed_name(b"tap", ".tap", "taps/"))
+        self.assertNotEqual(name, gcs.content_addressed_name(b"tap2", ".tap", "taps/"))
+        self.assertTrue(name.startswith("taps/") and name.endswith(".tap"))
+        self.assertEqual(len(name), len("taps/.tap") + 64)
+        self.assertEqual(gcs.tap_blob_name(b"tap"), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
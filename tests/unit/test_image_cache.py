@@ -0,0 +1,172 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from app.utils import image_cache
+from app.utils.image_cache import (
+    ExtractionCache,
+    extraction_key,
+    key_distance,
+    perceptual_hash,
+)
+
+
+def _listing_image(
+    size: tuple[int, int] = (400, 300),
+    text: str = "10 PRINT 1",
+    image_format: str = "PNG",
+) -> bytes:
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(0, size[1] - 20, 20):
+        draw.text((10, row + 5), f"{row} {text}", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class TestPerceptualHash(unittest.TestCase):
+    def test_hash_survives_recompression_and_resizing(self) -> None:
+        """Tests that re-encoded copies of an image hash the same."""
+        original = _listing_image()
+        with Image.open(io.BytesIO(original)) as image:
+            buffer = io.BytesIO()
+            image.resize((800, 600)).save(buffer, format="PNG")
+        resized = buffer.getvalue()
+        jpeg = _listing_image(image_format="JPEG")
+        self.assertTrue(perceptual_hash(original).startswith("dhash:"))
+        self.assertLessEqual(
+            _hamming(perceptual_hash(original), perceptual_hash(jpeg)), 4
+        )
+        self.assertEqual(len(perceptual_hash(original)), len("dhash:") + 64)
+        self.assertLessEqual(
+            _hamming(perceptual_hash(original), perceptual_hash(resized)), 4
+        )
+
+    def test_different_listings_hash_differently(self) -> None:
+        """Tests that different pictures produce different hashes."""
+        self.assertNotEqual(
+            perceptual_hash(_listing_image(text="10 PRINT 1")),
+            perceptual_hash(_listing_image(size=(300, 400), text="GO TO 10")),
+        )
+
+    def test_non_image_bytes_fall_back_to_sha256(self) -> None:
+        """Tests that unreadable bytes are hashed exactly."""
+        self.assertTrue(perceptual_hash(b"not an image").startswith("sha256:"))
+
+    @patch.object(image_cache, "Image", None)
+    def test_missing_pillow_falls_back_to_sha256(self) -> None:
+        """Tests the fallback when Pillow is not installed."""
+        self.assertTrue(perceptual_hash(_listing_image()).startswith("sha256:"))
+
+
+class TestExtractionKey(unittest.TestCase):
+    def test_similar_layouts_with_different_content_differ(self) -> None:
+        """Tests that a shared perceptual hash does not make keys collide."""
+        with patch.object(image_cache, "perceptual_hash", return_value="dhash:00"):
+            self.assertNotEqual(
+                extraction_key([_listing_image(text="10 PRINT 1")]),
+                extraction_key([_listing_image(text="10 PRINT 2")]),
+            )
+
+    def test_text_changes_the_key(self) -> None:
+        """Tests that the user's text is part of the key."""
+        image = _listing_image()
+        self.assertEqual(extraction_key([image]), extraction_key([image], ""))
+        self.assertNotEqual(
+            extraction_key([image]), extraction_key([image], "Lines 10-50 only")
+        )
+        self.assertTrue(extraction_key([image]).startswith(perceptual_hash(image)))
+
+    def test_key_distance(self) -> None:
+        """Tests that only keys for the same pages and text are comparable."""
+        self.assertEqual(key_distance("dhash:0f/aa", "dhash:0e/bb"), (1, 1))
+        self.assertEqual(key_distance("dhash:0f/aa", "dhash:0f/aa"), (0, 0))
+        self.assertIsNone(key_distance("dhash:00/aa", "dhash:ff/aa"))
+        self.assertIsNone(key_distance("dhash:00/aa+text:1", "dhash:00/aa+text:2"))
+        self.assertIsNone(key_distance("dhash:00/aa", "dhash:00/aa+dhash:00/aa"))
+        self.assertIsNone(key_distance("sha256:1/aa", "sha256:2/aa"))
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a.split(":")[1], 16) ^ int(b.split(":")[1], 16)).count("1")
+
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "extractions.sqlite3")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_entries_survive_reopening(self) -> None:
+        """Tests that the cache persists across instances."""
+        ExtractionCache(self.path).put("dhash:1", "v1", "10 PRINT 1\n")
+        cache = ExtractionCache(self.path)
+        self.assertEqual(cache.get("dhash:1", "v1"), "10 PRINT 1\n")
+        self.assertIsNone(cache.get("dhash:1", "v2"))
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        """Tests that the size limit evicts by last use."""
+        cache = ExtractionCache(self.path, max_entries=2, ttl=None)
+        with patch("time.time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+            cache.put("a", "v1", "A")
+            cache.put("b", "v1", "B")
+            cache.get("a", "v1")
+            cache.put("c", "v1", "C")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b", "v1"))
+        self.assertEqual(cache.get("a", "v1"), "A")
+
+    def test_expired_entries_are_not_served(self) -> None:
+        """Tests the time-to-live."""
+        cache = ExtractionCache(self.path, ttl=10)
+        with patch("time.time", side_effect=[100.0, 111.0]):
+            cache.put("a", "v1", "A")
+            self.assertIsNone(cache.get("a", "v1"))
+        self.assertEqual(len(cache), 0)
+
+    def test_re_encoded_copy_of_a_page_hits(self) -> None:
+        """Tests that a perceptually identical upload is served from the cache
+        and a different listing or request text is not."""
+        cache = ExtractionCache(self.path)
+        cache.put(extraction_key([_listing_image()]), "v1", "10 PRINT 1\n")
+
+        jpeg = _listing_image(image_format="JPEG")
+        self.assertEqual(cache.get(extraction_key([jpeg]), "v1"), "10 PRINT 1\n")
+        other = _listing_image(size=(300, 400), text="GO TO 10")
+        self.assertIsNone(cache.get(extraction_key([other]), "v1"))
+        self.assertIsNone(cache.get(extraction_key([jpeg], "Lines 10-50"), "v1"))
+        self.assertIsNone(cache.get(extraction_key([jpeg]), "v2"))
+
+    def test_closest_entry_wins_and_byte_digest_breaks_ties(self) -> None:
+        cache = ExtractionCache(self.path)
+        cache.put("dhash:00/aa", "v1", "A")
+        cache.put("dhash:03/bb", "v1", "B")
+        cache.put("dhash:07/cc", "v1", "C")
+        self.assertEqual(cache.get("dhash:01/bb", "v1"), "B")
+        self.assertEqual(cache.get("dhash:01/dd", "v1"), "A")
+
+    @patch.dict(
+        os.environ,
+        {"EXTRACTION_CACHE_MAX_ENTRIES": "5", "EXTRACTION_CACHE_TTL": "60"},
+    )
+    @patch.object(image_cache, "_extraction_cache", None)
+    def test_get_extraction_cache_reads_environment(self) -> None:
+        """Tests that the shared cache is configured from the environment."""
+        with patch.dict(os.environ, {"EXTRACTION_CACHE_PATH": self.path}):
+            cache = image_cache.get_extraction_cache()
+            self.assertIs(image_cache.get_extraction_cache(), cache)
+        self.assertEqual(cache.path, self.path)
+        self.assertEqual(cache.max_entries, 5)
+        self.assertEqual(cache.ttl, 60.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
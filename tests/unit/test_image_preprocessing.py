@@ -0,0 +1,172 @@
+import io
+import os
+import unittest
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from app.utils import image_preprocessing
+from app.utils.image_preprocessing import (
+    PreprocessingOptions,
+    estimate_tokens,
+    preprocess,
+    preprocessing_cache,
+    split_into_strips,
+)
+
+
+def _listing_photo(
+    size: tuple[int, int] = (3000, 2400),
+    skew: float = 0.0,
+    image_format: str = "JPEG",
+    dpi: tuple[int, int] | None = None,
+) -> bytes:
+    """A listing in the middle of a large page, optionally rotated."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(30):
+        draw.rectangle(
+            (900, 700 + row * 32, 900 + 400 + (row % 5) * 80, 700 + row * 32 + 14),
+            fill="black",
+        )
+    if skew:
+        image = image.rotate(skew, expand=True, fillcolor="white")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **({"dpi": dpi} if dpi else {}))
+    return buffer.getvalue()
+
+
+def _size(data: bytes) -> tuple[tuple[int, int], str]:
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size, image.mode
+
+
+class TestEstimateTokens(unittest.TestCase):
+    def test_small_images_cost_one_tile(self) -> None:
+        self.assertEqual(estimate_tokens(384, 200), 258)
+
+    def test_large_images_are_tiled(self) -> None:
+        self.assertEqual(estimate_tokens(1536, 1536), 4 * 258)
+        self.assertEqual(estimate_tokens(1000, 400), 8 * 258)
+
+
+class TestPreprocess(unittest.TestCase):
+    def setUp(self) -> None:
+        preprocessing_cache.clear()
+
+    def test_photo_is_cropped_to_text_and_shrunk(self) -> None:
+        """Tests that the margins are cropped and the savings reported."""
+        data = _listing_photo()
+        image = preprocess(data, "image/jpeg", PreprocessingOptions())
+        (width, height), mode = _size(image.data)
+        self.assertEqual(image.mime_type, "image/png")
+        self.assertEqual(mode, "L")
+        self.assertLess(width, 1000)
+        self.assertLess(height, 1100)
+        self.assertEqual(image.original_bytes, len(data))
+        self.assertGreater(image.saved_tokens, 0)
+        self.assertGreater(image.saved_bytes, 0)
+
+    def test_skewed_photo_is_straightened(self) -> None:
+        image = preprocess(_listing_photo(skew=3), "image/jpeg", PreprocessingOptions())
+        self.assertAlmostEqual(image.skew_degrees, -3.0, delta=0.3)
+
+    def test_bilevel_mode_and_size_limit(self) -> None:
+        options = PreprocessingOptions(color_mode="bilevel", max_side=300)
+        image = preprocess(_listing_photo(), "image/jpeg", options)
+        (width, height), mode = _size(image.data)
+        self.assertEqual(mode, "1")
+        self.assertEqual(max(width, height), 300)
+
+    def test_scans_are_downsampled_to_target_dpi(self) -> None:
+        options = PreprocessingOptions(target_dpi=150, max_side=10000)
+        image = preprocess(
+            _listing_photo(image_format="PNG", dpi=(600, 600)), "image/png", options
+        )
+        (width, _), _ = _size(image.data)
+        self.assertLess(width, 300)
+
+    def test_disabled_or_undecodable_images_are_unchanged(self) -> None:
+        data = _listing_photo()
+        image = preprocess(data, "image/jpeg", PreprocessingOptions(enabled=False))
+        self.assertIs(image.data, data)
+        self.assertEqual(image.saved_tokens, 0)
+        image = preprocess(b"not an image", "image/png", PreprocessingOptions())
+        self.assertEqual(image.data, b"not an image")
+        self.assertEqual(image.mime_type, "image/png")
+
+    def test_results_are_cached(self) -> None:
+        data = _listing_photo()
+        with patch.object(
+            image_preprocessing, "_preprocess", wraps=image_preprocessing._preprocess
+        ) as mock_preprocess:
+            first = preprocess(data, "image/jpeg", PreprocessingOptions())
+            second = preprocess(data, "image/jpeg", PreprocessingOptions())
+        self.assertIs(first, second)
+        mock_preprocess.assert_called_once()
+
+    @patch.dict(
+        os.environ,
+        {
+            "IMAGE_PREPROCESSING": "off",
+            "IMAGE_MAX_SIDE": "800",
+            "IMAGE_TARGET_DPI": "150",
+            "IMAGE_COLOR_MODE": "Bilevel",
+            "IMAGE_MAX_SKEW": "2.5",
+            "IMAGE_CROP_MARGIN": "4",
+        },
+    )
+    def test_options_from_env(self) -> None:
+        self.assertEqual(
+            PreprocessingOptions.from_env(),
+            PreprocessingOptions(
+                enabled=False,
+                max_side=800,
+                target_dpi=150,
+                color_mode="bilevel",
+                max_skew_degrees=2.5,
+                crop_margin=4,
+            ),
+        )
+
+
+def _tall_listing(size: tuple[int, int] = (400, 1400), line_height: int = 30) -> bytes:
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    for top in range(10, size[1] - line_height, line_height):
+        draw.rectangle((20, top, 300, top + 16), fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestSplitIntoStrips(unittest.TestCase):
+    def test_tall_image_is_cut_in_line_gaps_with_overlap(self) -> None:
+        strips = split_into_strips(_tall_listing(), PreprocessingOptions())
+        self.assertEqual(len(strips), 4)
+        tops = [0]
+        for strip in strips:
+            with Image.open(io.BytesIO(strip)) as image:
+                self.assertEqual(image.width, 400)
+                pixels = list(image.getdata())
+                # Neither edge slices through a text line.
+                self.assertTrue(all(value == 255 for value in pixels[-400:]))
+                self.assertTrue(all(value == 255 for value in pixels[:400]))
+                tops.append(tops[-1] + image.height)
+        # Together the strips cover more than the image: they overlap.
+        self.assertGreater(tops[-1], 1400)
+
+    def test_short_images_and_disabled_splitting_are_unchanged(self) -> None:
+        data = _tall_listing(size=(400, 500))
+        self.assertEqual(split_into_strips(data, PreprocessingOptions()), [data])
+        data = _tall_listing()
+        options = PreprocessingOptions(strip_aspect=0)
+        self.assertEqual(split_into_strips(data, options), [data])
+        self.assertEqual(
+            split_into_strips(b"not an image", PreprocessingOptions()),
+            [b"not an image"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+from collections.abc import AsyncIterator
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.jobs import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    ItemResult,
+    JobItem,
+    JobQueue,
+    JobStore,
+    mime_type_for,
+    run_pipeline,
+)
+
+
+class TestMimeTypeFor(unittest.TestCase):
+    def test_images_and_listings_are_accepted(self) -> None:
+        self.assertEqual(mime_type_for("page.png", "image/png"), "image/png")
+        self.assertEqual(
+            mime_type_for("game.bas", "application/octet-stream"), "text/plain"
+        )
+        self.assertEqual(mime_type_for("game", "text/plain"), "text/plain")
+
+    def test_other_files_are_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            mime_type_for("game.z80", "application/octet-stream")
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs", "jobs.sqlite3")
+        self.store = JobStore(self.path)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_items_are_claimed_in_order_and_survive_restarts(self) -> None:
+        job_id = self.store.create_job(
+            [("a.bas", "text/plain", b"10 PRINT 1"), ("b.png", "image/png", b"png")]
+        )
+        first = self.store.claim_next()
+        self.assertEqual((first.name, first.payload), ("a.bas", b"10 PRINT 1"))
+
+        # A new process finds the interrupted item queued again.
+        store = JobStore(self.path)
+        self.assertEqual(store.requeue_running(), 1)
+        self.assertEqual(store.claim_next().name, "a.bas")
+        self.assertEqual(store.claim_next().name, "b.png")
+        self.assertIsNone(store.claim_next())
+        self.assertEqual(store.job(job_id)["status"], RUNNING)
+
+    def test_status_and_archive(self) -> None:
+        job_id = self.store.create_job(
+            [("games/a.bas", "text/plain", b"1"), ("b.png", "image/png", b"2")]
+        )
+        self.assertEqual(self.store.job(job_id)["status"], QUEUED)
+        self.store.finish(self.store.claim_next().id, ItemResult(tap=b"tap"))
+        self.store.fail(self.store.claim_next().id, "No code found")
+
+        job = self.store.job(job_id)
+        self.assertEqual(job["status"], DONE)
+        self.assertEqual(job["counts"], {QUEUED: 0, RUNNING: 0, DONE: 1, FAILED: 1})
+        self.assertEqual(
+            [(item["status"], item["tap_size_bytes"]) for item in job["items"]],
+            [(DONE, 3), (FAILED, None)],
+        )
+        self.assertEqual(job["items"][1]["error"], "No code found")
+
+        with zipfile.ZipFile(io.BytesIO(self.store.archive(job_id))) as archive:
+            self.assertEqual(archive.read("0000-a.tap"), b"tap")
+            manifest = json.loads(archive.read("manifest.json"))
+        self.assertEqual([entry["tap"] for entry in manifest], ["0000-a.tap", None])
+
+    def test_unknown_job(self) -> None:
+        self.assertIsNone(self.store.job("missing"))
+
+    def test_finished_jobs_expire(self) -> None:
+        """Tests that only jobs finished longer than the TTL ago are deleted."""
+        store = JobStore(self.path, ttl=60)
+        finished = store.create_job([("a.bas", "text/plain", b"1")])
+        store.finish(store.claim_next().id, ItemResult(tap=b"tap"))
+        queued = store.create_job([("b.bas", "text/plain", b"2")])
+
+        with patch("time.time", return_value=time.time() + 120):
+            self.assertIsNone(store.job(finished))
+            self.assertEqual(store.job(queued)["status"], QUEUED)
+
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.directory.name, "jobs.sqlite3"))
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    async def test_workers_convert_items_concurrently(self) -> None:
+        """Tests that at most `concurrency` items run at once."""
+        running = 0
+        max_running = 0
+
+        async def process(item: JobItem) -> ItemResult:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            if item.name == "bad.bas":
+                raise RuntimeError("bas2tap failed")
+            return ItemResult(tap=item.payload)
+
+        queue = JobQueue(self.store, process, concurrency=3)
+        await queue.start()
+        try:
+            files = [(f"{n}.bas", "text/plain", b"%d" % n) for n in range(8)]
+            job_id = await queue.submit([*files, ("bad.bas", "text/plain", b"")])
+            for _ in range(200):
+                job = self.store.job(job_id)
+                if job["status"] == DONE:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+        self.assertEqual(job["counts"][DONE], 8)
+        self.assertEqual(job["counts"][FAILED], 1)
+        self.assertEqual(job["items"][-1]["error"], "bas2tap failed")
+        self.assertEqual(max_running, 3)
+
+
+class TestRunPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_session_is_deleted_when_it_cannot_be_read_back(self) -> None:
+        """Tests that a vanished session fails the item and is still cleaned up."""
+
+        async def run_async(**kwargs: Any) -> AsyncIterator[None]:
+            return
+            yield
+
+        runner = MagicMock()
+        runner.app_name = "app"
+        runner.run_async = run_async
+        runner.session_service.create_session = AsyncMock(
+            return_value=MagicMock(id="session-1")
+        )
+        runner.session_service.get_session = AsyncMock(return_value=None)
+        runner.session_service.delete_session = AsyncMock()
+        runner.artifact_service.list_artifact_keys = AsyncMock(return_value=[])
+        item = JobItem(1, "job", "a.bas", "text/plain", b"10 PRINT 1")
+
+        with patch("app.jobs._runner", runner):
+            with self.assertRaisesRegex(RuntimeError, "did not create a TAP file"):
+                await run_pipeline(item)
+
+        runner.session_service.delete_session.assert_awaited_once_with(
+            app_name="app", user_id="jobs", session_id="session-1"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
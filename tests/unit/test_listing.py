@@ -0,0 +1,66 @@
+import unittest
+
+from app.utils.listing import merge_listings, parse_lines
+
+
+class TestParseLines(unittest.TestCase):
+    def test_numbered_and_continuation_lines(self) -> None:
+        self.assertEqual(
+            parse_lines('10 PRINT "A"\n\n  20LET A=1\nB"\n'),
+            [(10, 'PRINT "A"'), (20, "LET A=1"), (None, 'B"')],
+        )
+
+
+class TestMergeListings(unittest.TestCase):
+    def test_pages_are_merged_in_line_order(self) -> None:
+        self.assertEqual(
+            merge_listings(["30 STOP\n", "10 PRINT 1\n20 GO TO 10\n"]),
+            "10 PRINT 1\n20 GO TO 10\n30 STOP\n",
+        )
+
+    def test_partial_duplicate_loses_to_full_line(self) -> None:
+        """Tests that a line cut at a page boundary is replaced by the full copy."""
+        self.assertEqual(
+            merge_listings(['10 CLS\n20 PRINT "HEL', '20 PRINT "HELLO"\n30 STOP']),
+            '10 CLS\n20 PRINT "HELLO"\n30 STOP\n',
+        )
+
+    def test_most_common_copy_wins(self) -> None:
+        self.assertEqual(
+            merge_listings(["10 PRINT 1\n", "10 PRINT l\n", "10 PRINT 1\n"]),
+            "10 PRINT 1\n",
+        )
+
+    def test_ties_go_to_the_earliest_piece(self) -> None:
+        self.assertEqual(
+            merge_listings(["10 PRINT A\n", "10 PRINT B\n"]), "10 PRINT A\n"
+        )
+        self.assertEqual(
+            merge_listings(["10 PRINT B\n", "10 PRINT A\n"]), "10 PRINT B\n"
+        )
+
+    def test_wrapped_line_continues_across_pages(self) -> None:
+        self.assertEqual(
+            merge_listings(['10 PRINT "ABCDEFGHIJ', 'KLM"\n20 STOP']),
+            '10 PRINT "ABCDEFGHIJKLM"\n20 STOP\n',
+        )
+
+    def test_fragment_at_the_top_of_an_overlapping_strip_is_dropped(self) -> None:
+        """Tests that a line cut by a strip boundary is not appended to the
+        complete copy of it in the strip before."""
+        strips = ['10 PRINT "AAA"\n50 GO TO 10', '"; BBB\n60 STOP', "70 CLS"]
+        self.assertEqual(
+            merge_listings(strips, overlaps=[False, True, False]),
+            '10 PRINT "AAA"\n50 GO TO 10\n60 STOP\n70 CLS\n',
+        )
+        self.assertEqual(
+            merge_listings(['10 PRINT "A', 'B"\n20 STOP'], overlaps=[False, False]),
+            '10 PRINT "AB"\n20 STOP\n',
+        )
+
+    def test_empty(self) -> None:
+        self.assertEqual(merge_listings(["", "\n"]), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,18 @@
-import unittest
-from unittest.mock import MagicMock, patch, call
 import base64
+import hashlib
+import unittest
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from google.oauth2 import service_account
 
 from app.tools import (
+    _fix_extracted_code,
     _save_uploaded_image_to_state,
-    _decode_b64_str,
-)  # _decode_b64_str is used by the SUT
+    _upload_to_gcs_and_get_url,
+)
+from app.utils import gcs
+from app.utils.image_cache import extraction_key
 
 
 # Helper to create a dummy image bytes
@@ -18,8 +25,10 @@ def encode_to_b64_string(data: bytes) -> str:
     return base64.b64encode(data).decode("utf-8")
 
 
-class TestSaveUploadedImageToState(unittest.TestCase):
-    def _create_mock_callback_context(self, parts_data=None):
+class TestSaveUploadedImageToState(unittest.IsolatedAsyncioTestCase):
+    def _create_mock_callback_context(
+        self, parts_data: list[dict[str, Any]] | None = None
+    ) -> MagicMock:
         callback_context = MagicMock()
         callback_context.state = {}  # Simulate the state dictionary
         callback_context.user_content = MagicMock()
@@ -30,232 +39,167 @@ class TestSaveUploadedImageToState(unittest.TestCase):
             mock_parts = []
             for part_info in parts_data:
                 mock_part = MagicMock()
+                mock_part.text = part_info.get("text")
                 if "mime_type" in part_info:
                     mock_part.inline_data = MagicMock()
                     mock_part.inline_data.mime_type = part_info["mime_type"]
                     mock_part.inline_data.data = part_info.get("raw_data")
-                    mock_part.inline_data.b64_json = part_info.get("b64_json")
                 else:
-                    if part_info.get("no_inline_data", False):
-                        del mock_part.inline_data
-                    else:
-                        mock_part.inline_data = MagicMock(
-                            spec=["mime_type", "data", "b64_json"]
-                        )
-                        mock_part.inline_data.mime_type = None
+                    mock_part.inline_data = None
                 mock_parts.append(mock_part)
             callback_context.user_content.parts = mock_parts
         return callback_context
 
+    def _expected_reference(self, data: bytes, mime_type: str) -> dict[str, Any]:
+        return {
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "mime_type": mime_type,
+            "size_bytes": len(data),
+        }
+
     @patch("app.tools.logger")
-    def test_no_user_content(self, mock_logger):
+    async def test_no_user_content(self, mock_logger: MagicMock) -> None:
         callback_context = self._create_mock_callback_context()
         callback_context.user_content = None
-        _save_uploaded_image_to_state(callback_context)
-        self.assertNotIn("uploaded_image_b64", callback_context.state)
-        self.assertNotIn("uploaded_image_parts", callback_context.state)
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertNotIn("uploaded_images", callback_context.state)
         mock_logger.info.assert_any_call(
             "Callback: No content or parts found in user_content."
         )
 
     @patch("app.tools.logger")
-    def test_user_content_parts_is_none(self, mock_logger):
+    async def test_user_content_parts_is_none(self, mock_logger: MagicMock) -> None:
         callback_context = self._create_mock_callback_context(parts_data=None)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertNotIn("uploaded_image_b64", callback_context.state)
-        self.assertNotIn("uploaded_image_parts", callback_context.state)
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertNotIn("uploaded_images", callback_context.state)
         mock_logger.info.assert_any_call(
             "Callback: No content or parts found in user_content."
         )
 
     @patch("app.tools.logger")
-    def test_user_content_parts_is_empty(self, mock_logger):
+    async def test_user_content_parts_is_empty(self, mock_logger: MagicMock) -> None:
         callback_context = self._create_mock_callback_context(parts_data=[])
-        _save_uploaded_image_to_state(callback_context)
-        self.assertNotIn("uploaded_image_b64", callback_context.state)
-        self.assertNotIn("uploaded_image_parts", callback_context.state)
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertNotIn("uploaded_images", callback_context.state)
         mock_logger.info.assert_any_call(
             "Callback: No content or parts found in user_content."
         )
 
     @patch("app.tools.logger")
-    def test_no_image_parts(self, mock_logger):
+    async def test_no_image_parts(self, mock_logger: MagicMock) -> None:
         parts_data = [{"mime_type": "text/plain"}]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertNotIn("uploaded_image_b64", callback_context.state)
-        self.assertTrue(
-            callback_context.state.get("uploaded_image_parts") is None
-            or len(callback_context.state.get("uploaded_image_parts")) == 0
-        )
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertIsNone(callback_context.state.get("uploaded_images"))
         mock_logger.info.assert_any_call(
-            "Callback: No valid image parts found to save to the list."
+            "Callback: No valid image parts found to save."
         )
 
     @patch("app.tools.logger")
-    def test_single_image_raw_bytes(self, mock_logger):
+    async def test_single_image_raw_bytes(self, mock_logger: MagicMock) -> None:
         dummy_bytes = create_dummy_image_bytes("raw_image_1")
-        expected_b64 = encode_to_b64_string(dummy_bytes)
         parts_data = [{"mime_type": "image/jpeg", "raw_data": dummy_bytes}]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertEqual(callback_context.state.get("uploaded_image_b64"), expected_b64)
-        self.assertIsNotNone(callback_context.state.get("uploaded_image_parts"))
-        self.assertEqual(len(callback_context.state["uploaded_image_parts"]), 1)
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["b64"], expected_b64
-        )
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["mime_type"], "image/jpeg"
-        )
-        mock_logger.info.assert_any_call(
-            f"Callback: Saved first image base64 string (len: {len(expected_b64)}) to state['uploaded_image_b64']."
-        )
+        await _save_uploaded_image_to_state(callback_context)
+        expected = self._expected_reference(dummy_bytes, "image/jpeg")
+        self.assertEqual(callback_context.state["uploaded_images"], [expected])
+        self.assertNotIn("uploaded_image_b64", callback_context.state)
+        self.assertNotIn("uploaded_image_parts", callback_context.state)
         mock_logger.info.assert_any_call(
-            "Callback: Saved list of 1 image parts to state['uploaded_image_parts']."
+            "Callback: Saved 1 image references to state['uploaded_images']."
         )
 
     @patch("app.tools.logger")
-    def test_single_image_b64_json(self, mock_logger):
-        original_bytes = create_dummy_image_bytes("b64_image_1_needs_padding")
-        b64_str_input = base64.b64encode(original_bytes).decode("utf-8").rstrip("=")
-        parts_data = [{"mime_type": "image/png", "b64_json": b64_str_input}]
+    async def test_non_image_inline_data_is_ignored(
+        self, mock_logger: MagicMock
+    ) -> None:
+        parts_data = [{"mime_type": "text/plain", "raw_data": b"10 PRINT 1"}]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        expected_final_b64 = encode_to_b64_string(original_bytes)
-        self.assertEqual(
-            callback_context.state.get("uploaded_image_b64"), expected_final_b64
-        )
-        self.assertIsNotNone(callback_context.state.get("uploaded_image_parts"))
-        self.assertEqual(len(callback_context.state["uploaded_image_parts"]), 1)
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["b64"], expected_final_b64
-        )
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["mime_type"], "image/png"
-        )
-
-    @patch("app.tools.logger")
-    @patch("app.tools._decode_b64_str")
-    def test_single_image_b64_json_with_data_url_prefix(
-        self, mock_decode_b64_str, mock_logger
-    ):
-        dummy_bytes = create_dummy_image_bytes("data_url_image")
-        mock_decode_b64_str.return_value = dummy_bytes
-        b64_str_with_prefix = "data:image/gif;base64," + encode_to_b64_string(
-            dummy_bytes
-        )
-        parts_data = [{"mime_type": "image/gif", "b64_json": b64_str_with_prefix}]
-        callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        mock_decode_b64_str.assert_called_once_with(b64_str_with_prefix)
-        expected_final_b64 = encode_to_b64_string(dummy_bytes)
-        self.assertEqual(
-            callback_context.state.get("uploaded_image_b64"), expected_final_b64
-        )
-        self.assertIsNotNone(callback_context.state.get("uploaded_image_parts"))
-        self.assertEqual(len(callback_context.state["uploaded_image_parts"]), 1)
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["b64"], expected_final_b64
-        )
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["mime_type"], "image/gif"
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertIsNone(callback_context.state.get("uploaded_images"))
+        mock_logger.info.assert_any_call(
+            "Callback: No valid image parts found to save."
         )
 
     @patch("app.tools.logger")
-    def test_multiple_images(self, mock_logger):
+    async def test_multiple_images(self, mock_logger: MagicMock) -> None:
         img1_bytes = create_dummy_image_bytes("multi_img_1_raw")
-        img1_b64_expected = encode_to_b64_string(img1_bytes)
-        img2_original_bytes = create_dummy_image_bytes("multi_img_2_b64")
-        img2_b64_input = encode_to_b64_string(img2_original_bytes)
-        img2_b64_expected = encode_to_b64_string(img2_original_bytes)
-        parts_data = [
+        img2_original_bytes = create_dummy_image_bytes("multi_img_2_raw")
+        parts_data: list[dict[str, Any]] = [
             {"mime_type": "image/jpeg", "raw_data": img1_bytes},
-            {"mime_type": "image/png", "b64_json": img2_b64_input},
+            {"mime_type": "image/png", "raw_data": img2_original_bytes},
         ]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertEqual(
-            callback_context.state.get("uploaded_image_b64"), img1_b64_expected
-        )
-        self.assertIsNotNone(callback_context.state.get("uploaded_image_parts"))
-        self.assertEqual(len(callback_context.state["uploaded_image_parts"]), 2)
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["b64"], img1_b64_expected
-        )
+        await _save_uploaded_image_to_state(callback_context)
         self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["mime_type"], "image/jpeg"
+            callback_context.state["uploaded_images"],
+            [
+                self._expected_reference(img1_bytes, "image/jpeg"),
+                self._expected_reference(img2_original_bytes, "image/png"),
+            ],
         )
-        self.assertEqual(
-            callback_context.state["uploaded_image_parts"][1]["b64"], img2_b64_expected
+        mock_logger.info.assert_any_call(
+            "Callback: Saved 2 image references to state['uploaded_images']."
         )
         self.assertEqual(
-            callback_context.state["uploaded_image_parts"][1]["mime_type"], "image/png"
-        )
-        mock_logger.info.assert_any_call(
-            "Callback: Saved list of 2 image parts to state['uploaded_image_parts']."
+            callback_context.state["uploaded_image_hash"],
+            extraction_key([img1_bytes, img2_original_bytes]),
         )
 
     @patch("app.tools.logger")
-    def test_image_part_missing_data_and_b64_json(self, mock_logger):
-        parts_data = [{"mime_type": "image/webp"}]
+    async def test_text_is_part_of_the_extraction_key(
+        self, mock_logger: MagicMock
+    ) -> None:
+        dummy_bytes = create_dummy_image_bytes("image_with_text")
+        parts_data: list[dict[str, Any]] = [
+            {"text": "Only lines 10 to 50"},
+            {"mime_type": "image/png", "raw_data": dummy_bytes},
+        ]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertIsNone(callback_context.state.get("uploaded_image_b64"))
-        self.assertTrue(
-            callback_context.state.get("uploaded_image_parts") is None
-            or len(callback_context.state.get("uploaded_image_parts")) == 0
-        )
-        mock_logger.warning.assert_any_call(
-            "Callback: Image part 0 found but no suitable data/b64_json."
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertEqual(
+            callback_context.state["uploaded_image_hash"],
+            extraction_key([dummy_bytes], "Only lines 10 to 50"),
         )
-        mock_logger.info.assert_any_call(
-            "Callback: No valid image parts found to save to the list."
+        self.assertNotEqual(
+            callback_context.state["uploaded_image_hash"],
+            extraction_key([dummy_bytes]),
         )
 
     @patch("app.tools.logger")
-    @patch("app.tools._decode_b64_str")
-    def test_image_part_invalid_b64_json(self, mock_decode_b64_str, mock_logger):
-        mock_decode_b64_str.side_effect = Exception("Simulated decode error")
-        parts_data = [{"mime_type": "image/bmp", "b64_json": "this_is_not_valid_b64"}]
+    async def test_image_part_missing_data(self, mock_logger: MagicMock) -> None:
+        parts_data = [{"mime_type": "image/webp"}]
         callback_context = self._create_mock_callback_context(parts_data)
-        _save_uploaded_image_to_state(callback_context)
-        self.assertIsNone(callback_context.state.get("uploaded_image_b64"))
-        self.assertTrue(
-            callback_context.state.get("uploaded_image_parts") is None
-            or len(callback_context.state.get("uploaded_image_parts")) == 0
-        )
-        mock_logger.error.assert_any_call(
-            "Callback: Failed to decode base64 from part 0: Simulated decode error"
-        )
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertIsNone(callback_context.state.get("uploaded_images"))
         mock_logger.info.assert_any_call(
-            "Callback: No valid image parts found to save to the list."
+            "Callback: No valid image parts found to save."
         )
 
     @patch("app.tools.logger")
-    def test_state_clearing_before_processing(self, mock_logger):
+    async def test_state_clearing_before_processing(
+        self, mock_logger: MagicMock
+    ) -> None:
         initial_state = {
             "uploaded_image_b64": "old_image_data",
             "uploaded_mask_b64": "old_mask_data",
             "uploaded_image_parts": [
                 {"b64": "old_part_data", "mime_type": "image/gif"}
             ],
+            "uploaded_images": [{"artifact": "old.gif"}],
             "unrelated_key": "should_remain",
         }
         new_image_bytes = create_dummy_image_bytes("new_image")
-        new_image_b64 = encode_to_b64_string(new_image_bytes)
         parts_data = [{"mime_type": "image/png", "raw_data": new_image_bytes}]
         callback_context = self._create_mock_callback_context(parts_data)
         callback_context.state = initial_state
-        _save_uploaded_image_to_state(callback_context)
-        self.assertEqual(
-            callback_context.state.get("uploaded_image_b64"), new_image_b64
-        )
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertIsNone(callback_context.state.get("uploaded_image_b64"))
         self.assertIsNone(callback_context.state.get("uploaded_mask_b64"))
-        self.assertIsNotNone(callback_context.state.get("uploaded_image_parts"))
-        self.assertEqual(len(callback_context.state["uploaded_image_parts"]), 1)
+        self.assertIsNone(callback_context.state.get("uploaded_image_parts"))
         self.assertEqual(
-            callback_context.state["uploaded_image_parts"][0]["b64"], new_image_b64
+            callback_context.state["uploaded_images"],
+            [self._expected_reference(new_image_bytes, "image/png")],
         )
         self.assertEqual(callback_context.state.get("unrelated_key"), "should_remain")
         mock_logger.debug.assert_any_call(
@@ -269,30 +213,121 @@ class TestSaveUploadedImageToState(unittest.TestCase):
         )
 
     @patch("app.tools.logger")
-    def test_state_after_no_valid_images_found_when_previously_set(self, mock_logger):
+    async def test_state_after_no_valid_images_found_when_previously_set(
+        self, mock_logger: MagicMock
+    ) -> None:
         initial_state = {
-            "uploaded_image_b64": "old_image_data",
-            "uploaded_image_parts": [
-                {"b64": "old_part_data", "mime_type": "image/jpeg"}
-            ],
+            "uploaded_images": [{"artifact": "old.jpg"}],
+            "uploaded_image_hash": "dhash:00",
         }
         parts_data_with_no_valid_images = [{"mime_type": "text/plain"}]
         callback_context = self._create_mock_callback_context(
             parts_data_with_no_valid_images
         )
         callback_context.state = initial_state
-        _save_uploaded_image_to_state(callback_context)
-        self.assertIsNone(callback_context.state.get("uploaded_image_b64"))
-        self.assertIsNone(callback_context.state.get("uploaded_image_parts"))
+        await _save_uploaded_image_to_state(callback_context)
+        self.assertIsNone(callback_context.state.get("uploaded_images"))
+        self.assertIsNone(callback_context.state.get("uploaded_image_hash"))
         mock_logger.info.assert_any_call(
-            "Callback: No valid image parts found to save to the list."
+            "Callback: No valid image parts found to save."
         )
         mock_logger.debug.assert_any_call(
-            "Cleared key 'uploaded_image_b64' in session state by setting to None."
+            "Cleared key 'uploaded_images' in session state by setting to None."
         )
-        mock_logger.debug.assert_any_call(
-            "Cleared key 'uploaded_image_parts' in session state by setting to None."
+
+
+@patch.dict("os.environ", {"GCS_BUCKET_NAME": "test-bucket"})
+class TestUploadToGcsAndGetUrl(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        gcs._clients.clear()
+        gcs.known_blobs.clear()
+        gcs.signed_urls.clear()
+        credentials = patch.object(
+            gcs, "_signing_credentials", MagicMock(spec=service_account.Credentials)
+        )
+        credentials.start()
+        self.addCleanup(credentials.stop)
+
+    @patch("app.utils.gcs.storage.Client")
+    async def test_uploads_tap_bytes_under_content_hash(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        tap_bytes = b"\x13\x00\x00\x00\xff"
+        callback_context = MagicMock()
+        callback_context.state = {
+            "tap_file_b64": encode_to_b64_string(tap_bytes),
+            "tap_file_name": "abc.tap",
+        }
+        mock_bucket = mock_storage_client.return_value.bucket.return_value
+        mock_blob = mock_bucket.blob.return_value
+        mock_blob.exists.return_value = False
+        mock_blob.generate_signed_url.return_value = "https://signed"
+
+        await _upload_to_gcs_and_get_url(callback_context)
+
+        mock_storage_client.return_value.bucket.assert_called_once_with("test-bucket")
+        mock_bucket.blob.assert_called_once_with(
+            f"taps/{hashlib.sha256(tap_bytes).hexdigest()}.tap"
         )
+        mock_blob.upload_from_string.assert_called_once_with(
+            tap_bytes, content_type="application/octet-stream", if_generation_match=0
+        )
+        self.assertEqual(callback_context.state["tap_public_url"], "https://signed")
+
+    @patch("app.utils.gcs.storage.Client")
+    async def test_repeated_program_reuses_its_url(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        """Tests that a repeat neither uploads nor signs while the URL is fresh."""
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = False
+        mock_blob.return_value.generate_signed_url.return_value = "https://signed"
+        for _ in range(2):
+            callback_context = MagicMock()
+            callback_context.state = {"tap_file_b64": encode_to_b64_string(b"tap")}
+            await _upload_to_gcs_and_get_url(callback_context)
+            self.assertEqual(callback_context.state["tap_public_url"], "https://signed")
+
+        mock_storage_client.assert_called_once()
+        mock_blob.return_value.upload_from_string.assert_called_once()
+        mock_blob.return_value.generate_signed_url.assert_called_once()
+
+    @patch("app.utils.gcs.storage.Client")
+    async def test_url_is_signed_again_near_expiry(
+        self, mock_storage_client: MagicMock
+    ) -> None:
+        mock_blob = mock_storage_client.return_value.bucket.return_value.blob
+        mock_blob.return_value.exists.return_value = False
+        mock_blob.return_value.generate_signed_url.side_effect = [
+            "https://1",
+            "https://2",
+        ]
+        urls = []
+        for now in (1000.0, 1000.0 + 3600 - 900 + 1):
+            callback_context = MagicMock()
+            callback_context.state = {"tap_file_b64": encode_to_b64_string(b"tap")}
+            with (
+                patch("app.tools.time.time", return_value=now),
+                patch("app.utils.gcs.time.time", return_value=now),
+            ):
+                await _upload_to_gcs_and_get_url(callback_context)
+            urls.append(callback_context.state["tap_public_url"])
+
+        self.assertEqual(urls, ["https://1", "https://2"])
+        mock_blob.return_value.upload_from_string.assert_called_once()
+
+    async def test_missing_tap_file_raises(self) -> None:
+        callback_context = MagicMock()
+        callback_context.state = {}
+        with self.assertRaises(ValueError):
+            await _upload_to_gcs_and_get_url(callback_context)
+
+
+class TestFixExtractedCode(unittest.TestCase):
+    def test_extracted_code_is_fixed_in_state(self) -> None:
+        callback_context = MagicMock(state={"current_code": "1O print 1\n\n"})
+        self.assertIsNone(_fix_extracted_code(callback_context))
+        self.assertEqual(callback_context.state["current_code"], "10 PRINT 1\n")
 
 
 if __name__ == "__main__":
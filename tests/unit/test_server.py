@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+from google.adk.artifacts import InMemoryArtifactService
+from starlette.routing import Mount
+
+from app import server, sessions
+
+
+class TestCreateApp(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = sessions.SessionStore(
+            os.path.join(self.directory.name, "s.sqlite3")
+        )
+        self.artifacts = InMemoryArtifactService()
+        self.client = TestClient(
+            server.create_app(
+                agents_dir=server.AGENT_DIR,
+                session_service=sessions.SqliteSessionService(self.store),
+                artifact_service=lambda: self.artifacts,
+            )
+        )
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_served_sessions_are_stored_in_the_given_service(self) -> None:
+        """Tests that sessions created through the API outlive the process."""
+        response = self.client.post("/apps/app/users/u/sessions/s")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [session_id for session_id, _ in self.store.list_sessions("app", "u")],
+            ["s"],
+        )
+        self.assertEqual(
+            self.client.get("/apps/app/users/u/sessions/s").status_code, 200
+        )
+        self.assertEqual(
+            self.client.post("/apps/app/users/u/sessions/s").status_code, 400
+        )
+
+    def test_run_needs_an_existing_session(self) -> None:
+        """Tests that runs on unknown sessions are rejected before loading agents."""
+        response = self.client.post(
+            "/run",
+            json={
+                "app_name": "app",
+                "user_id": "u",
+                "session_id": "missing",
+                "new_message": {"role": "user", "parts": [{"text": "hi"}]},
+            },
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_artifacts_come_from_the_given_service(self) -> None:
+        """Tests that artifact endpoints read the artifact service passed in."""
+        self.client.post("/apps/app/users/u/sessions/s")
+
+        response = self.client.get("/apps/app/users/u/sessions/s/artifacts")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_adk_app_is_mounted_after_the_other_routes(self) -> None:
+        """Tests that ADK's app only receives paths no other route handles."""
+        route = server.app.routes[-1]
+
+        self.assertIsInstance(route, Mount)
+        self.assertEqual(TestClient(server.app).get("/list-apps").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
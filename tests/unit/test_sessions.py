@@ -0,0 +1,246 @@
+import os
+import tempfile
+import time
+import unittest
+from typing import Any
+from unittest import mock
+
+from google.adk.events import Event, EventActions
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types
+
+from app import sessions
+
+
+def _event(
+    text: str,
+    timestamp: float | None = None,
+    state_delta: dict[str, Any] | None = None,
+    partial: bool | None = None,
+) -> Event:
+    return Event(
+        author="user",
+        content=types.Content(role="user", parts=[types.Part(text=text)]),
+        actions=EventActions(state_delta=state_delta or {}),
+        partial=partial,
+        timestamp=timestamp or time.time(),
+    )
+
+
+class TestSqliteSessionService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = sessions.SessionStore(
+            os.path.join(self.directory.name, "sessions.sqlite3"),
+            ttl=3600,
+            max_bytes=None,
+        )
+        self.service = sessions.SqliteSessionService(self.store)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    async def test_events_and_state_round_trip(self) -> None:
+        session = await self.service.create_session(
+            app_name="app", user_id="u", state={"a": 1, "app:shared": "x"}
+        )
+        await self.service.append_event(
+            session,
+            _event("hi", state_delta={"b": 2, "user:name": "n", "temp:t": 0}),
+        )
+        await self.service.append_event(session, _event("partial", partial=True))
+
+        loaded = await self.service.get_session(
+            app_name="app", user_id="u", session_id=session.id
+        )
+
+        self.assertEqual(
+            loaded.state, {"a": 1, "b": 2, "app:shared": "x", "user:name": "n"}
+        )
+        self.assertEqual([e.content.parts[0].text for e in loaded.events], ["hi"])
+        self.assertEqual(loaded.events[0].id, session.events[0].id)
+        other = await self.service.create_session(app_name="app", user_id="u")
+        self.assertEqual(other.state, {"app:shared": "x", "user:name": "n"})
+
+    async def test_get_session_reads_only_requested_events(self) -> None:
+        session = await self.service.create_session(
+            app_name="app", user_id="u", session_id="s"
+        )
+        for i in range(5):
+            await self.service.append_event(session, _event(str(i), timestamp=i + 1))
+
+        recent = await self.service.get_session(
+            app_name="app",
+            user_id="u",
+            session_id="s",
+            config=GetSessionConfig(num_recent_events=2),
+        )
+        after = await self.service.get_session(
+            app_name="app",
+            user_id="u",
+            session_id="s",
+            config=GetSessionConfig(after_timestamp=4),
+        )
+
+        self.assertEqual([e.content.parts[0].text for e in recent.events], ["3", "4"])
+        self.assertEqual([e.content.parts[0].text for e in after.events], ["3", "4"])
+        self.assertEqual(recent.last_update_time, 5)
+
+    async def test_get_session_without_config_reads_at_most_max_events(self) -> None:
+        service = sessions.SqliteSessionService(self.store, max_events=3)
+        session = await service.create_session(
+            app_name="app", user_id="u", session_id="s"
+        )
+        for i in range(5):
+            await service.append_event(session, _event(str(i), timestamp=i + 1))
+
+        bounded = await service.get_session(app_name="app", user_id="u", session_id="s")
+        unbounded = await sessions.SqliteSessionService(
+            self.store, max_events=0
+        ).get_session(app_name="app", user_id="u", session_id="s")
+
+        self.assertEqual(
+            [e.content.parts[0].text for e in bounded.events], ["2", "3", "4"]
+        )
+        self.assertEqual(len(unbounded.events), 5)
+
+    async def test_list_and_delete_sessions(self) -> None:
+        await self.service.create_session(app_name="app", user_id="u", session_id="s")
+        with self.assertRaises(ValueError):
+            await self.service.create_session(
+                app_name="app", user_id="u", session_id="s"
+            )
+
+        listed = await self.service.list_sessions(app_name="app", user_id="u")
+        self.assertEqual([s.id for s in listed.sessions], ["s"])
+        self.assertEqual(listed.sessions[0].events, [])
+
+        await self.service.delete_session(app_name="app", user_id="u", session_id="s")
+        self.assertIsNone(
+            await self.service.get_session(app_name="app", user_id="u", session_id="s")
+        )
+
+    async def test_expired_sessions_are_evicted(self) -> None:
+        with mock.patch.object(sessions.time, "time", return_value=1000.0):
+            await self.service.create_session(
+                app_name="app", user_id="u", session_id="old"
+            )
+        with mock.patch.object(sessions.time, "time", return_value=1000.0 + 3601):
+            await self.service.create_session(
+                app_name="app", user_id="u", session_id="new"
+            )
+
+        listed = await self.service.list_sessions(app_name="app", user_id="u")
+        self.assertEqual([s.id for s in listed.sessions], ["new"])
+        self.assertEqual(self.store.stats()["evictions"], 1)
+
+    async def test_expired_session_is_evicted_when_read(self) -> None:
+        with mock.patch.object(sessions.time, "time", return_value=1000.0):
+            await self.service.create_session(
+                app_name="app", user_id="u", session_id="old"
+            )
+        with mock.patch.object(sessions.time, "time", return_value=1000.0 + 3601):
+            loaded = await self.service.get_session(
+                app_name="app", user_id="u", session_id="old"
+            )
+
+        self.assertIsNone(loaded)
+        self.assertEqual(self.store.stats()["evictions"], 1)
+
+    async def test_writes_evict_other_sessions_but_not_their_own(self) -> None:
+        """Tests that a session growing past the budget makes room by evicting
+        the others, but is never evicted itself while it is being written."""
+        self.store.max_bytes = 1000
+        self.store.evict_interval = 0
+        await self.service.create_session(app_name="app", user_id="u", session_id="a")
+        session = await self.service.create_session(
+            app_name="app", user_id="u", session_id="b"
+        )
+        await self.service.append_event(session, _event("x" * 2000))
+
+        listed = await self.service.list_sessions(app_name="app", user_id="u")
+        self.assertEqual([s.id for s in listed.sessions], ["b"])
+        loaded = await self.service.get_session(
+            app_name="app", user_id="u", session_id="b"
+        )
+        self.assertEqual(len(loaded.events), 1)
+
+    async def test_least_recently_updated_sessions_are_evicted_over_budget(
+        self,
+    ) -> None:
+        self.store.max_bytes = 2500
+        artifacts = sessions.SqliteArtifactService(self.store)
+        for session_id in ("a", "b", "c"):
+            session = await self.service.create_session(
+                app_name="app", user_id="u", session_id=session_id
+            )
+            await artifacts.save_artifact(
+                app_name="app",
+                user_id="u",
+                session_id=session_id,
+                filename="image",
+                artifact=types.Part.from_bytes(data=b"x" * 1000, mime_type="image/png"),
+            )
+        await self.service.append_event(session, _event("latest"))
+
+        await self.service.create_session(app_name="app", user_id="u", session_id="d")
+
+        listed = await self.service.list_sessions(app_name="app", user_id="u")
+        self.assertEqual([s.id for s in listed.sessions], ["b", "c", "d"])
+        self.assertEqual(
+            await artifacts.list_artifact_keys(
+                app_name="app", user_id="u", session_id="a"
+            ),
+            [],
+        )
+        self.assertLessEqual(self.store.stats()["size_bytes"], 2500)
+
+
+class TestSqliteArtifactService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.service = sessions.SqliteArtifactService(
+            sessions.SessionStore(os.path.join(self.directory.name, "db.sqlite3"))
+        )
+        self.key = {"app_name": "app", "user_id": "u", "session_id": "s"}
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    async def test_versions_and_scopes(self) -> None:
+        image = types.Part.from_bytes(data=b"\x89PNG", mime_type="image/png")
+        text = types.Part(text="10 PRINT 1")
+        self.assertEqual(
+            await self.service.save_artifact(filename="f", artifact=text, **self.key), 0
+        )
+        self.assertEqual(
+            await self.service.save_artifact(filename="f", artifact=image, **self.key),
+            1,
+        )
+        await self.service.save_artifact(filename="user:p", artifact=text, **self.key)
+
+        self.assertEqual(
+            await self.service.load_artifact(filename="f", **self.key), image
+        )
+        self.assertEqual(
+            await self.service.load_artifact(filename="f", version=0, **self.key), text
+        )
+        self.assertEqual(
+            await self.service.list_versions(filename="f", **self.key), [0, 1]
+        )
+        self.assertEqual(
+            await self.service.list_artifact_keys(**self.key), ["f", "user:p"]
+        )
+        self.assertEqual(
+            await self.service.load_artifact(
+                app_name="app", user_id="u", session_id="other", filename="user:p"
+            ),
+            text,
+        )
+
+        await self.service.delete_artifact(filename="f", **self.key)
+        self.assertIsNone(await self.service.load_artifact(filename="f", **self.key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from app.utils.spectrum_basic import LineTable, convert
+
+
+class TestConvert(unittest.TestCase):
+    def test_valid_program(self) -> None:
+        """Tests that a valid listing converts without errors."""
+        result = convert('10 PRINT "hello"\n20 GO TO 10\n')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.stderr, "")
+        self.assertEqual(result.lines.line_numbers, [10, 20])
+        self.assertIn("Done! Listing contains 2 lines.", result.stdout)
+
+    def test_tokenizes_numbers_in_spectrum_format(self) -> None:
+        """Tests that numbers are followed by their 5-byte binary form."""
+        result = convert("10 PRINT 1\n")
+        self.assertEqual(
+            bytes(result.lines.program),
+            bytes.fromhex("000a0900f5310e00000100000d"),
+        )
+
+    def test_unknown_keyword(self) -> None:
+        """Tests that a misspelt keyword is reported like bas2tap does."""
+        result = convert('10 PRNT "hello"\n')
+        self.assertFalse(result.ok)
+        self.assertEqual(
+            result.stderr,
+            'ERROR in line 10, statement 1 - Expected keyword but got "P"\n',
+        )
+
+    def test_syntax_error(self) -> None:
+        """Tests that the syntax checker rejects a string where a number is due."""
+        result = convert('10 GO TO "a"\n')
+        self.assertFalse(result.ok)
+        self.assertIn("ERROR in line 10, statement 1", result.stderr)
+
+    def test_syntax_check_can_be_disabled(self) -> None:
+        """Tests that check_syntax=False only tokenizes the listing."""
+        result = convert('10 GO TO "a"\n', check_syntax=False)
+        self.assertTrue(result.ok)
+
+    def test_case_independent_keywords(self) -> None:
+        """Tests that lower-case keywords need case_independent=True."""
+        self.assertFalse(convert("10 print 1\n").ok)
+        self.assertTrue(convert("10 print 1\n", case_independent=True).ok)
+
+    def test_duplicate_line_warning(self) -> None:
+        """Tests that duplicate line numbers produce a warning on stdout."""
+        result = convert("10 PRINT 1\n10 PRINT 2\n")
+        self.assertIn("WARNING - Duplicate use of line number 10", result.stdout)
+        no_warnings = convert("10 PRINT 1\n10 PRINT 2\n", warnings=False)
+        self.assertNotIn("WARNING", no_warnings.stdout)
+
+
+class TestLineTable(unittest.TestCase):
+    def test_append_and_find(self) -> None:
+        """Tests that lines are stored in Spectrum memory layout."""
+        table = LineTable()
+        table.append(10, b"\xf5\x0d")
+        table.append(300, b"\xec\x0d")
+        self.assertEqual(len(table), 2)
+        self.assertEqual(
+            bytes(table.program),
+            b"\x00\x0a\x02\x00\xf5\x0d\x01\x2c\x02\x00\xec\x0d",
+        )
+        self.assertEqual(bytes(table.find(300)), b"\xec\x0d")
+        self.assertIsNone(table.find(20))
+        self.assertEqual(
+            [(number, bytes(body)) for number, body in table],
+            [(10, b"\xf5\x0d"), (300, b"\xec\x0d")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
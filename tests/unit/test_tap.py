@@ -0,0 +1,50 @@
+import unittest
+
+from app.utils.tap import encode_block, encode_program
+
+
+class TestEncodeBlock(unittest.TestCase):
+    def test_block_layout(self) -> None:
+        """Tests the length, flag, payload and checksum of a block."""
+        self.assertEqual(
+            encode_block(0xFF, b"\x01\x02\x04"),
+            b"\x05\x00\xff\x01\x02\x04\xf8",
+        )
+
+
+class TestEncodeProgram(unittest.TestCase):
+    PROGRAM = bytes.fromhex("000a0900f5310e00000100000d")  # 10 PRINT 1
+
+    def test_matches_bas2tap_output(self) -> None:
+        """Tests that the encoded file matches what bas2tap writes."""
+        self.assertEqual(
+            encode_program(self.PROGRAM),
+            bytes.fromhex(
+                "13000000202020202020202020200d00"
+                "00800d00800f00ff000a0900f5310e00000100000d3a"
+            ),
+        )
+
+    def test_name_and_autostart(self) -> None:
+        """Tests that the name is padded and the autostart line is stored."""
+        header = encode_program(self.PROGRAM, name="HELLO", autostart=10)[:21]
+        self.assertEqual(header[4:14], b"HELLO     ")
+        self.assertEqual(header[16:18], b"\x0a\x00")
+        self.assertEqual(header[20], 0x68)
+
+    def test_accepts_memoryview(self) -> None:
+        """Tests that a memoryview of the program can be encoded directly."""
+        self.assertEqual(
+            encode_program(memoryview(self.PROGRAM)), encode_program(self.PROGRAM)
+        )
+
+    def test_invalid_arguments(self) -> None:
+        """Tests that bas2tap's limits on the name and autostart line apply."""
+        with self.assertRaises(ValueError):
+            encode_program(self.PROGRAM, name="ELEVENCHARS")
+        with self.assertRaises(ValueError):
+            encode_program(self.PROGRAM, autostart=10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
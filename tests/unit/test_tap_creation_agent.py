@@ -0,0 +1,57 @@
+import os
+import unittest
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+
+from app.sub_agents.tap_creation_agent.agent import TapCreationAgent
+from app.utils import bas2tap, gcs
+
+
+@patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+class TestTapCreationAgent(unittest.IsolatedAsyncioTestCase):
+    async def _run(self, state: dict[str, Any]) -> tuple[list[Any], dict[str, Any]]:
+        runner = InMemoryRunner(agent=TapCreationAgent(name="tap"), app_name="test")
+        session = await runner.session_service.create_session(
+            app_name="test", user_id="user", state=state
+        )
+        events = [
+            event
+            async for event in runner.run_async(
+                user_id="user",
+                session_id=session.id,
+                new_message=types.Content(role="user", parts=[types.Part(text="go")]),
+            )
+        ]
+        session = await runner.session_service.get_session(
+            app_name="test", user_id="user", session_id=session.id
+        )
+        return events, session.state
+
+    async def test_compiles_current_code(self) -> None:
+        """Tests that the TAP file is built and named without a model call."""
+        events, state = await self._run({"current_code": "10 PRINT 1\n"})
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].content.parts[0].text, state["tap_file_name"])
+        self.assertEqual(
+            bas2tap.load_tap(state, "10 PRINT 1\n"),
+            bas2tap.compile_listing("10 PRINT 1\n").tap,
+        )
+
+    @patch("app.utils.bas2tap.compile_listing_async")
+    async def test_publishes_validated_tap(
+        self, mock_compile_listing: MagicMock
+    ) -> None:
+        """Tests that a TAP file kept by validation is published as is."""
+        state = {"current_code": "10 PRINT 1\n"}
+        bas2tap.store_tap(state, "10 PRINT 1\n", b"tap")
+        _, state = await self._run(state)
+        self.assertEqual(bas2tap.load_tap(state, "10 PRINT 1\n"), b"tap")
+        self.assertEqual(state["tap_file_name"], gcs.tap_blob_name(b"tap"))
+        mock_compile_listing.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
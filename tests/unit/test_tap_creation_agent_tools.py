@@ -0,0 +1,97 @@
+import base64
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.sub_agents.tap_creation_agent.tools import create_tap, publish_validated_tap
+from app.sub_agents.validation_agent.tools import validate_spectrum_code
+from app.utils import bas2tap, gcs, spectrum_basic
+from app.utils.bas2tap import compilation_cache
+
+
+class TestCreateTap(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        compilation_cache.clear()
+
+    def _create_mock_tool_context(self) -> MagicMock:
+        tool_context = MagicMock()
+        tool_context.state = {}
+        return tool_context
+
+    @patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+    @patch("asyncio.create_subprocess_exec")
+    async def test_tap_is_created_in_memory(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
+        """Tests that the native backend stores the TAP file in state."""
+        tool_context = self._create_mock_tool_context()
+        result = await create_tap("10 PRINT 1\n", tool_context)
+
+        tap_bytes = base64.b64decode(tool_context.state["tap_file_b64"])
+        self.assertEqual(tap_bytes[:4], b"\x13\x00\x00\x00")
+        self.assertEqual(result["size_bytes"], len(tap_bytes))
+        self.assertEqual(result["tap_file_name"], tool_context.state["tap_file_name"])
+        self.assertEqual(result["tap_file_name"], gcs.tap_blob_name(tap_bytes))
+        mock_create_subprocess_exec.assert_not_called()
+
+    @patch.dict(os.environ, {"BAS2TAP_BACKEND": "subprocess"})
+    @patch(
+        "asyncio.create_subprocess_exec",
+        side_effect=FileNotFoundError("bas2tap not found"),
+    )
+    async def test_bas2tap_not_found(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
+        """Tests that a missing bas2tap raises RuntimeError."""
+        with self.assertRaises(RuntimeError):
+            await create_tap("10 PRINT 1\n", self._create_mock_tool_context())
+
+    @patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+    @patch("app.utils.spectrum_basic.convert", wraps=spectrum_basic.convert)
+    async def test_validated_code_is_not_compiled_again(
+        self, mock_convert: MagicMock
+    ) -> None:
+        """Tests that create_tap reuses the validation tool's compilation."""
+        await validate_spectrum_code("10 PRINT 1\n")
+        await create_tap("10 PRINT 1\n", self._create_mock_tool_context())
+        mock_convert.assert_called_once()
+
+    @patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+    @patch("app.utils.bas2tap.compile_listing_async")
+    async def test_tap_from_validation_is_reused(
+        self, mock_compile_listing: MagicMock
+    ) -> None:
+        """Tests that create_tap publishes the TAP file kept by validation."""
+        tool_context = self._create_mock_tool_context()
+        bas2tap.store_tap(tool_context.state, "10 PRINT 1\n", b"tap")
+        result = await create_tap("10 PRINT 1\n", tool_context)
+        self.assertEqual(result["size_bytes"], 3)
+        mock_compile_listing.assert_not_called()
+
+
+@patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+class TestPublishValidatedTap(unittest.TestCase):
+    def test_skips_agent_when_code_was_validated(self) -> None:
+        """Tests that the agent is skipped when the TAP file already exists."""
+        callback_context = MagicMock()
+        callback_context.state = {"current_code": "10 PRINT 1\n"}
+        bas2tap.store_tap(callback_context.state, "10 PRINT 1\n", b"tap")
+
+        content = publish_validated_tap(callback_context)
+
+        tap_file_name = callback_context.state["tap_file_name"]
+        self.assertEqual(tap_file_name, gcs.tap_blob_name(b"tap"))
+        self.assertEqual(content.parts[0].text, tap_file_name)
+
+    def test_runs_agent_when_code_changed(self) -> None:
+        """Tests that the agent runs when the code changed after validation."""
+        callback_context = MagicMock()
+        callback_context.state = {"current_code": "10 PRINT 2\n"}
+        bas2tap.store_tap(callback_context.state, "10 PRINT 1\n", b"tap")
+
+        self.assertIsNone(publish_validated_tap(callback_context))
+        self.assertNotIn("tap_file_name", callback_context.state)
+
+
+if __name__ == "__main__":
+    unittest.main()
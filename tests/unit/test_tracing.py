@@ -0,0 +1,159 @@
+import gzip
+import json
+import threading
+import unittest
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from opentelemetry.sdk.trace import TracerProvider
+
+from app.utils import tracing
+from app.utils.tracing import CloudTraceLoggingSpanExporter
+
+
+def make_spans(*attributes: dict[str, Any]) -> list[Any]:
+    tracer = TracerProvider().get_tracer("test")
+    spans = []
+    with tracer.start_as_current_span("parent") as parent:
+        for span_attributes in attributes:
+            span = tracer.start_span("child", attributes=span_attributes)
+            span.add_event("event", {"n": 1})
+            span.end()
+            spans.append(span)
+    return [parent, *spans]
+
+
+class TestCloudTraceLoggingSpanExporter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.logging_client = MagicMock()
+        self.storage_client = MagicMock()
+        self.bucket = self.storage_client.bucket.return_value
+        self.bucket.exists.return_value = True
+
+    def _exporter(self, **kwargs: Any) -> CloudTraceLoggingSpanExporter:
+        exporter = CloudTraceLoggingSpanExporter(
+            logging_client=self.logging_client,
+            storage_client=self.storage_client,
+            project_id="test-project",
+            client=MagicMock(),
+            **kwargs,
+        )
+        self.addCleanup(exporter.shutdown)
+        return exporter
+
+    def test_spans_are_logged_in_one_batch(self) -> None:
+        spans = make_spans({"a": "1"}, {"b": (1, 2)})
+        exporter = self._exporter()
+
+        exporter.export(spans)
+
+        batch = self.logging_client.logger.return_value.batch.return_value
+        self.assertEqual(batch.log_struct.call_count, 3)
+        batch.commit.assert_called_once_with()
+        self.logging_client.logger.return_value.log_struct.assert_not_called()
+        for span, call in zip(spans, batch.log_struct.call_args_list, strict=True):
+            logged = call.args[0]
+            span_id = format(span.context.span_id, "x")
+            self.assertEqual(logged.pop("span_id"), span_id)
+            self.assertTrue(logged.pop("trace").startswith("projects/test-project/"))
+            self.assertEqual(json.loads(json.dumps(logged)), json.loads(span.to_json()))
+
+    def test_batches_are_split_by_size(self) -> None:
+        spans = make_spans({"a": "x" * 1000}, {"b": "y" * 1000})
+        exporter = self._exporter()
+
+        with patch.object(tracing, "LOG_BATCH_BUDGET", 1):
+            exporter.export(spans)
+
+        batch = self.logging_client.logger.return_value.batch
+        self.assertEqual(batch.call_count, 3)
+        self.assertEqual(batch.return_value.commit.call_count, 3)
+        self.assertEqual(batch.return_value.log_struct.call_count, 3)
+
+    def test_failed_commit_is_logged_and_spans_still_exported(self) -> None:
+        exporter = self._exporter()
+        batch = self.logging_client.logger.return_value.batch.return_value
+        batch.commit.side_effect = RuntimeError("request too large")
+
+        with self.assertLogs(level="ERROR") as logs:
+            exporter.export(make_spans({"a": "1"}))
+
+        self.assertIn("request too large", logs.output[0])
+
+    def test_large_attributes_are_uploaded_in_background(self) -> None:
+        """Tests that the exporter neither waits for GCS nor re-checks the bucket."""
+        uploading = threading.Event()
+        release = threading.Event()
+        uploaded = []
+
+        def upload(content: bytes, content_type: str) -> None:
+            uploaded.append(json.loads(gzip.decompress(content)))
+            uploading.set()
+            release.wait(5)
+
+        self.bucket.blob.return_value.upload_from_string.side_effect = upload
+        spans = make_spans({"big": "x" * 300 * 1024}, {"big": "y" * 300 * 1024})
+        exporter = self._exporter()
+
+        exporter.export(spans)
+        self.assertTrue(uploading.wait(5))
+        release.set()
+        exporter.shutdown()
+
+        batch = self.logging_client.logger.return_value.batch.return_value
+        logged = batch.log_struct.call_args_list[1].args[0]
+        self.assertEqual(
+            logged["attributes"]["uri_payload"],
+            f"gs://test-project-retro-righter-logs-data/spans/{logged['span_id']}.json",
+        )
+        self.assertEqual(logged["attributes"]["offloaded_attributes"], ["big"])
+        self.assertTrue(logged["attributes"]["big"].startswith("x" * 512 + "..."))
+        self.assertLess(len(logged["attributes"]["big"]), 600)
+        self.bucket.exists.assert_called_once()
+        self.assertEqual(self.bucket.blob.return_value.content_encoding, "gzip")
+        self.assertCountEqual(
+            uploaded, [{"big": "x" * 300 * 1024}, {"big": "y" * 300 * 1024}]
+        )
+
+    def test_only_largest_attributes_are_offloaded(self) -> None:
+        attributes = {
+            "prompt": "p" * 150 * 1024,
+            "response": "r" * 120 * 1024,
+            "model": "gemini",
+            "tokens": 12,
+        }
+        exporter = self._exporter()
+        exporter.export(make_spans(attributes))
+        exporter.shutdown()
+
+        batch = self.logging_client.logger.return_value.batch.return_value
+        logged = batch.log_struct.call_args_list[1].args[0]["attributes"]
+        self.assertEqual(logged["offloaded_attributes"], ["prompt"])
+        self.assertEqual(logged["response"], attributes["response"])
+        self.assertEqual((logged["model"], logged["tokens"]), ("gemini", 12))
+        content = self.bucket.blob.return_value.upload_from_string.call_args.args[0]
+        self.assertEqual(
+            json.loads(gzip.decompress(content)), {"prompt": attributes["prompt"]}
+        )
+
+    def test_full_queue_uploads_in_exporter_thread(self) -> None:
+        exporter = self._exporter(max_pending_uploads=0)
+        exporter.export(make_spans({"big": "x" * 300 * 1024}))
+        self.bucket.blob.return_value.upload_from_string.assert_called_once()
+
+    def test_missing_bucket_is_not_looked_up_per_span(self) -> None:
+        self.bucket.exists.return_value = False
+        exporter = self._exporter()
+        exporter.export(
+            make_spans({"big": "x" * 300 * 1024}, {"big": "y" * 300 * 1024})
+        )
+
+        batch = self.logging_client.logger.return_value.batch.return_value
+        logged = batch.log_struct.call_args_list[1].args[0]
+        self.assertEqual(logged["attributes"]["uri_payload"], "GCS bucket not found")
+        self.bucket.exists.assert_called_once()
+        self.bucket.blob.return_value.upload_from_string.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
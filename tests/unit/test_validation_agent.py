@@ -0,0 +1,93 @@
+import os
+import unittest
+from collections.abc import AsyncGenerator
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+
+from app.sub_agents.validation_agent.agent import VALID_CODE_MESSAGE, ValidationAgent
+from app.utils import bas2tap
+from app.utils.bas2tap import Compilation, compilation_cache
+
+
+class FallbackAgent(BaseAgent):
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        yield Event(
+            author=self.name,
+            invocation_id=ctx.invocation_id,
+            content=types.Content(role="model", parts=[types.Part(text="fallback")]),
+        )
+
+
+@patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+class TestValidationAgent(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        compilation_cache.clear()
+
+    async def _run(self, current_code: str) -> tuple[list[Any], dict[str, Any]]:
+        agent = ValidationAgent(
+            name="validation_agent", sub_agents=[FallbackAgent(name="fallback")]
+        )
+        runner = InMemoryRunner(agent=agent, app_name="test")
+        session = await runner.session_service.create_session(
+            app_name="test", user_id="user", state={"current_code": current_code}
+        )
+        events = [
+            event
+            async for event in runner.run_async(
+                user_id="user",
+                session_id=session.id,
+                new_message=types.Content(role="user", parts=[types.Part(text="go")]),
+            )
+        ]
+        session = await runner.session_service.get_session(
+            app_name="test", user_id="user", session_id=session.id
+        )
+        return events, session.state
+
+    async def test_clean_code_escalates(self) -> None:
+        """Tests that valid code exits the loop and keeps its TAP file."""
+        events, state = await self._run("10 PRINT 1\n")
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].actions.escalate)
+        self.assertEqual(events[0].content.parts[0].text, VALID_CODE_MESSAGE)
+        self.assertEqual(state["validation_errors"], [])
+        self.assertIsNotNone(bas2tap.load_tap(state, "10 PRINT 1\n"))
+
+    async def test_errors_are_structured(self) -> None:
+        """Tests that bas2tap errors are parsed for the debugging agent."""
+        events, state = await self._run("10 PRINT 1\n20 PRNT 2\n")
+        self.assertFalse(events[0].actions.escalate)
+        self.assertEqual(
+            state["validation_errors"],
+            [
+                {
+                    "line": 20,
+                    "statement": 1,
+                    "message": 'ERROR in line 20, statement 1 - Expected keyword but got "P"',
+                }
+            ],
+        )
+
+    @patch("app.utils.bas2tap.compile_listing_async")
+    async def test_ambiguous_output_falls_back_to_llm(
+        self, mock_compile_listing: MagicMock
+    ) -> None:
+        """Tests that output which cannot be parsed is left to the LLM agent."""
+        mock_compile_listing.return_value = Compilation(
+            stdout="", stderr="Segmentation fault\n", returncode=139, tap=b""
+        )
+        events, state = await self._run("10 PRINT 1\n")
+        self.assertEqual([event.author for event in events], ["fallback"])
+        self.assertNotIn("validation_errors", state)
+
+
+if __name__ == "__main__":
+    unittest.main()
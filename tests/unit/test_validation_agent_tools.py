@@ -1,76 +1,191 @@
+import asyncio
+import os
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
+
 from app.sub_agents.validation_agent.tools import validate_spectrum_code
+from app.utils import bas2tap, spectrum_basic
+from app.utils.bas2tap import compilation_cache
+
+
+def create_mock_process(
+    returncode: int = 0, stdout: bytes = b"", stderr: bytes = b""
+) -> MagicMock:
+    mock_process = MagicMock()
+    mock_process.returncode = returncode
+    mock_process.communicate = AsyncMock(return_value=(stdout, stderr))
+    mock_process.wait = AsyncMock(return_value=returncode)
+    return mock_process
+
 
+@patch.dict(os.environ, {"BAS2TAP_BACKEND": "subprocess"})
+class TestValidateSpectrumCode(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        compilation_cache.clear()
 
-class TestValidateSpectrumCode(unittest.TestCase):
-    @patch("subprocess.run")
-    def test_successful_execution(self, mock_subprocess_run):
+    @patch("asyncio.create_subprocess_exec")
+    async def test_successful_execution(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
         """Tests successful execution of bas2tap."""
-        mock_process = MagicMock()
-        mock_process.returncode = 0
-        mock_process.stdout = "success"
-        mock_process.stderr = ""
-        mock_subprocess_run.return_value = mock_process
+        mock_create_subprocess_exec.return_value = create_mock_process(
+            stdout=b"success"
+        )
 
-        result = validate_spectrum_code('10 PRINT "hello"')
+        result = await validate_spectrum_code('10 PRINT "hello"')
         self.assertIn("--- stdout ---", result)
         self.assertIn("success", result)
         self.assertNotIn("--- stderr ---", result)
-        mock_subprocess_run.assert_called_once()
+        mock_create_subprocess_exec.assert_called_once()
 
-    @patch("subprocess.run")
-    def test_execution_with_error(self, mock_subprocess_run):
+    @patch("asyncio.create_subprocess_exec")
+    async def test_execution_with_error(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
         """Tests execution of bas2tap with an error."""
-        mock_process = MagicMock()
-        mock_process.returncode = 1
-        mock_process.stdout = ""
-        mock_process.stderr = "error"
-        mock_subprocess_run.return_value = mock_process
+        mock_create_subprocess_exec.return_value = create_mock_process(
+            returncode=1, stderr=b"error"
+        )
 
-        result = validate_spectrum_code('10 PRNT "hello"')
+        result = await validate_spectrum_code('10 PRNT "hello"')
         self.assertIn("--- stderr ---", result)
         self.assertIn("error", result)
         self.assertIn("non-zero status: 1", result)
-        mock_subprocess_run.assert_called_once()
+        mock_create_subprocess_exec.assert_called_once()
 
-    @patch("subprocess.run", side_effect=FileNotFoundError("bas2tap not found"))
-    def test_bas2tap_not_found(self, mock_subprocess_run):
+    @patch(
+        "asyncio.create_subprocess_exec",
+        side_effect=FileNotFoundError("bas2tap not found"),
+    )
+    async def test_bas2tap_not_found(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
         """Tests that FileNotFoundError is raised if bas2tap is not found."""
         with self.assertRaises(FileNotFoundError):
-            validate_spectrum_code('10 PRINT "hello"')
-
-    @patch("os.path.exists")
-    @patch("os.remove")
-    def test_temp_files_are_cleaned_up_on_success(
-        self, mock_os_remove, mock_os_path_exists
-    ):
-        """Tests that temporary files are cleaned up on success."""
-        mock_os_path_exists.return_value = True
-        with patch("subprocess.run") as mock_subprocess_run:
-            mock_process = MagicMock()
-            mock_process.returncode = 0
-            mock_subprocess_run.return_value = mock_process
-
-            validate_spectrum_code('10 PRINT "hello"')
-
-            self.assertEqual(mock_os_remove.call_count, 2)
-
-    @patch("os.path.exists")
-    @patch("os.remove")
-    def test_temp_files_are_cleaned_up_on_error(
-        self, mock_os_remove, mock_os_path_exists
-    ):
-        """Tests that temporary files are cleaned up on error."""
-        mock_os_path_exists.return_value = True
-        with patch("subprocess.run") as mock_subprocess_run:
-            mock_process = MagicMock()
-            mock_process.returncode = 1
-            mock_subprocess_run.return_value = mock_process
-
-            validate_spectrum_code('10 PRINT "hello"')
-
-            self.assertEqual(mock_os_remove.call_count, 2)
+            await validate_spectrum_code('10 PRINT "hello"')
+
+    @patch("asyncio.create_subprocess_exec")
+    async def test_timeout_kills_bas2tap(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
+        """Tests that a hung bas2tap is killed once the timeout expires."""
+        mock_process = create_mock_process()
+
+        async def hang() -> None:
+            await asyncio.sleep(10)
+
+        mock_process.communicate = hang
+        mock_create_subprocess_exec.return_value = mock_process
+
+        with patch.dict(os.environ, {"BAS2TAP_TIMEOUT": "0.01"}):
+            with self.assertRaises(TimeoutError):
+                await validate_spectrum_code('10 PRINT "hello"')
+        mock_process.kill.assert_called_once()
+        self.assertEqual(len(compilation_cache), 0)
+
+    @patch("asyncio.create_subprocess_exec")
+    async def test_scratch_files_are_reused(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
+        """Tests that workers reuse their scratch files instead of temp files."""
+        mock_create_subprocess_exec.return_value = create_mock_process()
+
+        with patch("tempfile.NamedTemporaryFile") as mock_named_temporary_file:
+            await validate_spectrum_code("10 PRINT 1")
+            await validate_spectrum_code("10 PRINT 2")
+            mock_named_temporary_file.assert_not_called()
+
+        first, second = mock_create_subprocess_exec.call_args_list
+        self.assertEqual(first.args, second.args)
+        pool = bas2tap.worker_pool()
+        self.assertTrue(first.args[1].startswith(pool.scratch_dir))
+        with open(first.args[1], encoding="utf-8") as f:
+            self.assertEqual(f.read(), "10 PRINT 2\n")
+
+    @patch("asyncio.create_subprocess_exec")
+    async def test_pool_metrics(self, mock_create_subprocess_exec: MagicMock) -> None:
+        """Tests that the worker pool reports its load and latency."""
+        mock_create_subprocess_exec.return_value = create_mock_process()
+
+        await asyncio.gather(
+            *(validate_spectrum_code(f"10 PRINT {i}") for i in range(6))
+        )
+
+        metrics = bas2tap.worker_pool().metrics()
+        self.assertEqual(metrics["completed"], 6)
+        self.assertEqual(metrics["busy"], 0)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertGreater(metrics["latency_p95_ms"], 0)
+
+
+@patch.dict(os.environ, {"BAS2TAP_BACKEND": "native"})
+class TestValidateSpectrumCodeNative(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        compilation_cache.clear()
+
+    @patch("asyncio.create_subprocess_exec")
+    async def test_valid_code_does_not_run_bas2tap(
+        self, mock_create_subprocess_exec: MagicMock
+    ) -> None:
+        """Tests that the native backend validates without a subprocess."""
+        result = await validate_spectrum_code('10 PRINT "hello"\n20 GO TO 10\n')
+        self.assertIn("--- stdout ---", result)
+        self.assertIn("Done! Listing contains 2 lines.", result)
+        self.assertNotIn("--- stderr ---", result)
+        self.assertNotIn("\r", result)
+        mock_create_subprocess_exec.assert_not_called()
+
+    async def test_syntax_error_is_reported_on_stderr(self) -> None:
+        """Tests that syntax errors use the same wording as bas2tap."""
+        result = await validate_spectrum_code('10 PRNT "hello"\n')
+        self.assertIn("--- stderr ---", result)
+        self.assertIn(
+            'ERROR in line 10, statement 1 - Expected keyword but got "P"', result
+        )
+        self.assertNotIn("non-zero status", result)
+
+    @patch("app.utils.spectrum_basic.convert", wraps=spectrum_basic.convert)
+    async def test_repeated_code_is_served_from_cache(
+        self, mock_convert: MagicMock
+    ) -> None:
+        """Tests that the same listing is only compiled once."""
+        first = await validate_spectrum_code('10 PRINT "hello"\n')
+        second = await validate_spectrum_code('10 PRINT "hello"\r\n')
+        self.assertEqual(first, second)
+        mock_convert.assert_called_once()
+        self.assertEqual(compilation_cache.hits, 1)
+        self.assertEqual(compilation_cache.misses, 1)
+
+    async def test_metrics_come_from_native_counters_without_a_pool(self) -> None:
+        """Tests that reporting metrics does not start a worker pool."""
+        completed = bas2tap.native_compilations.completed
+
+        await asyncio.gather(
+            *(validate_spectrum_code(f"10 PRINT {i}") for i in range(3))
+        )
+
+        metrics = bas2tap.worker_metrics()
+        self.assertEqual(metrics["completed"], completed + 3)
+        self.assertEqual(metrics["busy"], 0)
+        self.assertNotIn(asyncio.get_running_loop(), bas2tap._pools)
+
+    async def test_valid_code_keeps_tap_file_in_state(self) -> None:
+        """Tests that a clean validation leaves the TAP file for publishing."""
+        tool_context = MagicMock()
+        tool_context.state = {}
+        await validate_spectrum_code("10 PRINT 1\n", tool_context)
+        self.assertEqual(
+            bas2tap.load_tap(tool_context.state, "10 PRINT 1\n"),
+            bas2tap.compile_listing("10 PRINT 1\n").tap,
+        )
+        self.assertIsNone(bas2tap.load_tap(tool_context.state, "10 PRINT 2\n"))
+
+    async def test_invalid_code_does_not_keep_tap_file(self) -> None:
+        """Tests that no TAP file is kept when validation fails."""
+        tool_context = MagicMock()
+        tool_context.state = {}
+        await validate_spectrum_code("10 PRNT 1\n", tool_context)
+        self.assertNotIn("tap_file_b64", tool_context.state)
 
 
 if __name__ == "__main__":